@@ -1,14 +1,106 @@
-from fastapi import FastAPI, HTTPException, Depends
+import functools
+import inspect
+import math
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional, Tuple
 from datetime import datetime
 from decimal import Decimal
+import orjson
 from sqlalchemy.orm import Session
-
-from database import init_db, User, Account, Transaction, TransactionType, Category
-
-app = FastAPI(title="Finance Tracker API")
+from dotenv import load_dotenv
+
+# Настройки из .env, как у бота: webhook.py, scheduler.py и другие модули ниже читают окружение при импорте
+load_dotenv()
+
+from database import init_db, get_or_create_user, run_in_session, pool_stats, bump_data_version, get_data_version, Account, Transaction, TransactionType, Category, RecurringRule, ArchivedRollup
+from stats import compute_analytics
+from reports import stats_body
+from listing import list_transactions, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from serialization import FastJSONResponse, dumps
+from export import stream_export
+from categories import resolve_categories
+from schemas import (
+    AccountCreate, AccountUpdate, AccountResponse,
+    TransactionCreate, TransactionUpdate, TransactionPage,
+    CategoryCreate, CategoryUpdate, CategoryResponse,
+    RecurringRuleCreate, RecurringRuleResponse,
+    BulkTransactionCreate, BulkImportResponse, ChangeSet
+)
+from importer import import_transactions
+from recorder import AccountNotFound, record_transaction
+from rollups import NO_ACCOUNT, NO_CATEGORY, apply_transaction, reassign as reassign_rollups, rebuild as rebuild_rollups
+from cache import create_cache, user_key
+from metrics import CONTENT_TYPE, MetricsMiddleware, register_cache, registry
+from changes import collect_changes, record_deletion
+from ledger import ADJUSTMENT, CLOSING, OPENING, lock_account, post, post_transaction
+from scheduler import SCHEDULER_INTERVAL, Scheduler
+from throttling import SingleFlight, create_limiter, throttled_requests_total
+from webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_SECRET, TelegramWebhook, check_secret, register_webhook, webhook_updates_total
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if telegram_webhook is not None:
+        await telegram_webhook.start()
+    if scheduler is not None:
+        scheduler.start()
+    yield
+    if scheduler is not None:
+        await scheduler.stop()
+    if telegram_webhook is not None:
+        await telegram_webhook.stop()
+
+# Ограничение частоты запросов пользователя (throttling.py); служебные адреса не ограничиваются.
+# Бот в режиме webhook получает тот же ограничитель: ключ — telegram_id и там, и здесь
+rate_limiter = create_limiter()
+UNLIMITED_PATHS = {"/metrics", "/api/pool", WEBHOOK_PATH}
+
+def check_rate_limit(user_id: int):
+    """Взять токен пользователя; 429 с Retry-After, если лимит исчерпан"""
+    retry_after = rate_limiter.acquire(user_id)
+    if retry_after is not None:
+        throttled_requests_total.inc("api")
+        raise HTTPException(
+            status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+async def request_user_id(request: Request) -> Optional[int]:
+    """Пользователь запроса из пути (telegram_id, user_id) или из поля user_id тела POST"""
+    user_id = request.path_params.get("telegram_id", request.path_params.get("user_id"))
+    if user_id is None and request.method == "POST":
+        # Тело уже прочитано FastAPI и закэшировано в Request, повторного чтения нет
+        try:
+            body = orjson.loads(await request.body())
+        except orjson.JSONDecodeError:
+            return None
+        if isinstance(body, dict) and isinstance(body.get("transactions"), list) and body["transactions"]:
+            body = body["transactions"][0]
+        user_id = body.get("user_id") if isinstance(body, dict) else None
+    try:
+        return int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+async def rate_limit(request: Request):
+    """Ограничение частоты для всех маршрутов API.
+
+    Записи по id строки (PUT и DELETE) не знают пользователя до запроса к
+    БД: их ограничивает begin_write, когда прочитает владельца строки.
+    """
+    if not rate_limiter.enabled or request.url.path in UNLIMITED_PATHS:
+        return
+    user_id = await request_user_id(request)
+    if user_id is not None:
+        check_rate_limit(user_id)
+
+# Ответы без response_model сериализуются orjson (serialization.py), минуя jsonable_encoder
+app = FastAPI(
+    title="Finance Tracker API", lifespan=lifespan, default_response_class=FastJSONResponse,
+    dependencies=[Depends(rate_limit)]
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,289 +109,596 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 SessionLocal = init_db()
+user_cache = create_cache()
+register_cache("user", user_cache)
+
+# Одновременные одинаковые чтения данных пользователя и статистики идут в БД один раз
+user_data_reads = SingleFlight("user_data")
+stats_reads = SingleFlight("stats")
+
+# С BOT_WEBHOOK_SECRET бот работает в этом же процессе (webhook.py): init_db и
+# create_cache отдают боту те же движок БД и кэш, что и API
+telegram_webhook = None
+if WEBHOOK_SECRET:
+    import bot
+    telegram_webhook = TelegramWebhook(bot.build_application(webhook=True), workers=bot.CONCURRENT_UPDATES)
+    register_webhook(telegram_webhook)
+
+# Регулярные операции и пересчёт отчётов (scheduler.py); SCHEDULER_INTERVAL=0 выключает
+scheduler = Scheduler(
+    SessionLocal, on_commit=lambda user_ids: [invalidate_user_data(user_id) for user_id in user_ids]
+) if SCHEDULER_INTERVAL > 0 else None
+
+# Браузер может хранить ответы, но обязан перепроверять их по ETag
+CACHE_CONTROL = "private, no-cache"
+
+# Колонки счетов и категорий в данных пользователя (/api/user)
+ACCOUNT_COLUMNS = (Account.id, Account.user_id, Account.name, Account.balance, Account.created_at, Account.version)
+CATEGORY_COLUMNS = (
+    Category.id, Category.user_id, Category.key, Category.name, Category.icon, Category.type,
+    Category.created_at, Category.version
+)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-class AccountCreate(BaseModel):
-    user_id: int
-    name: str
-    balance: Decimal = Decimal("0.00")
-
-class AccountUpdate(BaseModel):
-    name: Optional[str] = None
-    balance: Optional[Decimal] = None
-
-class TransactionCreate(BaseModel):
-    user_id: int
-    account_id: int
-    type: str
-    amount: Decimal
-    category: str
-    description: Optional[str] = ""
-
-class TransactionUpdate(BaseModel):
-    amount: Optional[Decimal] = None
-    category: Optional[str] = None
-    description: Optional[str] = None
-    account_id: Optional[int] = None
-
-class CategoryCreate(BaseModel):
-    user_id: int
-    name: str
-    icon: str = '📝'
-    type: str
-
-class CategoryResponse(BaseModel):
-    id: int
-    name: str
-    icon: str
-    type: str
-
-    class Config:
-        from_attributes = True
-
-class AccountResponse(BaseModel):
-    id: int
-    name: str
-    balance: Decimal
-
-    class Config:
-        from_attributes = True
-
-class TransactionResponse(BaseModel):
-    id: int
-    type: str
-    amount: Decimal
-    category: str
-    description: Optional[str]
-    account_id: int
-    created_at: datetime
-
-    class Config:
-        from_attributes = True
-
-@app.get("/api/user/{telegram_id}")
-async def get_user_data(telegram_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        # Создаём нового пользователя с основным счётом
-        user = User(telegram_id=telegram_id)
-        db.add(user)
-
-        default_account = Account(user_id=telegram_id, name="Основной", balance=0.00)
-        db.add(default_account)
-        db.commit()
-        db.refresh(user)
-
-    accounts = db.query(Account).filter(Account.user_id == telegram_id).all()
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == telegram_id
-    ).order_by(Transaction.created_at.desc()).limit(50).all()
-    categories = db.query(Category).filter(Category.user_id == telegram_id).all()
-
-    return {
+def with_session(handler):
+    """Запускать синхронный обработчик в пуле потоков с собственной сессией БД.
+
+    Обработчик получает сессию первым аргументом db. Запросы к БД не блокируют
+    event loop, а сессия закрывается в том же потоке ещё до сериализации
+    ответа, так что соединение из пула не удерживается дольше запроса.
+    """
+    params = list(inspect.signature(handler).parameters.values())[1:]
+
+    @functools.wraps(handler)
+    async def endpoint(**kwargs):
+        return await run_in_session(SessionLocal, handler, **kwargs)
+
+    endpoint.__signature__ = inspect.Signature(params)
+    return endpoint
+
+def invalidate_user_data(user_id: int):
+    """Сбросить кэш данных пользователя после записи"""
+    user_cache.invalidate(user_key(user_id))
+
+def begin_write(db: Session, model, row_id: int, not_found: str):
+    """Начать запись строки model пользователя: (строка, новая версия данных).
+
+    bump_data_version блокирует строку пользователя (в SQLite — базу на
+    запись) до коммита, так что записи одного пользователя выполняются по
+    очереди. Строка перечитывается уже под этой блокировкой: баланс и сумма
+    операции не берутся из копии, которую успел изменить параллельный запрос.
+    """
+    user_id = db.query(model.user_id).filter(model.id == row_id).scalar()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    # Здесь впервые известен пользователь записи по id строки (см. rate_limit)
+    check_rate_limit(user_id)
+    version = bump_data_version(db, user_id)
+    row = db.query(model).filter(model.id == row_id).populate_existing().first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    return row, version
+
+def write_result(db: Session, user_id: int, version: int, since: Optional[int]) -> dict:
+    """Ответ на запись: изменения после версии клиента since.
+
+    Без since отдаются ровно строки этой записи (версия version), даже если
+    параллельно успели пройти другие. Если клиент передаёт версию своих
+    данных, в ответ попадут и чужие записи после неё — например, сделанные
+    ботом, — и полная перезагрузка не понадобится.
+    """
+    if since is None:
+        return collect_changes(db, user_id, version - 1, until=version)
+    return collect_changes(db, user_id, since)
+
+def make_etag(user_id: int, version: int) -> str:
+    return f'W/"{user_id}-{version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+def fast_response(content, response: Response) -> FastJSONResponse:
+    """Ответ чтения сразу через orjson, без проверки схемой response_model.
+
+    Схема остаётся в объявлении маршрута для документации; заголовки
+    (ETag и т.п.), выставленные на response, переносятся в ответ.
+    """
+    return FastJSONResponse(content, headers=dict(response.headers))
+
+def check_etag(db: Session, user_id: int, request: Request, response: Response) -> Optional[Response]:
+    """Проставить ETag по версии данных пользователя.
+
+    Возвращает ответ 304, если у клиента уже актуальная версия, — тогда
+    основные запросы обработчика можно не выполнять.
+    """
+    etag = make_etag(user_id, get_data_version(db, user_id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return None
+
+def load_user_data(db: Session, telegram_id: int, request: Request) -> Tuple[int, Optional[bytes]]:
+    """Версия и данные пользователя в JSON; данные None, если клиенту подходит его копия"""
+    # Создаём нового пользователя с основным счётом при первом обращении.
+    # Версия читается до данных: при параллельной записи данные могут оказаться
+    # новее версии (клиент просто перечитает их), но не наоборот.
+    user = get_or_create_user(db, telegram_id)
+    version = user.data_version
+    if etag_matches(request, make_etag(telegram_id, version)):
+        return version, None
+
+    accounts = db.query(*ACCOUNT_COLUMNS).filter(Account.user_id == telegram_id).all()
+    transactions, next_cursor = list_transactions(db, telegram_id)
+    categories = db.query(*CATEGORY_COLUMNS).filter(Category.user_id == telegram_id).all()
+
+    return version, dumps({
         "user": {
             "telegram_id": user.telegram_id,
             "currency": user.currency
         },
-        "accounts": accounts,
+        # С этой версии клиент запрашивает /changes и передаёт её в since при записи
+        "data_version": version,
+        "accounts": [row._asdict() for row in accounts],
         "transactions": transactions,
-        "categories": categories
-    }
+        "transactions_next_cursor": next_cursor,
+        "categories": [row._asdict() for row in categories]
+    })
+
+async def fetch_user_data(telegram_id: int, request: Request, generation: int) -> dict:
+    """Загрузить данные пользователя и положить в кэш; body None, если клиенту подходит его копия"""
+    key = user_key(telegram_id)
+    version, body = await run_in_session(SessionLocal, load_user_data, telegram_id, request)
+    if body is None:
+        return {"version": version, "body": None}
+    # В кэше готовый JSON строкой: повторная загрузка не сериализует данные заново
+    cached = {"version": version, "body": body.decode()}
+    user_cache.set(key, cached, generation)
+    return cached
 
-@app.post("/api/accounts", response_model=AccountResponse)
-async def create_account(account: AccountCreate, db: Session = Depends(get_db)):
+@app.get("/api/user/{telegram_id}")
+async def get_user_data(telegram_id: int, request: Request):
+    # Веб-приложение перечитывает эти данные после каждого действия;
+    # повторные загрузки без изменений отдаются из кэша, не трогая БД
+    key = user_key(telegram_id)
+    cached = user_cache.get(key)
+    if cached is None:
+        # Одновременные загрузки с тем же If-None-Match ждут одну. Поколение кэша в
+        # ключе: чтение, пришедшее после записи, не присоединится к начатому до неё
+        generation = user_cache.generation(key)
+        cached = await user_data_reads.do(
+            (telegram_id, generation, request.headers.get("if-none-match")),
+            lambda: fetch_user_data(telegram_id, request, generation)
+        )
+        if cached["body"] is None:
+            return not_modified(make_etag(telegram_id, cached["version"]))
+
+    etag = make_etag(telegram_id, cached["version"])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return Response(cached["body"], media_type="application/json", headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+@app.get("/api/user/{telegram_id}/changes", response_model=ChangeSet)
+@with_session
+def get_user_changes(db: Session, telegram_id: int, since: int = Query(..., ge=0)):
+    # Инкрементальная синхронизация: только строки, изменённые после версии since
+    return collect_changes(db, telegram_id, since)
+
+@app.post("/api/accounts", response_model=ChangeSet)
+@with_session
+def create_account(db: Session, account: AccountCreate, since: Optional[int] = None):
+    version = bump_data_version(db, account.user_id)
     db_account = Account(
         user_id=account.user_id,
         name=account.name,
-        balance=account.balance
+        balance=Decimal("0.00"),
+        version=version
     )
     db.add(db_account)
+    db.flush()
+    if account.balance:
+        post(db, account.user_id, db_account.id, account.balance, OPENING, version)
     db.commit()
-    db.refresh(db_account)
-    return db_account
+    invalidate_user_data(account.user_id)
+    return write_result(db, account.user_id, version, since)
 
-@app.put("/api/accounts/{account_id}", response_model=AccountResponse)
-async def update_account(account_id: int, account_update: AccountUpdate, db: Session = Depends(get_db)):
-    account = db.query(Account).filter(Account.id == account_id).first()
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
+@app.put("/api/accounts/{account_id}", response_model=ChangeSet)
+@with_session
+def update_account(db: Session, account_id: int, account_update: AccountUpdate, since: Optional[int] = None):
+    _, version = begin_write(db, Account, account_id, "Account not found")
+    # Новый баланс проводится разницей с текущим, поэтому читаем его под блокировкой строки
+    account = lock_account(db, account_id)
 
     if account_update.name is not None:
         account.name = account_update.name
-    if account_update.balance is not None:
-        account.balance = account_update.balance
+    account.version = version
+    if account_update.balance is not None and account_update.balance != account.balance:
+        post(db, account.user_id, account_id, account_update.balance - account.balance, ADJUSTMENT, version)
 
+    user_id = account.user_id
     db.commit()
-    db.refresh(account)
-    return account
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
 
 @app.get("/api/accounts/{user_id}", response_model=List[AccountResponse])
-async def get_accounts(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Account).filter(Account.user_id == user_id).all()
-
-@app.delete("/api/accounts/{account_id}")
-async def delete_account(account_id: int, db: Session = Depends(get_db)):
-    account = db.query(Account).filter(Account.id == account_id).first()
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
-
+@with_session
+def get_accounts(db: Session, user_id: int, request: Request, response: Response):
+    unchanged = check_etag(db, user_id, request, response)
+    if unchanged:
+        return unchanged
+    accounts = db.query(Account.id, Account.name, Account.balance).filter(Account.user_id == user_id).all()
+    return fast_response([row._asdict() for row in accounts], response)
+
+@app.delete("/api/accounts/{account_id}", response_model=ChangeSet)
+@with_session
+def delete_account(db: Session, account_id: int, since: Optional[int] = None):
+    _, version = begin_write(db, Account, account_id, "Account not found")
+    account = lock_account(db, account_id)
+
+    user_id = account.user_id
+    if account.balance:
+        post(db, user_id, account_id, -account.balance, CLOSING, version)
+    # Операции удалённого счёта остаются без счёта: отвязываем их явно,
+    # чтобы они получили новую версию, и пересобираем сводку пользователя
+    db.query(Transaction).filter(Transaction.account_id == account_id).update(
+        {Transaction.account_id: None, Transaction.version: version}, synchronize_session=False
+    )
+    # Регулярным операциям счёта больше некуда записываться
+    db.query(RecurringRule).filter(RecurringRule.account_id == account_id).update(
+        {RecurringRule.account_id: None, RecurringRule.active: False}, synchronize_session=False
+    )
+    # Итоги заархивированных операций счёта переходят в строку «без счёта»
+    db.query(ArchivedRollup).filter(ArchivedRollup.account_id == account_id).update(
+        {ArchivedRollup.account_id: NO_ACCOUNT}, synchronize_session=False
+    )
     db.delete(account)
+    record_deletion(db, user_id, "accounts", account_id, version)
+    db.flush()
+    rebuild_rollups(db, user_id)
     db.commit()
-    return {"message": "Account deleted"}
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
 
-@app.post("/api/transactions", response_model=TransactionResponse)
-async def create_transaction(transaction: TransactionCreate, db: Session = Depends(get_db)):
-    account = db.query(Account).filter(
-        Account.id == transaction.account_id,
-        Account.user_id == transaction.user_id
-    ).first()
-
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
-
-    db_transaction = Transaction(
-        user_id=transaction.user_id,
-        account_id=transaction.account_id,
-        type=TransactionType(transaction.type),
-        amount=transaction.amount,
-        category=transaction.category,
-        description=transaction.description
+@app.post("/api/transactions", response_model=ChangeSet)
+@with_session
+def create_transaction(db: Session, transaction: TransactionCreate, since: Optional[int] = None):
+    try:
+        recorded = record_transaction(db, transaction)
+    except AccountNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    invalidate_user_data(transaction.user_id)
+    return write_result(db, transaction.user_id, recorded["version"], since)
+
+@app.post("/api/transactions/bulk", response_model=BulkImportResponse)
+@with_session
+def bulk_create_transactions(db: Session, payload: BulkTransactionCreate, since: Optional[int] = None):
+    user_ids = {t.user_id for t in payload.transactions}
+    if len(user_ids) > 1:
+        raise HTTPException(status_code=400, detail="All transactions must belong to one user")
+    try:
+        versions = import_transactions(db, payload.transactions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result = {"imported": len(payload.transactions), "data_version": 0}
+    for user_id, version in versions.items():
+        invalidate_user_data(user_id)
+        result.update(write_result(db, user_id, version, since))
+    return result
+
+@app.put("/api/transactions/{transaction_id}", response_model=ChangeSet)
+@with_session
+def update_transaction(db: Session, transaction_id: int, transaction_update: TransactionUpdate, since: Optional[int] = None):
+    transaction, version = begin_write(db, Transaction, transaction_id, "Transaction not found")
+    user_id = transaction.user_id
+
+    new_account_id = transaction_update.account_id
+    if new_account_id is not None and new_account_id != transaction.account_id:
+        owner = db.query(Account.user_id).filter(Account.id == new_account_id).scalar()
+        if owner != user_id:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+    moves_money = (
+        (transaction_update.amount is not None and transaction_update.amount != transaction.amount)
+        or (new_account_id is not None and new_account_id != transaction.account_id)
     )
 
-    if transaction.type == "expense":
-        account.balance -= transaction.amount
-    else:
-        account.balance += transaction.amount
-
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
-
-@app.put("/api/transactions/{transaction_id}", response_model=TransactionResponse)
-async def update_transaction(transaction_id: int, transaction_update: TransactionUpdate, db: Session = Depends(get_db)):
-    transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-
-    # Если меняем сумму или тип, корректируем баланс счёта
-    if transaction_update.amount is not None and transaction_update.amount != transaction.amount:
-        old_amount = float(transaction.amount)
-        new_amount = float(transaction_update.amount)
-        diff = new_amount - old_amount
-
-        account = db.query(Account).filter(Account.id == transaction.account_id).first()
-        if account:
-            if transaction.type == "expense":
-                account.balance = float(account.balance) - diff
-            else:
-                account.balance = float(account.balance) + diff
-
-    if transaction_update.account_id is not None and transaction_update.account_id != transaction.account_id:
-        # Старый счёт
-        old_account = db.query(Account).filter(Account.id == transaction.account_id).first()
-        if old_account:
-            if transaction.type == "expense":
-                old_account.balance = float(old_account.balance) + float(transaction.amount)
-            else:
-                old_account.balance = float(old_account.balance) - float(transaction.amount)
-
-        # Новый счёт
-        new_account = db.query(Account).filter(Account.id == transaction_update.account_id).first()
-        if new_account:
-            if transaction.type == "expense":
-                new_account.balance = float(new_account.balance) - float(transaction.amount)
-            else:
-                new_account.balance = float(new_account.balance) + float(transaction.amount)
-
-        transaction.account_id = transaction_update.account_id
+    # Вычитаем операцию из месячной сводки и с баланса в старом виде,
+    # затем проводим в новом
+    apply_transaction(db, transaction, -1)
+    if moves_money:
+        post_transaction(db, transaction, version, sign=-1)
 
+    if new_account_id is not None:
+        transaction.account_id = new_account_id
     if transaction_update.category is not None:
-        transaction.category = transaction_update.category
+        category = resolve_categories(
+            db, user_id, [(transaction.type, transaction_update.category)], version
+        ).get((transaction.type, transaction_update.category))
+        transaction.category_id = category.id if category is not None else None
     if transaction_update.description is not None:
         transaction.description = transaction_update.description
     if transaction_update.amount is not None:
         transaction.amount = transaction_update.amount
+    transaction.version = version
 
+    if moves_money:
+        post_transaction(db, transaction, version)
+    apply_transaction(db, transaction)
     db.commit()
-    db.refresh(transaction)
-    return transaction
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
 
-@app.delete("/api/transactions/{transaction_id}")
-async def delete_transaction(transaction_id: int, db: Session = Depends(get_db)):
-    transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
+@app.delete("/api/transactions/{transaction_id}", response_model=ChangeSet)
+@with_session
+def delete_transaction(db: Session, transaction_id: int, since: Optional[int] = None):
+    transaction, version = begin_write(db, Transaction, transaction_id, "Transaction not found")
 
     # Возвращаем сумму на счёт
-    account = db.query(Account).filter(Account.id == transaction.account_id).first()
-    if account:
-        if transaction.type == "expense":
-            account.balance = float(account.balance) + float(transaction.amount)
-        else:
-            account.balance = float(account.balance) - float(transaction.amount)
-
+    user_id = transaction.user_id
+    post_transaction(db, transaction, version, sign=-1)
+    apply_transaction(db, transaction, -1)
     db.delete(transaction)
+    record_deletion(db, user_id, "transactions", transaction_id, version)
     db.commit()
-    return {"message": "Transaction deleted"}
-
-@app.get("/api/transactions/{user_id}", response_model=List[TransactionResponse])
-async def get_transactions(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Transaction).filter(
-        Transaction.user_id == user_id
-    ).order_by(Transaction.created_at.desc()).all()
-
-@app.post("/api/categories", response_model=CategoryResponse)
-async def create_category(category: CategoryCreate, db: Session = Depends(get_db)):
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
+
+@app.get("/api/transactions/{user_id}", response_model=TransactionPage)
+@with_session
+def get_transactions(
+    db: Session,
+    user_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    type: Optional[TransactionType] = None,
+    category: Optional[str] = None,
+    category_id: Optional[int] = None,
+    account_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    amount_min: Optional[Decimal] = None,
+    amount_max: Optional[Decimal] = None
+):
+    unchanged = check_etag(db, user_id, request, response)
+    if unchanged:
+        return unchanged
+    try:
+        items, next_cursor = list_transactions(
+            db, user_id,
+            cursor=cursor,
+            limit=limit,
+            type=type.value if type else None,
+            category=category,
+            category_id=category_id,
+            account_id=account_id,
+            date_from=date_from,
+            date_to=date_to,
+            amount_min=amount_min,
+            amount_max=amount_max
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return fast_response({"items": items, "next_cursor": next_cursor}, response)
+
+@app.post("/api/categories", response_model=ChangeSet)
+@with_session
+def create_category(db: Session, category: CategoryCreate, since: Optional[int] = None):
+    version = bump_data_version(db, category.user_id)
     db_category = Category(
         user_id=category.user_id,
         name=category.name,
         icon=category.icon,
-        type=TransactionType(category.type)
+        type=TransactionType(category.type),
+        version=version
     )
     db.add(db_category)
     db.commit()
-    db.refresh(db_category)
-    return db_category
+    invalidate_user_data(category.user_id)
+    return write_result(db, category.user_id, version, since)
 
 @app.get("/api/categories/{user_id}", response_model=List[CategoryResponse])
-async def get_categories(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Category).filter(Category.user_id == user_id).all()
-
-@app.delete("/api/categories/{category_id}")
-async def delete_category(category_id: int, db: Session = Depends(get_db)):
-    category = db.query(Category).filter(Category.id == category_id).first()
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
-
+@with_session
+def get_categories(db: Session, user_id: int, request: Request, response: Response):
+    unchanged = check_etag(db, user_id, request, response)
+    if unchanged:
+        return unchanged
+    categories = db.query(Category.id, Category.key, Category.name, Category.icon, Category.type).filter(
+        Category.user_id == user_id
+    ).all()
+    return fast_response([row._asdict() for row in categories], response)
+
+@app.put("/api/categories/{category_id}", response_model=ChangeSet)
+@with_session
+def update_category(db: Session, category_id: int, category_update: CategoryUpdate, since: Optional[int] = None):
+    category, version = begin_write(db, Category, category_id, "Category not found")
+
+    if category_update.name is not None:
+        category.name = category_update.name
+    if category_update.icon is not None:
+        category.icon = category_update.icon
+    category.version = version
+    # Название и значок входят в ответ по операциям, поэтому операции категории
+    # получают новую версию и уходят клиенту вместе с ней
+    db.query(Transaction).filter(Transaction.category_id == category_id).update(
+        {Transaction.version: version}, synchronize_session=False
+    )
+    user_id = category.user_id
+    db.commit()
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
+
+@app.delete("/api/categories/{category_id}", response_model=ChangeSet)
+@with_session
+def delete_category(db: Session, category_id: int, since: Optional[int] = None):
+    category, version = begin_write(db, Category, category_id, "Category not found")
+
+    user_id = category.user_id
+    # Операции удалённой категории остаются без категории, как операции удалённого счёта
+    db.query(Transaction).filter(Transaction.category_id == category_id).update(
+        {Transaction.category_id: None, Transaction.version: version}, synchronize_session=False
+    )
+    db.query(RecurringRule).filter(RecurringRule.category_id == category_id).update(
+        {RecurringRule.category_id: None}, synchronize_session=False
+    )
+    db.query(ArchivedRollup).filter(ArchivedRollup.category_id == category_id).update(
+        {ArchivedRollup.category_id: NO_CATEGORY}, synchronize_session=False
+    )
     db.delete(category)
+    record_deletion(db, user_id, "categories", category_id, version)
+    reassign_rollups(db, user_id, "category_id", category_id, NO_CATEGORY)
     db.commit()
-    return {"message": "Category deleted"}
+    invalidate_user_data(user_id)
+    return write_result(db, user_id, version, since)
+
+@app.post("/api/recurring", response_model=RecurringRuleResponse)
+@with_session
+def create_recurring_rule(db: Session, rule: RecurringRuleCreate):
+    try:
+        type_ = TransactionType(rule.type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Unknown transaction type '{rule.type}'")
+    owner = db.query(Account.user_id).filter(Account.id == rule.account_id).scalar()
+    if owner is None or owner != rule.user_id:
+        raise HTTPException(status_code=404, detail="Account not found")
+    start_at = rule.start_at or datetime.utcnow()
+    if rule.end_at is not None and rule.end_at < start_at:
+        raise HTTPException(status_code=400, detail="end_at is before start_at")
+
+    # Недостающая категория создаётся, как при записи операции
+    version = bump_data_version(db, rule.user_id)
+    category = resolve_categories(db, rule.user_id, [(type_, rule.category)], version).get((type_, rule.category))
+    db_rule = RecurringRule(
+        user_id=rule.user_id,
+        account_id=rule.account_id,
+        type=type_,
+        amount=rule.amount,
+        category_ref=category,
+        description=rule.description,
+        period=rule.period,
+        interval=rule.interval,
+        start_at=start_at,
+        end_at=rule.end_at,
+        next_run_at=start_at
+    )
+    db.add(db_rule)
+    db.commit()
+    invalidate_user_data(rule.user_id)
+    # Сессия закрывается до сериализации ответа, поэтому схема заполняется здесь
+    return RecurringRuleResponse.model_validate(db_rule)
+
+@app.get("/api/recurring/{user_id}", response_model=List[RecurringRuleResponse])
+@with_session
+def get_recurring_rules(db: Session, user_id: int):
+    rules = db.query(RecurringRule).filter(RecurringRule.user_id == user_id).order_by(RecurringRule.id)
+    return [RecurringRuleResponse.model_validate(rule) for rule in rules]
+
+@app.delete("/api/recurring/{rule_id}", status_code=204)
+@with_session
+def delete_recurring_rule(db: Session, rule_id: int):
+    user_id = db.query(RecurringRule.user_id).filter(RecurringRule.id == rule_id).scalar()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="Recurring rule not found")
+    check_rate_limit(user_id)
+    # Уже созданные по правилу операции остаются
+    db.query(RecurringRule).filter(RecurringRule.id == rule_id).delete(synchronize_session=False)
+    db.commit()
+    return Response(status_code=204)
+
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_update(request: Request):
+    if telegram_webhook is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not check_secret(request.headers.get(SECRET_HEADER)):
+        webhook_updates_total.inc("forbidden")
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "update_id" not in data:
+        webhook_updates_total.inc("invalid")
+        raise HTTPException(status_code=400, detail="Invalid update")
+    # Очередь заполнена: Telegram повторит доставку, пока обработчики догоняют
+    if not await telegram_webhook.submit(data):
+        return Response(status_code=503, headers={"Retry-After": "1"})
+    return Response(status_code=200)
+
+@app.get("/api/export/{user_id}")
+async def export_transactions(user_id: int, gzip: bool = False):
+    # Выгрузка пишется потоком: в памяти одновременно не больше одной порции строк
+    filename = f"backup_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    if gzip:
+        filename += ".gz"
+    return StreamingResponse(
+        stream_export(SessionLocal, user_id, compress=gzip),
+        media_type="application/gzip" if gzip else "text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def load_stats(db: Session, user_id: int, request: Request) -> Tuple[int, Optional[str]]:
+    """Версия и статистика пользователя в JSON; статистика None, если клиенту подходит его копия"""
+    version = get_data_version(db, user_id)
+    if etag_matches(request, make_etag(user_id, version)):
+        return version, None
+    # Готовый отчёт (reports.py): пока данные не менялись, это одна строка из user_reports
+    return version, stats_body(db, user_id)
 
 @app.get("/api/stats/{user_id}")
-async def get_stats(user_id: int, db: Session = Depends(get_db)):
-    accounts = db.query(Account).filter(Account.user_id == user_id).all()
-    transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
-
-    total_balance = sum(acc.balance for acc in accounts)
-    total_income = sum(t.amount for t in transactions if t.type == TransactionType.INCOME)
-    total_expense = sum(t.amount for t in transactions if t.type == TransactionType.EXPENSE)
-
-    return {
-        "total_balance": total_balance,
-        "total_income": total_income,
-        "total_expense": total_expense,
-        "accounts_count": len(accounts),
-        "transactions_count": len(transactions)
-    }
+async def get_stats(user_id: int, request: Request):
+    # Поколение кэша данных пользователя меняется с каждой записью (см. get_user_data)
+    version, body = await stats_reads.do(
+        (user_id, user_cache.generation(user_key(user_id)), request.headers.get("if-none-match")),
+        lambda: run_in_session(SessionLocal, load_stats, user_id, request)
+    )
+    etag = make_etag(user_id, version)
+    if body is None:
+        return not_modified(etag)
+    return Response(body, media_type="application/json", headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+@app.get("/api/analytics/{user_id}")
+@with_session
+def get_analytics(
+    db: Session,
+    user_id: int,
+    request: Request,
+    response: Response,
+    period: Literal["day", "week", "month"] = "month",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    # Без date_to диапазон заканчивается текущим моментом и сдвигается со временем,
+    # поэтому ответ кэшируется по версии данных, только если диапазон задан полностью
+    if date_to is not None:
+        unchanged = check_etag(db, user_id, request, response)
+        if unchanged:
+            return unchanged
+    try:
+        return fast_response(compute_analytics(db, user_id, period, date_from, date_to), response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+@app.get("/api/pool")
+async def get_pool_stats():
+    # Пул соединений этого процесса; у бота и других воркеров uvicorn свои пулы
+    return pool_stats(SessionLocal)
 
 if __name__ == "__main__":
     import os
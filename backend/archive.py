@@ -0,0 +1,250 @@
+"""Архивация старых операций.
+
+    python archive.py run [--months 24] [--user ID] [--vacuum]   # перенести операции старше горизонта
+    python archive.py stats [--user ID]                          # размер архива
+
+Операции старше ARCHIVE_AFTER_MONTHS полных месяцев переносятся из
+transactions в transaction_archives: одна строка на пользователя и месяц,
+операции в ней — сжатый zlib JSON. Остаются нетронутыми балансы счетов,
+журнал проводок и monthly_rollups, а итоги перенесённых операций
+записываются в archived_rollups, чтобы rollups.rebuild их учитывал, —
+статистика и балансы после архивации те же. Лента операций (listing.py) и
+выгрузка (export.py) читают архив сами, когда доходят до его месяцев.
+
+Заархивированные операции только читаются: изменить или удалить их через
+API нельзя. Каждый месяц пользователя переносится отдельной транзакцией БД
+и для клиентов выглядит как запись: версия данных растёт, а перенесённые
+операции попадают в удаления /changes. Повторный запуск дописывает в архив
+операции, появившиеся в уже заархивированных месяцах (например, импорт
+задним числом).
+"""
+import argparse
+import json
+import os
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from categories import key_expression
+from changes import record_deletion
+from database import (
+    Account, ArchivedRollup, Category, Transaction, TransactionArchive, TransactionType, bump_data_version
+)
+from rollups import NO_ACCOUNT, NO_CATEGORY
+from serialization import dumps
+from stats import month_bucket
+
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("ARCHIVE_AFTER_MONTHS", "24"))
+
+# Поля операции в архиве
+FIELDS = (
+    Transaction.id,
+    Transaction.account_id,
+    Transaction.type,
+    Transaction.amount,
+    Transaction.category_id,
+    Transaction.description,
+    Transaction.created_at,
+    Transaction.version,
+    Transaction.idempotency_key,
+)
+
+
+def add_months(at: datetime, months: int) -> datetime:
+    """Начало месяца, отстоящего от месяца at на months"""
+    index = at.year * 12 + at.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def horizon(months: int, now: Optional[datetime] = None) -> datetime:
+    """Начало первого месяца, который остаётся в transactions"""
+    return add_months(now or datetime.utcnow(), -months)
+
+
+def encode(rows: List[dict]) -> bytes:
+    return zlib.compress(dumps(rows))
+
+
+def decode(data: bytes) -> List[dict]:
+    rows = json.loads(zlib.decompress(data))
+    for row in rows:
+        row["type"] = TransactionType(row["type"])
+        row["amount"] = Decimal(row["amount"])
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return rows
+
+
+def archive_month(db: Session, user_id: int, month: str, start: datetime, end: datetime) -> int:
+    """Перенести операции пользователя из [start, end) в архив месяца month и закоммитить"""
+    # Как любая запись, начинаем с версии данных: она блокирует строку пользователя
+    # (в SQLite — базу на запись), и правка или удаление операции через API или бота
+    # не пройдёт между чтением операций месяца и их удалением
+    version = bump_data_version(db, user_id)
+    # id перенесённых операций не выдаются повторно: transactions в SQLite с AUTOINCREMENT
+    rows = [row._asdict() for row in db.query(*FIELDS).filter(
+        Transaction.user_id == user_id, Transaction.created_at >= start, Transaction.created_at < end
+    )]
+    if not rows:
+        db.rollback()
+        return 0
+
+    archive = db.get(TransactionArchive, (user_id, month))
+    if archive is None:
+        archive = TransactionArchive(user_id=user_id, month=month, transactions_count=0)
+        db.add(archive)
+        archived = []
+    else:
+        archived = decode(archive.data)
+    archive.data = encode(archived + rows)
+    archive.transactions_count = len(archived) + len(rows)
+    archive.archived_at = datetime.utcnow()
+
+    totals = defaultdict(lambda: [Decimal("0"), 0])
+    for row in rows:
+        key = (row["account_id"] or NO_ACCOUNT, row["category_id"] or NO_CATEGORY, row["type"])
+        totals[key][0] += row["amount"]
+        totals[key][1] += 1
+    db.add_all([
+        ArchivedRollup(
+            user_id=user_id, account_id=account_id, category_id=category_id, type=type_,
+            month=month, total=total, transactions_count=count
+        )
+        for (account_id, category_id, type_), (total, count) in totals.items()
+    ])
+    # Клиенты по /changes убирают перенесённые операции из ленты; дальше она читает их из архива
+    for row in rows:
+        record_deletion(db, user_id, "transactions", row["id"], version)
+    db.query(Transaction).filter(Transaction.id.in_([row["id"] for row in rows])).delete(synchronize_session=False)
+    db.commit()
+    return len(rows)
+
+
+def archive(db: Session, before: datetime, user_id: Optional[int] = None,
+            on_commit: Optional[Callable[[Iterable[int]], None]] = None) -> List[Tuple[int, str, int]]:
+    """Заархивировать операции старше before. Возвращает [(user_id, месяц, перенесено операций)].
+
+    on_commit([user_id]) вызывается после каждого перенесённого месяца — чтобы
+    сбросить кэш данных пользователя, как после записи планировщика.
+    """
+    bucket = month_bucket(db, Transaction.created_at)
+    query = db.query(Transaction.user_id, bucket).filter(
+        Transaction.user_id.is_not(None), Transaction.created_at < before
+    ).group_by(Transaction.user_id, bucket).order_by(Transaction.user_id, bucket)
+    if user_id is not None:
+        query = query.filter(Transaction.user_id == user_id)
+
+    result = []
+    for owner, month in query.all():
+        start = datetime.strptime(month, "%Y-%m")
+        moved = archive_month(db, owner, month, start, add_months(start, 1))
+        if moved and on_commit:
+            on_commit([owner])
+        result.append((owner, month, moved))
+    return result
+
+
+def archived_months(db: Session, user_id: int, month_from: Optional[str] = None,
+                    month_to: Optional[str] = None) -> List[str]:
+    """Заархивированные месяцы пользователя в диапазоне [month_from, month_to], от новых к старым"""
+    query = db.query(TransactionArchive.month).filter(TransactionArchive.user_id == user_id)
+    if month_from is not None:
+        query = query.filter(TransactionArchive.month >= month_from)
+    if month_to is not None:
+        query = query.filter(TransactionArchive.month <= month_to)
+    return [month for month, in query.order_by(TransactionArchive.month.desc())]
+
+
+def archived_transactions(db: Session, user_id: int, months: List[str]) -> Iterator[dict]:
+    """Операции из архива за months в виде строк ленты (listing.TRANSACTION_COLUMNS).
+
+    Категория берётся из categories на момент чтения, как и у операций в
+    transactions; операции удалённых с тех пор категорий и счетов остаются
+    без них. Месяцы читаются по одному в заданном порядке, операции внутри
+    месяца — от новых к старым.
+    """
+    if not months:
+        return
+    accounts = {account_id for account_id, in db.query(Account.id).filter(Account.user_id == user_id)}
+    categories: Dict[int, tuple] = {
+        category_id: (key, name, icon)
+        for category_id, key, name, icon in db.query(
+            Category.id, key_expression(), Category.name, Category.icon
+        ).filter(Category.user_id == user_id)
+    }
+    for month in months:
+        data = db.query(TransactionArchive.data).filter(
+            TransactionArchive.user_id == user_id, TransactionArchive.month == month
+        ).scalar()
+        if data is None:
+            continue
+        rows = decode(data)
+        rows.sort(key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        for row in rows:
+            key, name, icon = categories.get(row["category_id"], (None, None, None))
+            yield {
+                "id": row["id"],
+                "type": row["type"],
+                "amount": row["amount"],
+                "category": key,
+                "category_id": row["category_id"] if key is not None else None,
+                "category_name": name,
+                "category_icon": icon,
+                "description": row["description"],
+                "account_id": row["account_id"] if row["account_id"] in accounts else None,
+                "created_at": row["created_at"],
+            }
+
+
+def has_archive(db: Session, user_id: int) -> bool:
+    return db.query(TransactionArchive.month).filter(TransactionArchive.user_id == user_id).first() is not None
+
+
+def main():
+    from cache import create_cache, user_key
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "stats"])
+    parser.add_argument("--months", type=int, default=ARCHIVE_AFTER_MONTHS, help="сколько полных месяцев оставить")
+    parser.add_argument("--user", type=int, default=None)
+    parser.add_argument("--vacuum", action="store_true", help="после архивации вернуть место на диске (SQLite)")
+    args = parser.parse_args()
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        if args.command == "stats":
+            query = db.query(
+                func.count(), func.coalesce(func.sum(TransactionArchive.transactions_count), 0),
+                func.coalesce(func.sum(func.length(TransactionArchive.data)), 0)
+            )
+            if args.user is not None:
+                query = query.filter(TransactionArchive.user_id == args.user)
+            partitions, transactions, size = query.one()
+            print(f"Месяцев в архиве: {partitions}, операций: {transactions}, сжатый размер: {size / 1024:.1f} КиБ")
+            return
+
+        # С общим кэшем (CACHE_URL) API сразу перестанет отдавать заархивированные операции из кэша
+        cache = create_cache()
+        before = horizon(args.months)
+        moved = archive(
+            db, before, args.user, lambda user_ids: [cache.invalidate(user_key(user_id)) for user_id in user_ids]
+        )
+        print(f"Перенесено операций старше {before:%Y-%m}: {sum(count for *_, count in moved)} "
+              f"({len(moved)} месяцев пользователей)")
+
+    if args.vacuum:
+        engine = SessionLocal.kw["bind"]
+        if engine.dialect.name == "sqlite":
+            # VACUUM не выполняется внутри транзакции
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
+            print("VACUUM выполнен")
+
+
+if __name__ == "__main__":
+    main()
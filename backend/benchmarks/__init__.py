@@ -0,0 +1 @@
+"""Бенчмарки backend. Запуск из каталога backend: python -m benchmarks.<модуль>"""
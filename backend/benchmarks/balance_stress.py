@@ -0,0 +1,101 @@
+"""Стресс-тест балансов: много параллельных писателей на один счёт.
+
+    python -m benchmarks.balance_stress [--writers 20] [--operations 25]
+
+Писатели одновременно создают, меняют и удаляют операции одного счёта через
+API и через бота (save_transaction). В конце баланс счёта должен точно,
+до копейки, совпасть с суммой оставшихся операций, а журнал ledger_entries
+и сводка monthly_rollups — сойтись (ledger.verify, rollups.verify).
+Код возврата 1 при любом расхождении. Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+
+async def run(args) -> dict:
+    import httpx
+    import api
+    import bot
+    import ledger
+    import rollups
+    from database import Account, Transaction, TransactionType, get_or_create_user, run_in_session
+
+    telegram_id = 1
+    with api.SessionLocal() as db:
+        get_or_create_user(db, telegram_id)
+        account_id = db.query(Account.id).filter(Account.user_id == telegram_id).scalar()
+
+    async def writer(index: int, http):
+        rng = random.Random(index)
+        created = []
+        for _ in range(args.operations):
+            amount = Decimal(rng.randint(1, 100000)) / 100
+            type_ = rng.choice(["income", "expense"])
+            action = rng.random()
+            if action < 0.2:
+                await run_in_session(bot.SessionLocal, bot.save_transaction, telegram_id, TransactionType(type_), {
+                    "amount": str(amount), "account_id": account_id, "category": "food"
+                })
+            elif action < 0.35 and created:
+                response = await http.put(f"/api/transactions/{rng.choice(created)}", json={"amount": str(amount)})
+                response.raise_for_status()
+            elif action < 0.45 and created:
+                response = await http.delete(f"/api/transactions/{created.pop()}")
+                response.raise_for_status()
+            else:
+                response = await http.post("/api/transactions", json={
+                    "user_id": telegram_id, "account_id": account_id, "type": type_,
+                    "amount": str(amount), "category": "food"
+                })
+                response.raise_for_status()
+                created.append(response.json()["transactions"][0]["id"])
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=None) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(i, http) for i in range(args.writers)))
+        elapsed = time.perf_counter() - started
+
+    with api.SessionLocal() as db:
+        balance = Decimal(str(db.query(Account.balance).filter(Account.id == account_id).scalar()))
+        expected = sum(
+            (ledger.signed_amount(type_, Decimal(str(amount)))
+             for type_, amount in db.query(Transaction.type, Transaction.amount).filter(Transaction.account_id == account_id)),
+            Decimal("0")
+        )
+        problems = ledger.verify(db) + rollups.verify(db)
+
+    return {
+        "writers": args.writers,
+        "operations": args.writers * args.operations,
+        "elapsed_s": round(elapsed, 2),
+        "balance": str(balance.quantize(Decimal("0.01"))),
+        "expected": str(expected.quantize(Decimal("0.01"))),
+        "exact": balance.quantize(Decimal("0.01")) == expected.quantize(Decimal("0.01")),
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=20)
+    parser.add_argument("--operations", type=int, default=25)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}")
+    # Нагрузку дают несколько пользователей: ограничение частоты (throttling.py) здесь не нужно
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    sys.exit(0 if result["exact"] and not result["problems"] else 1)
+
+
+if __name__ == "__main__":
+    main()
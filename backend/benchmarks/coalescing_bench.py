@@ -0,0 +1,96 @@
+"""Всплески одинаковых чтений после записи: с объединением запросов (SingleFlight) и без.
+
+    python -m benchmarks.coalescing_bench [--burst 20] [--rounds 10] [--transactions 5000]
+
+Так ведёт себя Web App после каждого действия: несколько одновременных
+GET /api/user и /api/stats одного пользователя при пустом кэше. Перед каждым
+всплеском версия данных пользователя меняется, как после записи. Считаются
+загрузки из БД (load_user_data, load_stats) и длительность всплеска.
+Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+
+class PassThrough:
+    """Без объединения: каждый запрос выполняет чтение сам"""
+
+    async def do(self, key, fn):
+        return await fn()
+
+
+def counted(fn, calls: dict, name: str):
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+async def run(args) -> dict:
+    import httpx
+    import api
+    from database import bump_data_version
+    from benchmarks.seed import seed_user
+
+    user_id = 1
+    with api.SessionLocal() as db:
+        seed_user(db, telegram_id=user_id, transactions=args.transactions)
+
+    calls = {"user_data": 0, "stats": 0}
+    api.load_user_data = counted(api.load_user_data, calls, "user_data")
+    api.load_stats = counted(api.load_stats, calls, "stats")
+    coalescing = api.user_data_reads, api.stats_reads
+
+    def touch():
+        with api.SessionLocal() as db:
+            bump_data_version(db, user_id)
+            db.commit()
+        api.invalidate_user_data(user_id)
+
+    result = {}
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        for mode in ("off", "on"):
+            api.user_data_reads, api.stats_reads = coalescing if mode == "on" else (PassThrough(), PassThrough())
+            for name in calls:
+                calls[name] = 0
+            durations = []
+            for _ in range(args.rounds):
+                touch()
+                started = time.perf_counter()
+                responses = await asyncio.gather(*(
+                    http.get(f"/api/user/{user_id}" if i % 2 == 0 else f"/api/stats/{user_id}")
+                    for i in range(args.burst)
+                ))
+                durations.append((time.perf_counter() - started) * 1000)
+                for response in responses:
+                    response.raise_for_status()
+            result[mode] = {
+                "requests": args.rounds * args.burst,
+                "db_loads": dict(calls),
+                "burst_mean_ms": round(statistics.fmean(durations), 2),
+                "burst_max_ms": round(max(durations), 2),
+            }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--transactions", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'coalescing.db')}")
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    os.environ.setdefault("SCHEDULER_INTERVAL", "0")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Минимальные заменители объектов python-telegram-bot и сервера Bot API для вызова бота без сети"""
+import io
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+
+
+class FakeFile:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    async def download_as_bytearray(self) -> bytearray:
+        return bytearray(self.content)
+
+
+class FakeDocument:
+    def __init__(self, file_name: str, content: bytes):
+        self.file_name = file_name
+        self.content = content
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self.content)
+
+
+class FakeMessage:
+    """Сообщение, которое запоминает ответы бота вместо отправки в Telegram"""
+
+    def __init__(self, web_app_data: Optional[str] = None, document: Optional[FakeDocument] = None):
+        self.web_app_data = SimpleNamespace(data=web_app_data) if web_app_data is not None else None
+        self.document = document
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+    async def reply_document(self, document, **kwargs):
+        # Читаем файл, как это сделала бы отправка, чтобы время выгрузки учитывалось полностью
+        content = document.read() if hasattr(document, "read") else document
+        self.replies.append(io.BytesIO(content))
+
+
+class FakeUpdate:
+    def __init__(self, telegram_id: int, message: FakeMessage):
+        self.effective_user = SimpleNamespace(id=telegram_id)
+        self.message = message
+
+
+def command_update(telegram_id: int) -> FakeUpdate:
+    return FakeUpdate(telegram_id, FakeMessage())
+
+
+def web_app_update(telegram_id: int, data: dict) -> FakeUpdate:
+    return FakeUpdate(telegram_id, FakeMessage(web_app_data=json.dumps(data)))
+
+
+def document_update(telegram_id: int, file_name: str, content: bytes) -> FakeUpdate:
+    return FakeUpdate(telegram_id, FakeMessage(document=FakeDocument(file_name, content)))
+
+
+class FakeBotApi:
+    """Локальный сервер Bot API: бот с TELEGRAM_API_URL=fake.url отвечает ему, а не Telegram.
+
+    Считает вызовы методов; sendMessage и sendDocument — ответы бота
+    пользователю. Файлы (getFile) отдаются как CSV из одного заголовка.
+    """
+
+    REPLY_METHODS = ("sendMessage", "sendDocument")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, file_content: bytes = b""):
+        self.calls = Counter()
+        self.file_content = file_content
+        self._changed = threading.Condition()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if parts[0] == "file":
+                    self._send(fake.file_content, "text/csv")
+                    return
+                method = parts[-1]
+                body = json.dumps({"ok": True, "result": fake.result(method)}).encode()
+                self._send(body, "application/json")
+                fake.record(method)
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def result(self, method: str):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getFile":
+            return {"file_id": "file", "file_unique_id": "file", "file_path": "documents/backup.csv"}
+        if method in self.REPLY_METHODS:
+            return {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}}
+        return True
+
+    def record(self, method: str):
+        with self._changed:
+            self.calls[method] += 1
+            self._changed.notify_all()
+
+    def replies(self) -> int:
+        return sum(self.calls[method] for method in self.REPLY_METHODS)
+
+    def wait_replies(self, expected: int, idle: float) -> int:
+        """Ждать expected ответов бота; сдаться, если новых нет дольше idle секунд"""
+        with self._changed:
+            while self.replies() < expected:
+                before = self.replies()
+                self._changed.wait(idle)
+                if self.replies() == before:
+                    break
+            return self.replies()
@@ -0,0 +1,90 @@
+"""Групповой коммит операций из Web App против коммита на каждое сообщение.
+
+    python -m benchmarks.group_commit [--senders 50] [--messages 20] [--delay-ms 5]
+
+Отправители одновременно записывают операции через тот же путь, что и
+handle_web_app_data: сначала по одной транзакции БД на сообщение, затем
+через GroupCommitter. Печатает в JSON пропускную способность, задержки
+подтверждений и метрики пакетов (размер, длительность коммита).
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from benchmarks.load_test import summarize
+
+
+async def drive(args, record) -> dict:
+    latencies = []
+
+    async def sender(index: int):
+        for i in range(args.messages):
+            started = time.perf_counter()
+            recorded = await record(index, i)
+            assert recorded is not None
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(args.senders)))
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "throughput_ops": round(len(latencies) / elapsed, 1),
+        "latency": summarize(latencies),
+    }
+
+
+async def run(args) -> dict:
+    import bot
+    from database import Account, TransactionType, get_or_create_user, run_in_session
+    from recorder import GroupCommitter
+
+    accounts = {}
+    with bot.SessionLocal() as db:
+        for index in range(args.senders):
+            get_or_create_user(db, index + 1)
+            accounts[index] = db.query(Account.id).filter(Account.user_id == index + 1).scalar()
+
+    def message(index: int, i: int) -> dict:
+        return {"amount": str(Decimal(i % 100 + 1)), "account_id": accounts[index], "category": "food"}
+
+    async def per_message(index: int, i: int):
+        return await run_in_session(
+            bot.SessionLocal, bot.save_transaction, index + 1, TransactionType.EXPENSE, message(index, i)
+        )
+
+    committer = GroupCommitter(bot.SessionLocal, max_delay=args.delay_ms / 1000, on_commit=bot.invalidate_users)
+
+    async def grouped(index: int, i: int):
+        return await committer.submit(
+            bot.web_app_transaction(index + 1, TransactionType.EXPENSE, message(index, i))
+        )
+
+    result = {
+        "senders": args.senders,
+        "messages": args.senders * args.messages,
+        "per_message_commit": await drive(args, per_message),
+        "group_commit": await drive(args, grouped),
+    }
+    await committer.close()
+    result["group_commit"]["batches"] = committer.metrics.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'group_commit.db')}")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Нагрузочный тест API: задержки лёгких запросов на фоне тяжёлой статистики.
+
+    python -m benchmarks.load_test [--clients 200] [--requests 5] [--heavy-rows 10000]
+                                   [--no-offload | --tree DIR] [--timeout 60]
+
+Приложение вызывается в процессе через httpx.ASGITransport, т.е. в одном
+event loop, как в единственном воркере uvicorn. Если обработчик блокирует
+loop синхронным запросом к БД, это сразу видно по p99 лёгких запросов.
+Результат печатается в JSON.
+
+Сравнение «до и после» выноса работы с БД в пул потоков:
+
+    --no-offload  database.run_in_session выполняет запрос прямо в event loop,
+                  как async-обработчики до выноса; остальной код текущий
+    --tree DIR    тот же тест против другой копии репозитория, например
+                  git worktree add /tmp/before 9612084^ и --tree /tmp/before:
+                  там обработчики ещё держали сессию Depends(get_db)
+
+Упавшие запросы (например, QueuePool timeout) считаются в errors, а прогон,
+не уложившийся в --timeout секунд, прерывается с timed_out: true.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "mean_ms": round(statistics.fmean(samples), 2),
+    }
+
+
+def disable_offload(api):
+    """Выполнять работу с БД в event loop вместо пула потоков"""
+    async def run_inline(session_factory, fn, *args, **kwargs):
+        with session_factory() as db:
+            return fn(db, *args, **kwargs)
+
+    api.run_in_session = run_inline
+
+
+async def run(args) -> dict:
+    import httpx
+    import api
+    from benchmarks.seed import seed_user
+
+    if args.no_offload:
+        disable_offload(api)
+
+    heavy_user, light_user = 1, 2
+    with api.SessionLocal() as db:
+        seed_user(db, telegram_id=heavy_user, transactions=args.heavy_rows)
+        seed_user(db, telegram_id=light_user, transactions=100, seed=7)
+
+    light, heavy, errors = [], [], []
+
+    async def client(index: int, http):
+        is_heavy = index % 10 == 0
+        for _ in range(args.requests):
+            url = f"/api/stats/{heavy_user}" if is_heavy else f"/api/accounts/{light_user}"
+            started = time.perf_counter()
+            try:
+                response = await http.get(url)
+                response.raise_for_status()
+            except Exception as e:
+                errors.append(type(e).__name__)
+                continue
+            (heavy if is_heavy else light).append((time.perf_counter() - started) * 1000)
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(client(i, http) for i in range(args.clients))), args.timeout)
+            timed_out = False
+        except asyncio.TimeoutError:
+            timed_out = True
+        elapsed = time.perf_counter() - started
+
+    done = len(light) + len(heavy)
+    return {
+        "clients": args.clients,
+        "mode": "no-offload" if args.no_offload else "offload",
+        "requests": done,
+        "errors": {name: errors.count(name) for name in sorted(set(errors))},
+        "timed_out": timed_out,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(done / elapsed, 1),
+        "light": summarize(light) if light else None,
+        "heavy": summarize(heavy) if heavy else None,
+    }
+
+
+def run_tree(tree: str, argv) -> dict:
+    """Запустить этот же тест с модулями backend другой копии репозитория"""
+    backend = os.path.join(os.path.abspath(tree), "backend")
+    # Первым в sys.path встаёт каталог скрипта (benchmarks), поэтому api,
+    # database и пакет benchmarks с seed.py берутся из PYTHONPATH
+    env = dict(os.environ, PYTHONPATH=backend)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__)] + argv, cwd=backend, env=env,
+        stdout=subprocess.PIPE, check=True, text=True
+    ).stdout
+    return dict(json.loads(output), mode=f"tree {tree}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--heavy-rows", type=int, default=10000)
+    parser.add_argument("--timeout", type=float, default=None, help="прервать прогон через столько секунд")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--no-offload", action="store_true", help="работа с БД в event loop, без пула потоков")
+    mode.add_argument("--tree", help="корень другой копии репозитория (git worktree)")
+    args = parser.parse_args()
+
+    if args.tree:
+        argv = ["--clients", str(args.clients), "--requests", str(args.requests), "--heavy-rows", str(args.heavy_rows)]
+        if args.timeout is not None:
+            argv += ["--timeout", str(args.timeout)]
+        print(json.dumps(run_tree(args.tree, argv), indent=2))
+        return
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}")
+    # Нагрузку дают несколько пользователей: ограничение частоты (throttling.py) здесь не нужно
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
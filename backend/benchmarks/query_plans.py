@@ -0,0 +1,74 @@
+"""Проверка, что горячие запросы используют индексы из database.py.
+
+    python -m benchmarks.query_plans [DATABASE_URL]
+
+Печатает план каждого запроса и завершается с кодом 1, если ожидаемый индекс
+не используется. Для PostgreSQL последовательное сканирование отключается,
+иначе на маленькой таблице планировщик законно выбирает seq scan.
+"""
+import os
+import sys
+import tempfile
+
+from sqlalchemy import text
+
+from database import init_db
+
+HOT_QUERIES = [
+    (
+        "лента операций",
+        "SELECT * FROM transactions WHERE user_id = :uid ORDER BY created_at DESC LIMIT 50",
+        "ix_transactions_user_id_created_at",
+    ),
+    (
+        "статистика по типам",
+        "SELECT type, SUM(amount), COUNT(id) FROM transactions WHERE user_id = :uid GROUP BY type",
+        "ix_transactions_user_id_type",
+    ),
+    (
+        "операции счёта",
+        "SELECT id FROM transactions WHERE account_id = :uid",
+        "ix_transactions_account_id",
+    ),
+    (
+        "счета пользователя",
+        "SELECT * FROM accounts WHERE user_id = :uid",
+        "ix_accounts_user_id",
+    ),
+    (
+        "категории пользователя",
+        "SELECT * FROM categories WHERE user_id = :uid",
+        "ix_categories_user_id",
+    ),
+]
+
+
+def explain(conn, sql: str) -> str:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SET enable_seqscan = off"))
+        rows = conn.execute(text(f"EXPLAIN {sql}"), {"uid": 1}).all()
+        return "\n".join(row[0] for row in rows)
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), {"uid": 1}).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def main():
+    if len(sys.argv) > 1:
+        database_url = sys.argv[1]
+    else:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+
+    engine = init_db(database_url).kw["bind"]
+    failed = False
+    with engine.connect() as conn:
+        for title, sql, index in HOT_QUERIES:
+            plan = explain(conn, sql)
+            ok = index in plan
+            failed |= not ok
+            print(f"[{'OK' if ok else 'FAIL'}] {title}: ожидается {index}")
+            print("    " + plan.replace("\n", "\n    "))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from categories import resolve_categories
+from database import User, Account, Category, LedgerEntry, Transaction, TransactionType
+from ledger import OPENING
+from rollups import rebuild as rebuild_rollups
+
+CATEGORIES = {
+    TransactionType.INCOME: ["salary", "freelance", "investments", "gift"],
+    TransactionType.EXPENSE: ["food", "transport", "shopping", "entertainment", "health", "utilities"],
+}
+
+
+def seed_user(db, telegram_id: int, transactions: int, accounts: int = 3, seed: int = 42, categories: int = 0):
+    """Создать пользователя со счетами, своими категориями и заданным числом случайных операций"""
+    rng = random.Random(seed)
+    db.add(User(telegram_id=telegram_id))
+    db.add_all([
+        Category(
+            user_id=telegram_id,
+            name=f"Категория {i + 1}",
+            type=TransactionType.EXPENSE if i % 2 == 0 else TransactionType.INCOME
+        )
+        for i in range(categories)
+    ])
+    account_rows = [Account(user_id=telegram_id, name=f"Счёт {i + 1}", balance=Decimal("0.00")) for i in range(accounts)]
+    db.add_all(account_rows)
+    db.flush()
+
+    category_ids = {
+        pair: category.id
+        for pair, category in resolve_categories(
+            db, telegram_id, [(type_, key) for type_, keys in CATEGORIES.items() for key in keys], 0
+        ).items()
+    }
+
+    balances = {acc.id: Decimal("0.00") for acc in account_rows}
+    start = datetime.utcnow() - timedelta(days=730)
+    rows = []
+    for i in range(transactions):
+        type_ = TransactionType.INCOME if rng.random() < 0.2 else TransactionType.EXPENSE
+        amount = Decimal(rng.randint(100, 500000)) / 100
+        account_id = rng.choice(account_rows).id
+        balances[account_id] += amount if type_ == TransactionType.INCOME else -amount
+        rows.append({
+            "user_id": telegram_id,
+            "account_id": account_id,
+            "type": type_,
+            "amount": amount,
+            "category_id": category_ids[(type_, rng.choice(CATEGORIES[type_]))],
+            "description": f"operation {i}",
+            "created_at": start + timedelta(seconds=rng.randint(0, 730 * 86400)),
+        })
+    db.bulk_insert_mappings(Transaction, rows)
+    for acc in account_rows:
+        acc.balance = balances[acc.id]
+    # Баланс сгенерированной истории — одной проводкой на счёт, чтобы ledger.verify сходился
+    db.bulk_insert_mappings(LedgerEntry, [
+        {"account_id": acc.id, "user_id": telegram_id, "delta": balances[acc.id], "reason": OPENING, "created_at": start}
+        for acc in account_rows
+    ])
+    rebuild_rollups(db, telegram_id)
+    db.commit()
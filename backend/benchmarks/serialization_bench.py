@@ -0,0 +1,94 @@
+"""Загрузка и сериализация списка операций: ORM и pydantic против кортежей колонок и orjson.
+
+    python -m benchmarks.serialization_bench [--sizes 10000] [--repeat 5]
+
+Прежний путь: ORM-объекты Transaction (с категорией), проверка каждой строки
+схемой TransactionResponse, model_dump в JSON-совместимый вид и
+JSONResponse. Текущий: выборка listing.transaction_rows кортежами колонок,
+как в list_transactions, и serialization.dumps. Список берётся целиком, без
+ограничения MAX_PAGE_SIZE. Оба пути выдают одинаковый JSON, это проверяется.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fastapi.responses import JSONResponse
+
+from database import init_db, Transaction
+from listing import transaction_rows
+from schemas import TransactionPage, TransactionResponse
+from serialization import dumps
+from benchmarks.seed import seed_user
+
+
+def legacy_load(db, user_id: int) -> list:
+    """Прежняя выборка: ORM-объекты через identity map сессии"""
+    return db.query(Transaction).filter(Transaction.user_id == user_id).order_by(
+        Transaction.created_at.desc(), Transaction.id.desc()
+    ).all()
+
+
+def current_load(db, user_id: int) -> list:
+    return [
+        row._asdict()
+        for row in transaction_rows(db).filter(Transaction.user_id == user_id).order_by(
+            Transaction.created_at.desc(), Transaction.id.desc()
+        )
+    ]
+
+
+def legacy_serialize(transactions: list) -> bytes:
+    """Прежняя сериализация: response_model=TransactionPage и JSONResponse"""
+    page = TransactionPage(items=[TransactionResponse.model_validate(t) for t in transactions])
+    return JSONResponse(page.model_dump(mode="json")).body
+
+
+def _timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'':>10} {'legacy, ms':>12} {'current, ms':>12} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            SessionLocal = init_db(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            with SessionLocal() as db:
+                seed_user(db, telegram_id=1, transactions=size)
+                db.expunge_all()
+
+                legacy_rows = legacy_load(db, 1)
+                rows = current_load(db, 1)
+                legacy_body = legacy_serialize(legacy_rows)
+                body = dumps({"items": rows, "next_cursor": None})
+                assert json.loads(legacy_body) == json.loads(body)
+
+                timings = {
+                    "load": (
+                        _timeit(lambda: (db.expunge_all(), legacy_load(db, 1)), args.repeat),
+                        _timeit(lambda: current_load(db, 1), args.repeat),
+                    ),
+                    "serialize": (
+                        _timeit(lambda: legacy_serialize(legacy_rows), args.repeat),
+                        _timeit(lambda: dumps({"items": rows, "next_cursor": None}), args.repeat),
+                    ),
+                }
+            SessionLocal.kw["bind"].dispose()
+        timings["total"] = tuple(map(sum, zip(*timings.values())))
+        for stage, (legacy_ms, current_ms) in timings.items():
+            print(f"{size:>8} {stage:>10} {legacy_ms:>12.1f} {current_ms:>12.1f} {legacy_ms / current_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
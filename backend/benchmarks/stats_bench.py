@@ -0,0 +1,63 @@
+"""Сравнение агрегатов в БД (stats.compute_stats) с прежним подсчётом в Python.
+
+    python -m benchmarks.stats_bench [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from database import init_db, Account, Transaction, TransactionType
+from stats import compute_stats
+from benchmarks.seed import seed_user
+
+
+def legacy_stats(db, user_id: int) -> dict:
+    """Прежняя реализация get_stats: загрузка всех строк и суммирование в Python"""
+    accounts = db.query(Account).filter(Account.user_id == user_id).all()
+    transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
+
+    return {
+        "total_balance": sum(acc.balance for acc in accounts),
+        "total_income": sum(t.amount for t in transactions if t.type == TransactionType.INCOME),
+        "total_expense": sum(t.amount for t in transactions if t.type == TransactionType.EXPENSE),
+        "accounts_count": len(accounts),
+        "transactions_count": len(transactions)
+    }
+
+
+def _timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy, ms':>12} {'sql, ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            SessionLocal = init_db(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            with SessionLocal() as db:
+                seed_user(db, telegram_id=1, transactions=size)
+
+                legacy = legacy_stats(db, 1)
+                current = compute_stats(db, 1)
+                for key in legacy:
+                    assert legacy[key] == current[key], key
+
+                legacy_ms = _timeit(lambda: (db.expunge_all(), legacy_stats(db, 1)), args.repeat)
+                sql_ms = _timeit(lambda: compute_stats(db, 1), args.repeat)
+            SessionLocal.kw["bind"].dispose()
+        print(f"{size:>8} {legacy_ms:>12.1f} {sql_ms:>10.1f} {legacy_ms / sql_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
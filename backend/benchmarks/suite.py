@@ -0,0 +1,443 @@
+"""Воспроизводимый набор бенчмарков всех маршрутов API и обработчиков бота.
+
+    python -m benchmarks.suite [--users 20] [--transactions 2000] [--accounts 3] [--categories 4]
+                               [--iterations 100] [--concurrency 1] [--repeat 3] [--output result.json]
+                               [--save-baseline benchmarks/baseline.json]
+                               [--baseline benchmarks/baseline.json] [--threshold 0.5]
+
+База заполняется синтетическими пользователями, счетами, категориями и
+операциями (DATABASE_URL, по умолчанию временный файл SQLite; база
+PostgreSQL должна быть пустой). Маршруты api.py вызываются в процессе через
+httpx.ASGITransport, обработчики бота — с поддельным Update из
+benchmarks.fakes. По каждому сценарию в JSON печатаются пропускная
+способность, задержки p50/p95/p99 и число ошибок.
+
+С --baseline результат сравнивается с сохранённым: если метрика (--metric,
+по умолчанию p95_ms) ухудшилась больше чем на --threshold и при этом больше
+чем на --min-delta-ms, или сценарий завершился с ошибками, код выхода 1.
+Базовая линия зависит от машины, поэтому сравнивать стоит прогоны на одном
+и том же железе и с одинаковыми параметрами. По умолчанию запросы сценария
+идут по одному: при параллельной записи в SQLite задержки определяются
+ожиданием блокировки и от прогона к прогону меняются в полтора-два раза;
+пропускную способность под нагрузкой смотрят с --concurrency 8 и выше.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import command_update, document_update, web_app_update
+from benchmarks.load_test import summarize
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "mean_ms", "throughput_ops"]
+
+# Тяжёлые сценарии (выгрузка, импорт, догон планировщика) выполняются реже остальных
+HEAVY_SHARE = 0.2
+BULK_ROWS = 50
+IMPORT_ROWS = 50
+# Сколько пропущенных ежедневных повторений догоняет планировщик за проход
+CATCH_UP_DAYS = 30
+
+
+class Failed(Exception):
+    pass
+
+
+def check(response, *allowed: int):
+    if response.status_code >= 400 or (allowed and response.status_code not in allowed):
+        raise Failed(f"{response.request.method} {response.request.url.path}: {response.status_code} {response.text[:120]}")
+    return response
+
+
+def check_replies(update):
+    replies = update.message.replies
+    if not replies:
+        raise Failed("no reply")
+    if isinstance(replies[-1], str) and replies[-1].startswith("❌"):
+        raise Failed(replies[-1])
+
+
+async def measure(iterations: int, concurrency: int, operation, warmup: int = 0) -> dict:
+    """Выполнить operation(i) iterations раз не больше чем в concurrency потоков.
+
+    Первые warmup вызовов прогревают кэши и пул соединений и не учитываются.
+    """
+    for i in range(warmup):
+        try:
+            await operation(iterations + i)
+        except Exception:
+            pass
+
+    latencies, errors = [], []
+    pending = iter(range(iterations))
+
+    async def worker():
+        for i in pending:
+            started = time.perf_counter()
+            try:
+                await operation(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {str(e).splitlines()[0][:160] if str(e) else ''}")
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies) if latencies else {"count": 0}
+    result["throughput_ops"] = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    result["errors"] = len(errors)
+    if errors:
+        result["error_samples"] = sorted(set(errors))[:3]
+    return result
+
+
+def merge_rounds(rounds) -> dict:
+    """Медиана каждой метрики по повторам: один шумный прогон не решает исход сравнения"""
+    merged = {}
+    for name in rounds[0]:
+        results = [round_[name] for round_ in rounds]
+        scenario = {"count": sum(r["count"] for r in results)}
+        for metric in METRICS:
+            values = [r[metric] for r in results if metric in r]
+            if values:
+                scenario[metric] = round(statistics.median(values), 2)
+        scenario["errors"] = sum(r["errors"] for r in results)
+        samples = sorted({sample for r in results for sample in r.get("error_samples", [])})
+        if samples:
+            scenario["error_samples"] = samples[:3]
+        merged[name] = scenario
+    return merged
+
+
+def seed(args):
+    from database import init_db
+    from benchmarks.seed import seed_user
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        for user_id in range(1, args.users + 1):
+            seed_user(
+                db, telegram_id=user_id, transactions=args.transactions,
+                accounts=args.accounts, categories=args.categories, seed=user_id
+            )
+    SessionLocal.kw["bind"].dispose()
+
+
+def import_csv(user_id: int, account_name: str, rows: int) -> bytes:
+    from export import CSV_HEADER
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for i in range(rows):
+        writer.writerow(["", "expense", f"{i % 90 + 10}.50", "food", account_name, f"import {user_id}/{i}", "2024-01-15T12:00:00"])
+    return buffer.getvalue().encode("utf-8")
+
+
+def build_scenarios(http, users: int, accounts: dict, cursors: dict):
+    """Сценарии в порядке выполнения: (имя, доля итераций, операция)"""
+    from datetime import datetime, timedelta
+    from decimal import Decimal
+
+    import api
+    import bot
+    from database import RecurringRule, TransactionType
+    from metrics import instrument_handler
+    from scheduler import Scheduler
+
+    def user(i: int) -> int:
+        return i % users + 1
+
+    created = {"accounts": [], "transactions": [], "categories": [], "recurring": []}
+    scheduler = Scheduler(api.SessionLocal, on_commit=lambda user_ids: [api.invalidate_user_data(u) for u in user_ids])
+    # Планировщик процесса выполняет проходы по одному, как Scheduler._run
+    scheduler_lock = asyncio.Lock()
+
+    async def get(url: str, *allowed: int, **kwargs):
+        return check(await http.get(url, **kwargs), *allowed)
+
+    async def get_user_data_cold(i):
+        api.user_cache.invalidate(api.user_key(user(i)))
+        await get(f"/api/user/{user(i)}", 200)
+
+    async def get_user_data_cached(i):
+        await get(f"/api/user/{user(i)}", 200)
+
+    async def get_user_data_not_modified(i):
+        etag = (await get(f"/api/user/{user(i)}")).headers["ETag"]
+        await get(f"/api/user/{user(i)}", 304, headers={"If-None-Match": etag})
+
+    async def create_account(i):
+        response = await http.post("/api/accounts", json={"user_id": user(i), "name": f"Bench {i}", "balance": "100.00"})
+        created["accounts"].append(check(response).json()["accounts"][0]["id"])
+
+    async def update_account(i):
+        account_id = created["accounts"][i % len(created["accounts"])]
+        check(await http.put(f"/api/accounts/{account_id}", json={"balance": f"{i % 500 + 1}.00"}))
+
+    async def delete_account(i):
+        check(await http.delete(f"/api/accounts/{created['accounts'].pop()}"))
+
+    async def create_transaction(i):
+        response = await http.post("/api/transactions", json={
+            "user_id": user(i), "account_id": accounts[user(i)], "type": "expense",
+            "amount": f"{i % 100 + 1}.25", "category": "food"
+        })
+        created["transactions"].append(check(response).json()["transactions"][0]["id"])
+
+    async def update_transaction(i):
+        transaction_id = created["transactions"][i % len(created["transactions"])]
+        check(await http.put(f"/api/transactions/{transaction_id}", json={"amount": f"{i % 100 + 2}.75", "category": "transport"}))
+
+    async def delete_transaction(i):
+        check(await http.delete(f"/api/transactions/{created['transactions'].pop()}"))
+
+    async def bulk_import(i):
+        check(await http.post("/api/transactions/bulk", json={"transactions": [
+            {"user_id": user(i), "account_id": accounts[user(i)], "type": "income",
+             "amount": f"{j + 1}.00", "category": "salary", "created_at": "2024-02-01T09:00:00"}
+            for j in range(BULK_ROWS)
+        ]}))
+
+    async def create_category(i):
+        response = await http.post("/api/categories", json={"user_id": user(i), "name": f"Bench {i}", "icon": "🧪", "type": "expense"})
+        created["categories"].append(check(response).json()["categories"][0]["id"])
+
+    async def delete_category(i):
+        check(await http.delete(f"/api/categories/{created['categories'].pop()}"))
+
+    async def create_recurring(i):
+        # Первое повторение в будущем: правило не попадает в проход планировщика ниже
+        response = await http.post("/api/recurring", json={
+            "user_id": user(i), "account_id": accounts[user(i)], "type": "expense", "amount": f"{i % 100 + 1}.00",
+            "category": "utilities", "period": "month", "start_at": (datetime.utcnow() + timedelta(days=30)).isoformat()
+        })
+        created["recurring"].append(check(response).json()["id"])
+
+    async def delete_recurring(i):
+        check(await http.delete(f"/api/recurring/{created['recurring'].pop()}"), 204)
+
+    async def scheduler_catch_up(i):
+        # Ежедневное правило, пропустившее CATCH_UP_DAYS дней: проход записывает все повторения
+        now = datetime.utcnow()
+        rule = RecurringRule(
+            user_id=user(i), account_id=accounts[user(i)], type=TransactionType.EXPENSE, amount=Decimal("3.50"),
+            description="bench", period="day", interval=1, start_at=now - timedelta(days=CATCH_UP_DAYS - 1),
+            end_at=now, next_run_at=now - timedelta(days=CATCH_UP_DAYS - 1)
+        )
+        with api.SessionLocal() as db:
+            db.add(rule)
+            db.commit()
+            rule_id = rule.id
+        async with scheduler_lock:
+            await scheduler.run_once(now)
+        # При --concurrency правило может догнать проход другой итерации, поэтому проверяется само правило
+        with api.SessionLocal() as db:
+            runs = db.get(RecurringRule, rule_id).runs
+        if runs != CATCH_UP_DAYS:
+            raise Failed(f"caught up {runs} of {CATCH_UP_DAYS}")
+
+    def handler(fn):
+        wrapped = instrument_handler(fn)
+
+        async def run(update):
+            await wrapped(update, None)
+            check_replies(update)
+        return run
+
+    start, stats, backup = handler(bot.start), handler(bot.stats), handler(bot.backup)
+    web_app, import_document = handler(bot.handle_web_app_data), handler(bot.import_document)
+
+    async def bot_web_app_transaction(i, type_: str, category: str):
+        await web_app(web_app_update(user(i), {
+            "type": type_, "amount": f"{i % 100 + 1}.10", "account_id": accounts[user(i)], "category": category
+        }))
+
+    async def bot_import_document(i):
+        await import_document(document_update(user(i), "import.csv", import_csv(user(i), "Счёт 1", IMPORT_ROWS)))
+
+    return [
+        ("api.get_user_data.cold", 1, get_user_data_cold),
+        ("api.get_user_data.cached", 1, get_user_data_cached),
+        ("api.get_user_data.not_modified", 1, get_user_data_not_modified),
+        ("api.get_accounts", 1, lambda i: get(f"/api/accounts/{user(i)}")),
+        ("api.get_categories", 1, lambda i: get(f"/api/categories/{user(i)}")),
+        ("api.get_transactions", 1, lambda i: get(f"/api/transactions/{user(i)}")),
+        ("api.get_transactions.next_page", 1, lambda i: get(f"/api/transactions/{user(i)}", params={"cursor": cursors[user(i)]})),
+        ("api.get_transactions.filtered", 1, lambda i: get(
+            f"/api/transactions/{user(i)}", params={"type": "expense", "category": "food", "amount_min": "100"}
+        )),
+        ("api.get_stats", 1, lambda i: get(f"/api/stats/{user(i)}")),
+        ("api.get_analytics", 1, lambda i: get(f"/api/analytics/{user(i)}")),
+        ("api.get_analytics.daily", 1, lambda i: get(f"/api/analytics/{user(i)}", params={"period": "day"})),
+        ("api.export", HEAVY_SHARE, lambda i: get(f"/api/export/{user(i)}")),
+        ("api.export.gzip", HEAVY_SHARE, lambda i: get(f"/api/export/{user(i)}", params={"gzip": "true"})),
+        ("api.metrics", 1, lambda i: get("/metrics")),
+        ("api.pool", 1, lambda i: get("/api/pool")),
+        ("api.create_account", 1, create_account),
+        ("api.update_account", 1, update_account),
+        ("api.create_transaction", 1, create_transaction),
+        ("api.update_transaction", 1, update_transaction),
+        ("api.delete_transaction", 1, delete_transaction),
+        ("api.bulk_import", HEAVY_SHARE, bulk_import),
+        ("api.create_category", 1, create_category),
+        ("api.delete_category", 1, delete_category),
+        ("api.create_recurring", 1, create_recurring),
+        ("api.get_recurring", 1, lambda i: get(f"/api/recurring/{user(i)}")),
+        ("api.delete_recurring", 1, delete_recurring),
+        ("scheduler.catch_up", HEAVY_SHARE, scheduler_catch_up),
+        ("api.delete_account", 1, delete_account),
+        # Все записи выше подняли версии данных: since=0 отдаёт их разницей
+        ("api.get_user_changes", 1, lambda i: get(f"/api/user/{user(i)}/changes", params={"since": 0})),
+        ("bot.start", 1, lambda i: start(command_update(user(i)))),
+        ("bot.stats", 1, lambda i: stats(command_update(user(i)))),
+        ("bot.backup", HEAVY_SHARE, lambda i: backup(command_update(user(i)))),
+        ("bot.web_app.expense", 1, lambda i: bot_web_app_transaction(i, "expense", "food")),
+        ("bot.web_app.income", 1, lambda i: bot_web_app_transaction(i, "income", "salary")),
+        ("bot.web_app.create_account", 1, lambda i: web_app(web_app_update(user(i), {
+            "type": "create_account", "name": f"Bot {i}", "balance": "10.00"
+        }))),
+        ("bot.import_document", HEAVY_SHARE, bot_import_document),
+    ]
+
+
+async def run(args) -> dict:
+    import httpx
+    import api
+    from database import Account
+
+    with api.SessionLocal() as db:
+        accounts = dict(
+            db.query(Account.user_id, Account.id).filter(Account.name == "Счёт 1").all()
+        )
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        cursors = {}
+        for user_id in accounts:
+            page = check(await http.get(f"/api/transactions/{user_id}")).json()
+            cursors[user_id] = page["next_cursor"]
+
+        rounds = []
+        for round_ in range(args.repeat):
+            results = {}
+            for name, share, operation in build_scenarios(http, args.users, accounts, cursors):
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                iterations = max(args.concurrency, int(args.iterations * share))
+                results[name] = await measure(iterations, args.concurrency, operation, warmup=args.concurrency)
+                print(
+                    f"[{round_ + 1}/{args.repeat}] {name}: {results[name].get('p95_ms')} ms p95, "
+                    f"{results[name]['errors']} errors",
+                    file=sys.stderr
+                )
+            rounds.append(results)
+
+    return merge_rounds(rounds)
+
+
+def compare(result: dict, baseline: dict, metric: str, threshold: float, min_delta_ms: float) -> dict:
+    """Сценарии, метрика которых ухудшилась относительно базовой линии сверх порога"""
+    higher_is_better = metric == "throughput_ops"
+    regressions, missing = [], []
+    for name, current in result["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None or metric not in base or metric not in current:
+            missing.append(name)
+            continue
+        before, after = base[metric], current[metric]
+        if higher_is_better:
+            regressed = after < before * (1 - threshold)
+        else:
+            regressed = after > before * (1 + threshold) and after - before > min_delta_ms
+        if regressed:
+            regressions.append({
+                "scenario": name,
+                "baseline": before,
+                "current": after,
+                "change": round(after / before - 1, 3) if before else None,
+            })
+    return {
+        "metric": metric,
+        "threshold": threshold,
+        "config_matches": baseline.get("config") == result["config"],
+        "regressions": regressions,
+        "not_in_baseline": missing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--transactions", type=int, default=2000, help="операций на пользователя")
+    parser.add_argument("--accounts", type=int, default=3, help="счетов на пользователя")
+    parser.add_argument("--categories", type=int, default=4, help="своих категорий на пользователя")
+    parser.add_argument("--iterations", type=int, default=100, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных запросов в сценарии")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов набора; в отчёт идёт медиана")
+    parser.add_argument("--only", nargs="*", help="префиксы имён сценариев, например api.get_stats bot.")
+    parser.add_argument("--output", help="куда дополнительно записать результат")
+    parser.add_argument("--save-baseline", help="сохранить результат как базовую линию")
+    parser.add_argument("--baseline", help="сравнить с базовой линией и завершиться с ошибкой при регрессии")
+    parser.add_argument("--metric", choices=METRICS, default="p95_ms")
+    parser.add_argument("--threshold", type=float, default=0.5, help="допустимое ухудшение, доля")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="меньшие абсолютные изменения — шум")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'suite.db')}")
+    # Нагрузку дают несколько пользователей: ограничение частоты (throttling.py) здесь не нужно
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    seed(args)
+
+    # bot.py (его импортируют сценарии) включает журнал INFO, а httpx пишет в него каждый запрос
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    from sqlalchemy.engine import make_url
+
+    result = {
+        "config": {
+            "database": make_url(os.environ["DATABASE_URL"]).get_backend_name(),
+            "users": args.users,
+            "transactions": args.transactions,
+            "accounts": args.accounts,
+            "categories": args.categories,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "repeat": args.repeat,
+        },
+        "scenarios": asyncio.run(run(args)),
+    }
+
+    failed = sorted(name for name, scenario in result["scenarios"].items() if scenario["errors"])
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            result["comparison"] = compare(result, json.load(f), args.metric, args.threshold, args.min_delta_ms)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    print(output)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    if failed or (args.baseline and result["comparison"]["regressions"]):
+        if failed:
+            print(f"Сценарии с ошибками: {', '.join(failed)}", file=sys.stderr)
+        for regression in result.get("comparison", {}).get("regressions", []):
+            print(
+                f"Регрессия {regression['scenario']}: {args.metric} {regression['baseline']} -> {regression['current']}",
+                file=sys.stderr
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Смешанная нагрузка чтения и записи из двух процессов на одну базу SQLite.
+
+    python -m benchmarks.two_process [--seconds 10] [--concurrency 16] [--mode both|tuned|legacy]
+
+Один процесс работает как API (статистика, лента операций, запись операций
+через ASGI), другой — как бот (save_transaction и /stats). Оба открывают
+свой движок на один файл, как api.py и bot.py в продакшене. Режим legacy
+повторяет прежние настройки соединения SQLite (журнал DELETE, synchronous
+FULL), tuned — настройки init_db по умолчанию (WAL, busy_timeout, mmap,
+cache_size). Печатает в JSON пропускную способность, задержки и ошибки
+(в том числе «database is locked») каждого процесса.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+USERS = 20
+SEED_ROWS = 2000
+
+LEGACY_SQLITE = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE": "-2000",
+}
+
+
+def _result(name: str, latencies, reads: int, writes: int, errors, elapsed: float) -> dict:
+    from benchmarks.load_test import summarize
+
+    return {
+        "process": name,
+        "reads": reads,
+        "writes": writes,
+        "throughput_ops": round((reads + writes) / elapsed, 1),
+        "latency": summarize(latencies) if latencies else None,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+    }
+
+
+async def _drive(name: str, seconds: float, concurrency: int, read, write, read_share: float) -> dict:
+    latencies, errors = [], []
+    counts = {"reads": 0, "writes": 0}
+    deadline = time.perf_counter() + seconds
+
+    async def client(index: int):
+        rng = random.Random(index)
+        while time.perf_counter() < deadline:
+            user_id = rng.randint(1, USERS)
+            is_read = rng.random() < read_share
+            started = time.perf_counter()
+            try:
+                await (read(user_id, rng) if is_read else write(user_id, rng))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {str(e).splitlines()[0][:120]}")
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            counts["reads" if is_read else "writes"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return _result(name, latencies, counts["reads"], counts["writes"], errors, time.perf_counter() - started)
+
+
+def api_process(barrier, results, seconds: float, concurrency: int):
+    import httpx
+    import api
+    from database import Account
+
+    with api.SessionLocal() as db:
+        accounts = dict(db.query(Account.user_id, Account.id).all())
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            async def read(user_id, rng):
+                url = f"/api/stats/{user_id}" if rng.random() < 0.5 else f"/api/transactions/{user_id}?limit=50"
+                (await http.get(url)).raise_for_status()
+
+            async def write(user_id, rng):
+                (await http.post("/api/transactions", json={
+                    "user_id": user_id, "account_id": accounts[user_id], "type": "expense",
+                    "amount": str(Decimal(rng.randint(100, 10000)) / 100), "category": "food"
+                })).raise_for_status()
+
+            barrier.wait()
+            return await _drive("api", seconds, concurrency, read, write, read_share=0.7)
+
+    results.put(asyncio.run(run()))
+
+
+def bot_process(barrier, results, seconds: float, concurrency: int):
+    import bot
+    from database import Account, TransactionType, run_in_session
+
+    with bot.SessionLocal() as db:
+        accounts = dict(db.query(Account.user_id, Account.id).all())
+
+    async def read(user_id, rng):
+        await run_in_session(bot.SessionLocal, bot.load_stats, user_id)
+
+    async def write(user_id, rng):
+        recorded = await run_in_session(bot.SessionLocal, bot.save_transaction, user_id, TransactionType.INCOME, {
+            "amount": str(Decimal(rng.randint(100, 10000)) / 100), "account_id": accounts[user_id], "category": "salary"
+        })
+        if recorded is None:
+            raise RuntimeError("account not found")
+
+    async def run():
+        barrier.wait()
+        return await _drive("bot", seconds, concurrency, read, write, read_share=0.5)
+
+    results.put(asyncio.run(run()))
+
+
+def run_mode(mode: str, args) -> dict:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'two_process.db')}"
+    # Нагрузку дают несколько пользователей: ограничение частоты (throttling.py) здесь не нужно
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    for name, value in LEGACY_SQLITE.items():
+        if mode == "legacy":
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
+
+    from database import init_db
+    from benchmarks.seed import seed_user
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        for user_id in range(1, USERS + 1):
+            seed_user(db, telegram_id=user_id, transactions=SEED_ROWS, accounts=1, seed=user_id)
+    SessionLocal.kw["bind"].dispose()
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(2)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=target, args=(barrier, results, args.seconds, args.concurrency))
+        for target in (api_process, bot_process)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    by_process = {result.pop("process"): result for result in collected}
+    return {
+        "mode": mode,
+        "total_throughput_ops": round(sum(r["throughput_ops"] for r in by_process.values()), 1),
+        "total_errors": sum(r["errors"] for r in by_process.values()),
+        **by_process,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=["both", "tuned", "legacy"], default="both")
+    args = parser.parse_args()
+
+    modes = ["legacy", "tuned"] if args.mode == "both" else [args.mode]
+    print(json.dumps([run_mode(mode, args) for mode in modes], indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Обновление базы первой версии приложения до текущей схемы миграциями.
+
+    python -m benchmarks.upgrade_bench [--users 20] [--transactions 2000]
+
+Создаёт таблицы в том виде, в каком их создавал первый выпуск (категория
+операции — строка, ни сводки, ни журнала проводок), заполняет их
+синтетическими данными и открывает базу текущим init_db, как при
+развёртывании новой версии поверх старого файла. Затем проверяет, что
+применены все миграции, операции и балансы сохранились, сводка и журнал
+проводок сходятся (rollups.verify, ledger.verify). Печатает время
+обновления и результат проверок в JSON; код выхода 1, если проверка не
+прошла. DATABASE_URL — пустая база, по умолчанию временный файл SQLite.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import (
+    Column, DateTime, Enum, ForeignKey, Integer, MetaData, Numeric, String, Table, Text, create_engine, func, select
+)
+
+from database import TransactionType
+from benchmarks.seed import CATEGORIES
+
+# Схема первого выпуска
+legacy = MetaData()
+users = Table(
+    "users", legacy,
+    Column("telegram_id", Integer, primary_key=True),
+    Column("currency", String(3), default="RUB"),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+accounts = Table(
+    "accounts", legacy,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", Integer, ForeignKey("users.telegram_id")),
+    Column("name", String(50), nullable=False),
+    Column("balance", Numeric(10, 2), default=0.00),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+categories = Table(
+    "categories", legacy,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", Integer, ForeignKey("users.telegram_id"), nullable=False),
+    Column("name", String(50), nullable=False),
+    Column("icon", String(10), default="📝"),
+    Column("type", Enum(TransactionType), nullable=False),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+transactions = Table(
+    "transactions", legacy,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", Integer, ForeignKey("users.telegram_id")),
+    Column("account_id", Integer, ForeignKey("accounts.id")),
+    Column("type", Enum(TransactionType), nullable=False),
+    Column("amount", Numeric(10, 2), nullable=False),
+    Column("category", String(50), nullable=False),
+    Column("description", Text),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+
+
+def seed_legacy(engine, user_count: int, transaction_count: int, seed: int = 42) -> dict:
+    """Заполнить старую схему: у каждого пользователя два счёта и своя категория.
+
+    Категории операций — ключи встроенных категорий и id своей категории
+    строкой, как их записывала старая версия. Возвращает ожидаемые итоги.
+    """
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=730)
+    expected = {"transactions": 0, "balance": Decimal("0.00")}
+    legacy.create_all(engine)
+    with engine.begin() as conn:
+        for user_id in range(1, user_count + 1):
+            conn.execute(users.insert().values(telegram_id=user_id))
+            account_ids = [
+                conn.execute(accounts.insert().values(user_id=user_id, name=f"Счёт {i + 1}", balance=0)).inserted_primary_key[0]
+                for i in range(2)
+            ]
+            own = conn.execute(categories.insert().values(
+                user_id=user_id, name="Своя", type=TransactionType.EXPENSE
+            )).inserted_primary_key[0]
+            balances = {account_id: Decimal("0.00") for account_id in account_ids}
+            rows = []
+            for _ in range(transaction_count):
+                type_ = rng.choice(list(TransactionType))
+                amount = Decimal(rng.randint(100, 500000)) / 100
+                keys = CATEGORIES[type_] + ([str(own)] if type_ is TransactionType.EXPENSE else [])
+                account_id = rng.choice(account_ids)
+                balances[account_id] += amount if type_ is TransactionType.INCOME else -amount
+                rows.append({
+                    "user_id": user_id, "account_id": account_id, "type": type_, "amount": amount,
+                    "category": rng.choice(keys), "description": None,
+                    "created_at": start + timedelta(seconds=rng.randint(0, 730 * 86400)),
+                })
+            conn.execute(transactions.insert(), rows)
+            for account_id, balance in balances.items():
+                # Начальный остаток, который операциями не объясняется
+                balance += 1000
+                conn.execute(accounts.update().where(accounts.c.id == account_id).values(balance=balance))
+                expected["balance"] += balance
+            expected["transactions"] += len(rows)
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--transactions", type=int, default=2000, help="операций на пользователя")
+    args = parser.parse_args()
+
+    url = os.environ.get("DATABASE_URL") or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'upgrade.db')}"
+    engine = create_engine(url)
+    expected = seed_legacy(engine, args.users, args.transactions)
+    engine.dispose()
+
+    import ledger
+    import rollups
+    from database import Account, Transaction, init_db
+    from migrations import MIGRATIONS, current_version
+
+    started = time.perf_counter()
+    SessionLocal = init_db(url)
+    elapsed = time.perf_counter() - started
+
+    with SessionLocal() as db:
+        checks = {
+            "schema_version": current_version(db.connection()) == MIGRATIONS[-1][0],
+            "transactions": db.query(func.count(Transaction.id)).scalar() == expected["transactions"],
+            "categories": db.query(Transaction.id).filter(Transaction.category_id.is_(None)).first() is None,
+            "balance": db.scalar(select(func.sum(Account.balance))) == expected["balance"],
+            "rollups": not rollups.verify(db),
+            "ledger": not ledger.verify(db),
+        }
+    result = {
+        "config": {"users": args.users, "transactions": args.transactions},
+        "upgrade_seconds": round(elapsed, 2),
+        "checks": checks,
+    }
+    print(json.dumps(result, indent=2))
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
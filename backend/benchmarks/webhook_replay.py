@@ -0,0 +1,256 @@
+"""Нагрузка на webhook бота: записанные обновления Telegram с заданной частотой.
+
+    python -m benchmarks.webhook_replay [--users 20] [--count 2000] [--rate 500] [--concurrency 40]
+                                        [--workers 0] [--updates updates.jsonl] [--record updates.jsonl]
+
+Обновления берутся из файла JSONL (по одному JSON Update Telegram в строке,
+например из getUpdates) или генерируются: /start, /stats и операции из Web App
+для заранее созданных пользователей; --record сохраняет сгенерированные для
+повторного прогона. Ответы бота уходят в локальный сервер Bot API
+(benchmarks.fakes.FakeBotApi), а не в Telegram.
+
+С --workers 0 приложение API вызывается в процессе через httpx.ASGITransport,
+с --workers N харнесс запускает uvicorn api:app с N воркерами. --concurrency
+ограничивает число одновременных запросов, как max_connections у Telegram,
+--rate — частоту отправки (0 — без ограничения). В JSON печатаются ответы
+webhook по кодам (503 — очередь заполнена), задержки ответа webhook и
+пропускная способность обработки — по ответам бота, дошедшим до Bot API.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeBotApi
+from benchmarks.load_test import summarize
+
+SECRET = "bench-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def message(update_id: int, user_id: int, **fields) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            **fields,
+        },
+    }
+
+
+def command(update_id: int, user_id: int, text: str) -> dict:
+    return message(update_id, user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}])
+
+
+def web_app_data(update_id: int, user_id: int, data: dict) -> dict:
+    return message(update_id, user_id, web_app_data={"data": json.dumps(data), "button_text": "Finance"})
+
+
+def synthetic_updates(count: int, accounts: dict, seed: int = 42) -> list:
+    """Смесь обновлений, на каждое из которых бот отвечает ровно одним сообщением"""
+    rng = random.Random(seed)
+    users = sorted(accounts)
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = rng.choice(users)
+        kind = rng.random()
+        if kind < 0.1:
+            updates.append(command(update_id, user_id, "/start"))
+        elif kind < 0.3:
+            updates.append(command(update_id, user_id, "/stats"))
+        else:
+            type_, category = ("income", "salary") if kind < 0.45 else ("expense", "food")
+            updates.append(web_app_data(update_id, user_id, {
+                "type": type_, "amount": f"{rng.randint(100, 10000) / 100:.2f}",
+                "account_id": accounts[user_id], "category": category
+            }))
+    return updates
+
+
+def load_updates(path: str, count: int) -> list:
+    """Записанные обновления; если их меньше count, они повторяются с новыми update_id"""
+    with open(path, encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    updates = []
+    for update_id, update in zip(range(1, count + 1), itertools.cycle(recorded)):
+        updates.append({**update, "update_id": update_id})
+    return updates
+
+
+def seed(users: int, transactions: int) -> dict:
+    from database import init_db, Account
+    from benchmarks.seed import seed_user
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        for user_id in range(1, users + 1):
+            seed_user(db, telegram_id=user_id, transactions=transactions, accounts=1, seed=user_id)
+        accounts = dict(db.query(Account.user_id, Account.id).all())
+    SessionLocal.kw["bind"].dispose()
+    return accounts
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def send_all(http, updates: list, rate: float, concurrency: int) -> dict:
+    """Отправить обновления с частотой rate в секунду, не больше concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses, latencies = {}, []
+    started = time.perf_counter()
+
+    async def send(index: int, update: dict):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                response = await http.post("/telegram/webhook", json=update, headers={SECRET_HEADER: SECRET})
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - sent) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*(send(index, update) for index, update in enumerate(updates)))
+    elapsed = time.perf_counter() - started
+    return {
+        "statuses": statuses,
+        "send_seconds": round(elapsed, 2),
+        "send_rate": round(len(updates) / elapsed, 1),
+        "webhook_latency": summarize(latencies),
+    }
+
+
+async def check_secret(http) -> bool:
+    """Запрос без секретного токена должен получить 403"""
+    response = await http.post("/telegram/webhook", json=command(0, 1, "/start"), headers={SECRET_HEADER: "wrong"})
+    return response.status_code == 403
+
+
+async def run(args, updates: list, bot_api: FakeBotApi) -> dict:
+    import httpx
+
+    if args.workers:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            env=os.environ.copy()
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(
+                max_connections=args.concurrency
+            )) as http:
+                for _ in range(300):
+                    try:
+                        if (await http.get("/api/pool")).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.1)
+                return await measure(args, http, updates, bot_api)
+        finally:
+            server.terminate()
+            server.wait(30)
+
+    import api
+    # bot.py включает журнал INFO, а httpx пишет в него каждый запрос
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=api.app)
+    async with api.app.router.lifespan_context(api.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            return await measure(args, http, updates, bot_api)
+
+
+async def measure(args, http, updates: list, bot_api: FakeBotApi) -> dict:
+    secret_ok = await check_secret(http)
+    replies_before = bot_api.replies()
+    started = time.perf_counter()
+    result = await send_all(http, updates, args.rate, args.concurrency)
+    accepted = result["statuses"].get("200", 0)
+    # Обработчики догоняют очередь уже после ответа webhook: ждём ответы бота
+    replies = await asyncio.to_thread(bot_api.wait_replies, replies_before + accepted, args.idle) - replies_before
+    elapsed = time.perf_counter() - started
+    result.update(
+        secret_rejected=secret_ok,
+        accepted=accepted,
+        replies=replies,
+        processing_seconds=round(elapsed, 2),
+        processed_per_second=round(replies / elapsed, 1),
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--transactions", type=int, default=200, help="операций на пользователя в начальных данных")
+    parser.add_argument("--count", type=int, default=2000, help="сколько обновлений отправить")
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 — без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=40, help="одновременных запросов к webhook")
+    parser.add_argument("--workers", type=int, default=0, help="воркеров uvicorn (0 — приложение в процессе)")
+    parser.add_argument("--updates", help="файл JSONL с записанными обновлениями")
+    parser.add_argument("--record", help="сохранить сгенерированные обновления в JSONL")
+    parser.add_argument("--idle", type=float, default=5.0, help="сколько секунд ждать новых ответов бота")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'webhook.db')}")
+    # Нагрузку дают несколько пользователей: ограничение частоты (throttling.py) здесь не нужно
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+    os.environ["BOT_WEBHOOK_SECRET"] = SECRET
+    logging.basicConfig(level=logging.WARNING)
+    # Под нагрузкой запись в SQLite ждёт блокировку, и журнал медленных запросов заполняет вывод
+    logging.getLogger("slow_query").setLevel(logging.ERROR)
+
+    accounts = seed(args.users, args.transactions)
+    if args.updates:
+        updates = load_updates(args.updates, args.count)
+    else:
+        updates = synthetic_updates(args.count, accounts)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(update, ensure_ascii=False) + "\n" for update in updates)
+
+    with FakeBotApi() as bot_api:
+        os.environ["TELEGRAM_API_URL"] = bot_api.url
+        result = asyncio.run(run(args, updates, bot_api))
+        result["bot_api_calls"] = dict(bot_api.calls)
+
+    result = {
+        "config": {
+            "users": args.users,
+            "count": len(updates),
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "updates": args.updates or "synthetic",
+        },
+        **result,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    # На сгенерированные обновления бот отвечает ровно одним сообщением; у записанных ответов может не быть
+    if not result["secret_rejected"] or (not args.updates and result["replies"] < result["accepted"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
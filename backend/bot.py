@@ -1,14 +1,34 @@
+import asyncio
+import csv
+import functools
+import math
 import os
+import sys
 import json
 import logging
+import tempfile
+import time
 from datetime import datetime
 from decimal import Decimal
+from typing import Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 from telegram.constants import ParseMode
 
-from database import init_db, User, Account, Transaction, TransactionType
+from sqlalchemy.orm import Session
+
+from database import init_db, get_or_create_user, run_in_session, bump_data_version, User, Account, Transaction, TransactionType
+from reports import stats_body
+from export import iter_export_rows, iter_csv, iter_encoded
+from archive import has_archive
+from importer import import_transactions, parse_backup_csv
+from ledger import OPENING, post
+from recorder import AccountNotFound, GroupCommitter, record_transaction
+from schemas import TransactionCreate
+from cache import create_cache, user_key
+from metrics import instrument_handler, register_cache, registry, serve_metrics
+from throttling import create_limiter, throttled_requests_total
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,24 +41,129 @@ logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEB_APP_URL = os.getenv("WEB_APP_URL")
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+# Выгрузки больше этого размера /backup собирает на диске, а не в памяти
+BACKUP_SPOOL_SIZE = 4 * 1024 * 1024
+# Групповой коммит операций из Web App: сколько миллисекунд ждать попутчиков (0 — выключен)
+GROUP_COMMIT_MS = float(os.getenv("BOT_GROUP_COMMIT_MS", "0"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("BOT_GROUP_COMMIT_MAX_BATCH", "200"))
+# Порт HTTP-сервера с /metrics бота (0 — не запускать)
+METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "0"))
+# Свой сервер Bot API (telegram-bot-api --local) вместо api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+TRANSACTION_SAVED = {
+    TransactionType.EXPENSE: "✅ Расход записан!",
+    TransactionType.INCOME: "✅ Доход записан!",
+}
 
 SessionLocal = init_db()
+# С CACHE_URL (общий Redis) записи бота сбрасывают и кэш API
+user_cache = create_cache()
+register_cache("user", user_cache)
+# Ограничение частоты обновлений пользователя (throttling.py), те же настройки, что у API
+rate_limiter = create_limiter()
+
+def invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_key(user_id))
+
+group_committer = GroupCommitter(
+    SessionLocal,
+    max_delay=GROUP_COMMIT_MS / 1000,
+    max_batch=GROUP_COMMIT_MAX_BATCH,
+    on_commit=invalidate_users
+) if GROUP_COMMIT_MS > 0 else None
+
+def collect_group_commit():
+    stats = group_committer.metrics.stats()
+    yield "group_commit_batches_total", "counter", "Пакеты группового коммита", [({}, stats["batches"])]
+    yield "group_commit_transactions_total", "counter", "Операции, записанные групповым коммитом", [({}, stats["transactions"])]
+    yield "group_commit_batch_size_avg", "gauge", "Средний размер пакета (последние 1000)", [({}, stats["avg_batch_size"])]
+    yield "group_commit_commit_p95_ms", "gauge", "p95 длительности коммита пакета, мс", [({}, stats["commit_p95_ms"])]
+
+if group_committer is not None:
+    registry.register_collector(collect_group_commit)
 
-def get_user_session(telegram_id: int) -> User:
+def get_user_session(db: Session, telegram_id: int) -> User:
     """Получить или создать пользователя"""
-    user = SessionLocal.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        user = User(telegram_id=telegram_id)
-        SessionLocal.add(user)
-        
-        default_account = Account(user_id=telegram_id, name="Основной", balance=0.00)
-        SessionLocal.add(default_account)
-        SessionLocal.commit()
-    return user
+    return get_or_create_user(db, telegram_id)
+
+def load_stats(db: Session, telegram_id: int):
+    """Валюта и статистика пользователя из готового отчёта (reports.py)"""
+    user = get_user_session(db, telegram_id)
+    # Суммы в отчёте — числа; Decimal не добавляет к ним ошибку округления float
+    return user.currency, json.loads(stats_body(db, telegram_id), parse_float=Decimal)
+
+def build_backup_file(db: Session, telegram_id: int):
+    """CSV-выгрузка во временном файле (в памяти до BACKUP_SPOOL_SIZE байт)"""
+    get_user_session(db, telegram_id)
+    
+    if not db.query(Transaction.id).filter(Transaction.user_id == telegram_id).first() \
+            and not has_archive(db, telegram_id):
+        return None
+    
+    backup_file = tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_SIZE)
+    for chunk in iter_encoded(iter_csv(iter_export_rows(db, telegram_id))):
+        backup_file.write(chunk)
+    backup_file.seek(0)
+    return backup_file
+
+def save_account(db: Session, telegram_id: int, name: str, balance: Decimal):
+    get_user_session(db, telegram_id)
+    version = bump_data_version(db, telegram_id)
+    account = Account(user_id=telegram_id, name=name, balance=Decimal("0.00"), version=version)
+    db.add(account)
+    db.flush()
+    if balance:
+        post(db, telegram_id, account.id, balance, OPENING, version)
+    db.commit()
+    user_cache.invalidate(user_key(telegram_id))
+
+def web_app_transaction(telegram_id: int, type_: TransactionType, data: dict) -> TransactionCreate:
+    """Операция из сообщения Web App"""
+    return TransactionCreate(
+        user_id=telegram_id,
+        account_id=data.get('account_id'),
+        type=type_.value,
+        amount=Decimal(str(data.get('amount'))),
+        category=data.get('category'),
+        description=data.get('description', '')
+    )
+
+def save_transaction(db: Session, telegram_id: int, type_: TransactionType, data: dict) -> Optional[dict]:
+    """Записать операцию из Web App. Возвращает данные записи или None, если счёт не найден"""
+    try:
+        recorded = record_transaction(db, web_app_transaction(telegram_id, type_, data))
+    except AccountNotFound:
+        return None
+    user_cache.invalidate(user_key(telegram_id))
+    return recorded
+
+def import_backup(db: Session, telegram_id: int, text: str) -> int:
+    get_user_session(db, telegram_id)
+    transactions = parse_backup_csv(db, telegram_id, text)
+    import_transactions(db, transactions)
+    user_cache.invalidate(user_key(telegram_id))
+    return len(transactions)
+
+async def record_web_app_transaction(telegram_id: int, type_: TransactionType, data: dict) -> Optional[dict]:
+    """Записать операцию из Web App: групповым коммитом, если он включён"""
+    if group_committer is None:
+        return await run_in_session(SessionLocal, save_transaction, telegram_id, type_, data)
+    try:
+        return await group_committer.submit(web_app_transaction(telegram_id, type_, data))
+    except AccountNotFound:
+        return None
+
+async def shutdown(application: Application):
+    if group_committer is not None:
+        await group_committer.close()
+        logger.info(f"Групповой коммит: {group_committer.metrics.stats()}")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
-    user = get_user_session(update.effective_user.id)
+    await run_in_session(SessionLocal, get_user_session, update.effective_user.id)
     
     keyboard = [
         [InlineKeyboardButton(
@@ -57,50 +182,51 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /stats - показать статистику"""
-    user = get_user_session(update.effective_user.id)
-    
-    accounts = SessionLocal.query(Account).filter(Account.user_id == user.telegram_id).all()
-    transactions = SessionLocal.query(Transaction).filter(Transaction.user_id == user.telegram_id).all()
-    
-    total_balance = sum(acc.balance for acc in accounts)
-    total_income = sum(t.amount for t in transactions if t.type == TransactionType.INCOME)
-    total_expense = sum(t.amount for t in transactions if t.type == TransactionType.EXPENSE)
+    currency, summary = await run_in_session(SessionLocal, load_stats, update.effective_user.id)
     
     stats_text = f"📊 **Статистика**\n\n"
     stats_text += f"**Счета:**\n"
-    for acc in accounts:
-        stats_text += f"  • {acc.name}: {acc.balance:.2f} {user.currency}\n"
-    stats_text += f"\n**Общий баланс:** {total_balance:.2f} {user.currency}\n"
-    stats_text += f"**Доходы:** {total_income:.2f} {user.currency}\n"
-    stats_text += f"**Расходы:** {total_expense:.2f} {user.currency}\n"
-    stats_text += f"**Всего операций:** {len(transactions)}"
+    for acc in summary["accounts"]:
+        stats_text += f"  • {acc['name']}: {Decimal(acc['balance']):.2f} {currency}\n"
+    stats_text += f"\n**Общий баланс:** {Decimal(summary['total_balance']):.2f} {currency}\n"
+    stats_text += f"**Доходы:** {Decimal(summary['total_income']):.2f} {currency}\n"
+    stats_text += f"**Расходы:** {Decimal(summary['total_expense']):.2f} {currency}\n"
+    stats_text += f"**Всего операций:** {summary['transactions_count']}"
     
     await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
 
 async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /backup - экспорт в CSV"""
-    user = get_user_session(update.effective_user.id)
-    
-    transactions = SessionLocal.query(Transaction).filter(
-        Transaction.user_id == user.telegram_id
-    ).order_by(Transaction.created_at.desc()).all()
+    telegram_id = update.effective_user.id
+    backup_file = await run_in_session(SessionLocal, build_backup_file, telegram_id)
     
-    if not transactions:
+    if backup_file is None:
         await update.message.reply_text("Нет данных для экспорта.")
         return
     
-    csv_content = "ID,Тип,Сумма,Категория,Счёт,Описание,Дата\n"
-    for t in transactions:
-        account = SessionLocal.query(Account).filter(Account.id == t.account_id).first()
-        csv_content += f"{t.id},{t.type.value},{t.amount},{t.category},{account.name if account else ''},{t.description or ''},{t.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    filename = f"backup_{telegram_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    filename = f"backup_{user.telegram_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    with backup_file:
+        await update.message.reply_document(
+            document=backup_file,
+            filename=filename,
+            caption="📁 Ваш файл с данными"
+        )
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт операций из присланного CSV-файла в формате /backup"""
+    telegram_file = await update.message.document.get_file()
+    content = await telegram_file.download_as_bytearray()
     
-    await update.message.reply_document(
-        document=csv_content.encode('utf-8'),
-        filename=filename,
-        caption="📁 Ваш файл с данными"
-    )
+    try:
+        count = await run_in_session(
+            SessionLocal, import_backup, update.effective_user.id, content.decode('utf-8-sig')
+        )
+    except (ValueError, UnicodeDecodeError, csv.Error, AccountNotFound) as e:
+        await update.message.reply_text(f"❌ Не удалось импортировать файл: {e}")
+        return
+    
+    await update.message.reply_text(f"✅ Импортировано операций: {count}")
 
 async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка данных от Web App"""
@@ -108,91 +234,109 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
         try:
             data = json.loads(update.message.web_app_data.data)
             telegram_id = update.effective_user.id
-            user = get_user_session(telegram_id)
             
             action = data.get('type')
             
             if action == 'create_account':
                 name = data.get('name')
                 initial_balance = Decimal(str(data.get('balance', 0)))
-                account = Account(user_id=telegram_id, name=name, balance=initial_balance)
-                SessionLocal.add(account)
-                SessionLocal.commit()
+                await run_in_session(SessionLocal, save_account, telegram_id, name, initial_balance)
                 await update.message.reply_text(f"✅ Счёт '{name}' создан!")
                 
-            elif action == 'expense':
-                amount = Decimal(str(data.get('amount')))
-                account_id = data.get('account_id')
-                category = data.get('category')
-                description = data.get('description', '')
-                
-                account = SessionLocal.query(Account).filter(
-                    Account.id == account_id,
-                    Account.user_id == telegram_id
-                ).first()
-                
-                if account:
-                    transaction = Transaction(
-                        user_id=telegram_id,
-                        account_id=account_id,
-                        type=TransactionType.EXPENSE,
-                        amount=amount,
-                        category=category,
-                        description=description
-                    )
-                    account.balance -= amount
-                    SessionLocal.add(transaction)
-                    SessionLocal.commit()
-                    await update.message.reply_text(
-                        f"✅ Расход записан!\n"
-                        f"Сумма: {amount:.2f} {user.currency}\n"
-                        f"Категория: {category}\n"
-                        f"Счёт: {account.name}"
-                    )
-                    
-            elif action == 'income':
-                amount = Decimal(str(data.get('amount')))
-                account_id = data.get('account_id')
-                category = data.get('category')
-                description = data.get('description', '')
-                
-                account = SessionLocal.query(Account).filter(
-                    Account.id == account_id,
-                    Account.user_id == telegram_id
-                ).first()
-                
-                if account:
-                    transaction = Transaction(
-                        user_id=telegram_id,
-                        account_id=account_id,
-                        type=TransactionType.INCOME,
-                        amount=amount,
-                        category=category,
-                        description=description
-                    )
-                    account.balance += amount
-                    SessionLocal.add(transaction)
-                    SessionLocal.commit()
+            elif action in ('expense', 'income'):
+                type_ = TransactionType(action)
+                recorded = await record_web_app_transaction(telegram_id, type_, data)
+                if recorded:
                     await update.message.reply_text(
-                        f"✅ Доход записан!\n"
-                        f"Сумма: {amount:.2f} {user.currency}\n"
-                        f"Категория: {category}\n"
-                        f"Счёт: {account.name}"
+                        f"{TRANSACTION_SAVED[type_]}\n"
+                        f"Сумма: {recorded['amount']:.2f} {recorded['currency']}\n"
+                        f"Категория: {recorded['category']}\n"
+                        f"Счёт: {recorded['account_name']}"
                     )
                     
         except Exception as e:
             logger.error(f"Ошибка обработки данных Web App: {e}")
             await update.message.reply_text("❌ Произошла ошибка при обработке данных.")
 
+def rate_limited(handler):
+    """Пропускать обновление, если пользователь исчерпал лимит запросов.
+
+    О превышении бот пишет один раз за период ожидания, чтобы поток
+    сообщений не превращался в такой же поток ответов.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user is not None:
+            retry_after = rate_limiter.acquire(update.effective_user.id)
+            if retry_after is not None:
+                throttled_requests_total.inc("bot")
+                now = time.monotonic()
+                if context.user_data.get("throttled_until", 0) <= now and update.effective_message:
+                    context.user_data["throttled_until"] = now + retry_after
+                    await update.effective_message.reply_text(
+                        f"⏳ Слишком много запросов, повторите через {math.ceil(retry_after)} с."
+                    )
+                return
+        return await handler(update, context)
+
+    return wrapper
+
+def build_application(webhook: bool = False) -> Application:
+    """Приложение PTB с обработчиками бота.
+
+    В режиме webhook обновления приходят через маршрут API (webhook.py),
+    поэтому Updater для опроса Telegram не создаётся.
+    """
+    # Каждое обновление работает со своей сессией БД в пуле потоков,
+    # поэтому обновления разных чатов можно обрабатывать параллельно
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(CONCURRENT_UPDATES).post_shutdown(shutdown)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if webhook:
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # Каждый обработчик пишет длительность и число запросов к БД в метрики;
+    # обновления сверх лимита отбрасываются до обработчика и в них не попадают
+    application.add_handler(CommandHandler("start", rate_limited(instrument_handler(start))))
+    application.add_handler(CommandHandler("stats", rate_limited(instrument_handler(stats))))
+    application.add_handler(CommandHandler("backup", rate_limited(instrument_handler(backup))))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv"), rate_limited(instrument_handler(import_document))
+    ))
+    application.add_handler(MessageHandler(
+        filters.StatusUpdate.WEB_APP_DATA, rate_limited(instrument_handler(handle_web_app_data))
+    ))
+    return application
+
+async def set_webhook():
+    """Направить обновления бота на сервер API (BOT_WEBHOOK_URL + BOT_WEBHOOK_PATH)"""
+    # Настройки webhook читаются при импорте модуля, то есть уже после load_dotenv
+    from webhook import WEBHOOK_MAX_CONNECTIONS, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+    
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise SystemExit("Для режима webhook задайте BOT_WEBHOOK_URL и BOT_WEBHOOK_SECRET")
+    url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    async with build_application(webhook=True).bot as telegram_bot:
+        await telegram_bot.set_webhook(
+            url,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    logger.info(f"Webhook установлен: {url}")
+
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    # python bot.py webhook — один раз при развёртывании: дальше обновления
+    # принимает сервер API. Опрос (run_polling) снимает webhook
+    if sys.argv[1:] == ["webhook"]:
+        asyncio.run(set_webhook())
+        return
     
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("stats", stats))
-    application.add_handler(CommandHandler("backup", backup))
-    application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_data))
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    build_application().run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,202 @@
+"""Кэш ответов для чтения с явной инвалидацией при записи.
+
+По умолчанию используется LRU-кэш в памяти процесса. Если задан CACHE_URL
+(redis://...), кэш хранится в Redis-совместимом сервере и становится общим
+для всех воркеров uvicorn и бота, так что инвалидация из одного процесса
+видна остальным. Поколения ключей хранятся там же, где значения: загрузка,
+начатая в одном процессе до записи в другом, не положит в кэш устаревшее
+значение.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class LocalBackend:
+    """LRU-кэш в памяти процесса с ограничением по числу ключей"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key: str, value: Any, ttl: float):
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def generation(self, key: str) -> int:
+        return self._generations.get(key, 0)
+
+    def set_if_generation(self, key: str, value: Any, ttl: float, generation: int) -> bool:
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._items.pop(key, None)
+
+    def size(self) -> Optional[int]:
+        return len(self._items)
+
+
+class RedisBackend:
+    """Бэкенд поверх клиента с API redis-py (redis, fakeredis, KeyDB, Dragonfly...)"""
+
+    # Поколение живёт заведомо дольше любой загрузки и продлевается каждой инвалидацией
+    GENERATION_TTL = 24 * 60 * 60
+
+    def __init__(self, client, prefix: str = "finance-tracker:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _generation_key(self, key: str) -> str:
+        return f"{self.prefix}generation:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def generation(self, key: str) -> int:
+        raw = self.client.get(self._generation_key(key))
+        return int(raw) if raw is not None else 0
+
+    def set_if_generation(self, key: str, value: Any, ttl: float, generation: int) -> bool:
+        from redis.exceptions import WatchError
+
+        generation_key = self._generation_key(key)
+        with self.client.pipeline() as pipe:
+            try:
+                # WATCH: если инвалидация пройдёт между проверкой и SET, EXEC не выполнится
+                pipe.watch(generation_key)
+                raw = pipe.get(generation_key)
+                if (int(raw) if raw is not None else 0) != generation:
+                    return False
+                pipe.multi()
+                pipe.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def invalidate(self, key: str):
+        generation_key = self._generation_key(key)
+        with self.client.pipeline() as pipe:
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, self.GENERATION_TTL)
+            pipe.delete(self.prefix + key)
+            pipe.execute()
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class Cache:
+    """Read-through кэш со счётчиками попаданий и промахов.
+
+    Значения должны быть JSON-совместимыми. Инвалидация увеличивает поколение
+    ключа в бэкенде: если запись в любом процессе пришлась на время загрузки,
+    загруженное (уже устаревшее) значение в кэш не попадёт.
+    """
+
+    def __init__(self, backend, ttl: float = 30.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def generation(self, key: str) -> int:
+        """Текущее поколение ключа; запомнить перед загрузкой значения из БД"""
+        return self.backend.generation(key)
+
+    def set(self, key: str, value: Any, generation: int) -> bool:
+        """Сохранить значение, если ключ не инвалидировали после generation()"""
+        return self.backend.set_if_generation(key, value, self.ttl, generation)
+
+    def invalidate(self, key: str):
+        self.backend.invalidate(key)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "size": self.backend.size(),
+        }
+
+
+# Кэши по настройкам: API и бот в одном процессе (режим webhook) получают один
+# и тот же кэш, поэтому записи бота сбрасывают кэш API и без Redis
+_caches = {}
+
+
+def create_cache(url: str = None, ttl: float = None, max_size: int = None) -> Cache:
+    """Кэш по настройкам окружения: CACHE_URL, CACHE_TTL, CACHE_MAX_SIZE"""
+    url = url if url is not None else os.environ.get("CACHE_URL", "")
+    ttl = ttl if ttl is not None else float(os.environ.get("CACHE_TTL", "30"))
+    max_size = max_size if max_size is not None else int(os.environ.get("CACHE_MAX_SIZE", "10000"))
+    key = (url, ttl, max_size)
+    if key in _caches:
+        return _caches[key]
+
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL указывает на Redis, но пакет redis не установлен")
+        cache = Cache(RedisBackend(redis.Redis.from_url(url)), ttl)
+    else:
+        cache = Cache(LocalBackend(max_size), ttl)
+    _caches[key] = cache
+    return cache
+
+
+def user_key(telegram_id: int) -> str:
+    return f"user:{telegram_id}"
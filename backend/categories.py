@@ -0,0 +1,104 @@
+"""Категории операций.
+
+Операция ссылается на строку categories по category_id. Встроенные категории
+Web App (food, salary, ...) хранятся как категории пользователя с ключом key
+и создаются при первом использовании, свои категории пользователя ключа не
+имеют. Клиенты по-прежнему передают категорию строкой — ключом встроенной
+категории, id своей категории или произвольным названием (импорт CSV), — и
+в ответах получают её в том же виде (category_key), а также id, название и
+значок.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import String, cast, func, or_
+from sqlalchemy.orm import Session
+
+from database import Category, TransactionType
+
+DEFAULT_ICON = '📝'
+
+# Встроенные категории Web App (DEFAULT_CATEGORIES в frontend/src/App.jsx): ключ -> (название, значок)
+DEFAULT_CATEGORIES = {
+    TransactionType.INCOME: {
+        "salary": ("Зарплата", "💰"),
+        "freelance": ("Фриланс", "💻"),
+        "investments": ("Инвестиции", "📈"),
+        "gift": ("Подарок", "🎁"),
+        "other_income": ("Другое", "➕"),
+    },
+    TransactionType.EXPENSE: {
+        "food": ("Еда", "🍔"),
+        "transport": ("Транспорт", "🚗"),
+        "shopping": ("Покупки", "🛍"),
+        "entertainment": ("Развлечения", "🎬"),
+        "health": ("Здоровье", "🏥"),
+        "utilities": ("Коммуналка", "🏠"),
+        "education": ("Обучение", "📚"),
+        "other_expense": ("Другое", "➖"),
+    },
+}
+
+
+def category_key(category: Optional[Category]) -> Optional[str]:
+    """Категория в виде, в котором её передаёт клиент: ключ или id строкой"""
+    if category is None:
+        return None
+    return category.key if category.key is not None else str(category.id)
+
+
+def key_expression():
+    """category_key() в виде SQL-выражения"""
+    return func.coalesce(Category.key, cast(Category.id, String))
+
+
+def default_category(type_: TransactionType, key: str) -> Tuple[str, str]:
+    """Название и значок категории с ключом key"""
+    return DEFAULT_CATEGORIES[type_].get(key, (key[:50], DEFAULT_ICON))
+
+
+def resolve_categories(
+    db: Session,
+    user_id: int,
+    values: Iterable[Tuple[TransactionType, str]],
+    version: int
+) -> Dict[Tuple[TransactionType, str], Category]:
+    """Категории пользователя для пар (тип операции, категория строкой).
+
+    Строка из цифр сначала ищется как id своей категории, остальные — по
+    ключу среди категорий того же типа. Недостающие категории создаются с
+    ключом и версией данных version, поэтому вызывать нужно после
+    bump_data_version: записи пользователя идут по очереди, и одна категория
+    не создаётся дважды. Одним запросом на всю пачку операций.
+    """
+    values = {(type_, value) for type_, value in values if value}
+    if not values:
+        return {}
+    ids = {int(value) for _, value in values if value.isdigit()}
+    keys = {value for _, value in values}
+
+    by_id, by_key = {}, {}
+    for category in db.query(Category).filter(
+        Category.user_id == user_id,
+        or_(Category.id.in_(ids), Category.key.in_(keys))
+    ):
+        if category.id in ids:
+            by_id[category.id] = category
+        if category.key is not None:
+            by_key[(category.type, category.key)] = category
+
+    resolved = {}
+    for type_, value in values:
+        category = by_id.get(int(value)) if value.isdigit() else None
+        resolved[(type_, value)] = category or by_key.get((type_, value))
+
+    created = []
+    for (type_, value), category in resolved.items():
+        if category is None:
+            name, icon = default_category(type_, value)
+            category = Category(user_id=user_id, key=value, name=name, icon=icon, type=type_, version=version)
+            resolved[(type_, value)] = category
+            created.append(category)
+    if created:
+        db.add_all(created)
+        db.flush()
+    return resolved
@@ -0,0 +1,74 @@
+"""Инкрементальная синхронизация клиентов по версии данных пользователя.
+
+Каждая запись увеличивает users.data_version (bump_data_version) и помечает
+новой версией изменённые строки accounts, transactions и categories, а
+удаления оставляют отметку в deleted_rows. Клиенту, знающему версию своих
+данных, отдаются только строки с версией больше неё: сначала он применяет
+удаления, затем добавленные и изменённые строки.
+"""
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from database import Account, Category, DeletedRow, Transaction, get_data_version
+
+ENTITIES = {
+    "accounts": Account,
+    "transactions": Transaction,
+    "categories": Category,
+}
+
+# Если с версии клиента изменилось больше операций, ему проще перечитать
+# данные целиком (GET /api/user/{id}), чем получать их разницей
+MAX_CHANGED_TRANSACTIONS = 1000
+
+
+def record_deletion(db: Session, user_id: int, entity: str, entity_id: int, version: int):
+    """Запомнить удаление строки entity (accounts, transactions, categories)"""
+    db.add(DeletedRow(user_id=user_id, entity=entity, entity_id=entity_id, version=version))
+
+
+def collect_changes(db: Session, user_id: int, since: int, until: Optional[int] = None) -> dict:
+    """Строки пользователя, изменённые после версии since и не позже until.
+
+    Без until берётся текущая версия; она читается первой, так что запись,
+    закоммиченная между запросами, попадёт в следующую синхронизацию целиком.
+    reset=True означает, что разницу отдать нельзя и нужна полная загрузка.
+    """
+    version = get_data_version(db, user_id) if until is None else until
+    changes = {
+        "data_version": version,
+        "reset": since > version,
+        "deleted": {entity: [] for entity in ENTITIES},
+    }
+    for entity in ENTITIES:
+        changes[entity] = []
+    if since >= version:
+        return changes
+
+    def changed(model):
+        return db.query(model).filter(
+            model.user_id == user_id,
+            model.version > since,
+            model.version <= version
+        )
+
+    transactions = changed(Transaction).order_by(
+        Transaction.created_at.desc(), Transaction.id.desc()
+    ).limit(MAX_CHANGED_TRANSACTIONS + 1).all()
+    if len(transactions) > MAX_CHANGED_TRANSACTIONS:
+        changes["reset"] = True
+        return changes
+
+    changes["transactions"] = transactions
+    changes["accounts"] = changed(Account).order_by(Account.id).all()
+    changes["categories"] = changed(Category).order_by(Category.id).all()
+
+    deleted = defaultdict(list)
+    for entity, entity_id in changed(DeletedRow).with_entities(
+        DeletedRow.entity, DeletedRow.entity_id
+    ).order_by(DeletedRow.id):
+        deleted[entity].append(entity_id)
+    changes["deleted"].update(deleted)
+    return changes
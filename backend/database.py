@@ -1,12 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Enum, Text
+from sqlalchemy import create_engine, event, Boolean, Column, Integer, String, ForeignKey, DateTime, Enum, Text, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.types import Numeric
 from datetime import datetime
+import asyncio
 import enum
 from decimal import Decimal
+from typing import Optional
 import os
 
+from migrations import run_migrations
+from metrics import instrument_engine
+
 Base = declarative_base()
 
 class TransactionType(enum.Enum):
@@ -19,6 +27,8 @@ class User(Base):
     telegram_id = Column(Integer, primary_key=True)
     currency = Column(String(3), default='RUB')
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Растёт при каждой записи данных пользователя; из неё строится ETag
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     accounts = relationship("Account", back_populates="user", cascade="all, delete-orphan")
     transactions = relationship("Transaction", back_populates="user", cascade="all, delete-orphan")
@@ -26,62 +36,391 @@ class User(Base):
 
 class Account(Base):
     __tablename__ = 'accounts'
+    __table_args__ = (
+        # Инкрементальная синхронизация: WHERE user_id = ? AND version > ?
+        Index('ix_accounts_user_id_version', 'user_id', 'version'),
+        # Архив операций хранит account_id: id удалённого счёта не должен достаться новому
+        {'sqlite_autoincrement': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.telegram_id'))
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), index=True)
     name = Column(String(50), nullable=False)
     balance = Column(Numeric(10, 2), default=0.00)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # data_version пользователя при последнем изменении строки (см. changes.py)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
 
     user = relationship("User", back_populates="accounts")
     transactions = relationship("Transaction", back_populates="account")
 
 class Category(Base):
     __tablename__ = 'categories'
+    __table_args__ = (
+        Index('ix_categories_user_id_version', 'user_id', 'version'),
+        # Поиск встроенной категории по ключу; NULL-ключи своих категорий не конфликтуют
+        Index('ix_categories_user_id_type_key', 'user_id', 'type', 'key', unique=True),
+        # Как у счетов: архив операций ссылается на category_id
+        {'sqlite_autoincrement': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False, index=True)
+    # Ключ встроенной категории Web App (food, salary, ...) или прежнее текстовое
+    # значение из операций; NULL у категорий, созданных пользователем (см. categories.py)
+    key = Column(String(50))
     name = Column(String(50), nullable=False)
     icon = Column(String(10), default='📝')
     type = Column(Enum(TransactionType), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
 
     user = relationship("User", back_populates="categories")
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Лента операций пользователя: WHERE user_id = ? ORDER BY created_at DESC.
+        # Остальные колонки делают индекс покрывающим для аналитики по диапазону дат
+        Index('ix_transactions_user_id_created_at', 'user_id', 'created_at', 'account_id', 'type', 'category_id', 'amount'),
+        # Агрегаты по типу операции в статистике
+        Index('ix_transactions_user_id_type', 'user_id', 'type'),
+        Index('ix_transactions_user_id_version', 'user_id', 'version'),
+        Index('ix_transactions_idempotency_key', 'idempotency_key', unique=True),
+        # SQLite без AUTOINCREMENT выдаёт max(id) + 1 и повторил бы id удалённых
+        # или перенесённых в архив операций (archive.py)
+        {'sqlite_autoincrement': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.telegram_id'))
-    account_id = Column(Integer, ForeignKey('accounts.id'))
+    account_id = Column(Integer, ForeignKey('accounts.id'), index=True)
     type = Column(Enum(TransactionType), nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
-    category = Column(String(50), nullable=False)
+    # NULL — категория удалена
+    category_id = Column(Integer, ForeignKey('categories.id'), index=True)
     description = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # Ключ идемпотентности: повторная запись с тем же ключом нарушает уникальный
+    # индекс (операции регулярных платежей, см. recurring.py); NULL не конфликтуют
+    idempotency_key = Column(String(100))
 
     user = relationship("User", back_populates="transactions")
     account = relationship("Account", back_populates="transactions")
+    # Название и значок нужны в каждом ответе с операциями: подгружаем их тем же запросом
+    category_ref = relationship("Category", lazy="joined")
+
+    @property
+    def category(self) -> Optional[str]:
+        """Категория в виде, в котором её передаёт клиент (см. categories.category_key)"""
+        ref = self.category_ref
+        if ref is None:
+            return None
+        return ref.key if ref.key is not None else str(ref.id)
+
+    @property
+    def category_name(self) -> Optional[str]:
+        return self.category_ref.name if self.category_ref is not None else None
+
+    @property
+    def category_icon(self) -> Optional[str]:
+        return self.category_ref.icon if self.category_ref is not None else None
+
+class MonthlyRollup(Base):
+    """Суммы операций за месяц в разрезе счёта, категории и типа.
+
+    Обновляется в той же транзакции БД, что и сами операции (см. rollups.py),
+    поэтому статистика читает O(месяцев) строк вместо всей истории.
+    """
+    __tablename__ = 'monthly_rollups'
+
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), primary_key=True)
+    # 0 — операции, счёт которых удалён
+    account_id = Column(Integer, primary_key=True, autoincrement=False)
+    # 0 — операции без категории (категория удалена)
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    type = Column(Enum(TransactionType), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    total = Column(Numeric(12, 2), nullable=False, default=0)
+    transactions_count = Column(Integer, nullable=False, default=0)
+
+class TransactionArchive(Base):
+    """Операции пользователя за месяц, перенесённые из transactions (archive.py).
+
+    Одна строка на пользователя и месяц: сжатый zlib JSON-список операций.
+    Лента операций и выгрузка дочитывают архив, когда доходят до этих месяцев.
+    """
+    __tablename__ = 'transaction_archives'
+
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    transactions_count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedRollup(Base):
+    """Итоги заархивированных операций в разрезе monthly_rollups.
+
+    monthly_rollups при архивации не меняется, а rollups.rebuild складывает
+    итоги по transactions с этими строками, поэтому статистика и сводка после
+    пересчёта учитывают и архив. Ключ не уникален: повторная архивация месяца
+    добавляет строки.
+    """
+    __tablename__ = 'archived_rollups'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False, index=True)
+    account_id = Column(Integer, nullable=False)
+    category_id = Column(Integer, nullable=False)
+    type = Column(Enum(TransactionType), nullable=False)
+    month = Column(String(7), nullable=False)
+    total = Column(Numeric(12, 2), nullable=False)
+    transactions_count = Column(Integer, nullable=False)
+
+class RecurringRule(Base):
+    """Регулярная операция: зарплата, подписка и т.п.
+
+    Планировщик (scheduler.py) создаёт операции по правилу на даты
+    start_at + runs * interval периодов, пока next_run_at в прошлом.
+    """
+    __tablename__ = 'recurring_rules'
+    __table_args__ = (
+        # Выборка правил, по которым пора создать операции
+        Index('ix_recurring_rules_active_next_run_at', 'active', 'next_run_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False, index=True)
+    # NULL — счёт удалён, правило при этом выключается
+    account_id = Column(Integer, ForeignKey('accounts.id'))
+    type = Column(Enum(TransactionType), nullable=False)
+    amount = Column(Numeric(10, 2), nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.id'))
+    description = Column(Text)
+    # day, week или month; interval — через сколько периодов повторять
+    period = Column(String(10), nullable=False)
+    interval = Column(Integer, nullable=False, default=1)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime)
+    # Сколько операций уже создано и дата следующей
+    runs = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False)
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    category_ref = relationship("Category", lazy="joined")
+
+    @property
+    def category(self) -> Optional[str]:
+        """Категория в виде, в котором её передаёт клиент, как у Transaction"""
+        ref = self.category_ref
+        if ref is None:
+            return None
+        return ref.key if ref.key is not None else str(ref.id)
+
+class UserReport(Base):
+    """Готовая статистика пользователя (stats.compute_stats) в JSON.
+
+    Действительна, пока data_version совпадает с версией данных пользователя
+    (см. reports.py): /stats читает одну строку вместо агрегатов по сводке.
+    """
+    __tablename__ = 'user_reports'
+
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), primary_key=True)
+    data_version = Column(Integer, nullable=False)
+    body = Column(Text, nullable=False)
+    computed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class LedgerEntry(Base):
+    """Проводка по счёту: каждое изменение баланса, только добавление.
+
+    Баланс счёта равен сумме его проводок, а баланс на момент T — сумме
+    проводок с created_at <= T (см. ledger.py). Строки не изменяются и не
+    удаляются, в том числе при удалении счёта или операции.
+    """
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        Index('ix_ledger_entries_account_id_created_at', 'account_id', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Без внешних ключей: история остаётся после удаления счёта или операции
+    account_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    transaction_id = Column(Integer)
+    delta = Column(Numeric(12, 2), nullable=False)
+    # opening, adjustment, transaction, reversal, import
+    reason = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class DeletedRow(Base):
+    """Отметка об удалённой строке для инкрементальной синхронизации клиентов"""
+    __tablename__ = 'deleted_rows'
+    __table_args__ = (
+        Index('ix_deleted_rows_user_id_version', 'user_id', 'version'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False)
+    # Имя таблицы: accounts, transactions или categories
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def _configure_sqlite(engine):
+    """PRAGMA на каждом новом соединении SQLite.
+
+    WAL позволяет читать во время записи, а busy_timeout заставляет писателя
+    ждать блокировку, а не сразу падать с «database is locked», когда API и
+    бот пишут в один файл из разных процессов.
+    """
+    pragmas = {
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "busy_timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        # В режиме WAL NORMAL не теряет целостность, лишь последние коммиты при сбое питания
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+        # Отрицательное значение — размер в КиБ
+        "cache_size": _env_int("SQLITE_CACHE_SIZE", -64000),
+    }
+    in_memory = engine.url.database in (None, "", ":memory:")
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if name == "journal_mode" and in_memory:
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def _track_pool(engine):
+    """Счётчики событий пула для pool_stats()"""
+    counters = {"connects": 0, "checkouts": 0, "checkins": 0, "invalidations": 0}
+
+    def count(name):
+        def listener(*args):
+            counters[name] += 1
+        return listener
+
+    event.listen(engine, "connect", count("connects"))
+    event.listen(engine, "checkout", count("checkouts"))
+    event.listen(engine, "checkin", count("checkins"))
+    event.listen(engine, "invalidate", count("invalidations"))
+    engine.pool_counters = counters
+
+# Фабрики сессий по URL базы. API и бот в одном процессе (режим webhook)
+# получают одну фабрику, а с ней общий движок и пул соединений
+_session_factories = {}
 
 def init_db(database_url: str = None):
     # Получаем URL из переменных окружения или используем SQLite по умолчанию
     if database_url is None:
         database_url = os.environ.get("DATABASE_URL", "sqlite:///./finance_tracker.db")
+    if database_url in _session_factories:
+        return _session_factories[database_url]
+
+    # Размер пула на процесс: API и бот в отдельных процессах держат каждый свой пул
+    pool_options = {
+        "pool_size": _env_int("DB_POOL_SIZE", 10),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 20),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+    }
 
     # Настройки для PostgreSQL
     if database_url.startswith("postgresql://") or database_url.startswith("postgres://"):
         engine = create_engine(
             database_url,
             pool_pre_ping=True,
-            pool_recycle=300
+            pool_recycle=_env_int("DB_POOL_RECYCLE", 300),
+            **pool_options
         )
     else:
-        # Настройки для SQLite
+        # Настройки для SQLite: у базы в памяти свой пул без этих параметров
+        in_memory = make_url(database_url).database in (None, "", ":memory:")
         engine = create_engine(
             database_url,
-            connect_args={"check_same_thread": False}
+            connect_args={
+                "check_same_thread": False,
+                "timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000,
+            },
+            **({} if in_memory else pool_options)
         )
+        _configure_sqlite(engine)
 
+    _track_pool(engine)
+    instrument_engine(engine)
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    _session_factories[database_url] = SessionLocal
     return SessionLocal
+
+def pool_stats(session_factory) -> dict:
+    """Состояние пула соединений движка, к которому привязана фабрика сессий"""
+    engine = session_factory.kw["bind"]
+    pool = engine.pool
+    stats = {
+        "dialect": engine.dialect.name,
+        "pool": type(pool).__name__,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "timeout": pool.timeout(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # QueuePool считает overflow от -size; наружу отдаём только сверх пула
+            "overflow": max(pool.overflow(), 0),
+        })
+    stats.update(getattr(engine, "pool_counters", {}))
+    return stats
+
+def get_or_create_user(db, telegram_id: int) -> User:
+    """Получить пользователя или создать его вместе с основным счётом"""
+    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    if user:
+        return user
+
+    user = User(telegram_id=telegram_id)
+    db.add(user)
+    db.add(Account(user_id=telegram_id, name="Основной", balance=0.00))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельный запрос (бот или API) успел создать пользователя первым
+        db.rollback()
+        return db.query(User).filter(User.telegram_id == telegram_id).one()
+    db.refresh(user)
+    return user
+
+def bump_data_version(db, user_id: int) -> int:
+    """Увеличить версию данных пользователя в той же транзакции, что и запись.
+
+    Возвращает новую версию: ею помечаются строки, изменённые этой записью.
+    UPDATE блокирует строку пользователя до конца транзакции, поэтому
+    параллельные записи получают разные версии.
+    """
+    db.query(User).filter(User.telegram_id == user_id).update(
+        {User.data_version: User.data_version + 1}, synchronize_session=False
+    )
+    return get_data_version(db, user_id)
+
+def get_data_version(db, user_id: int) -> int:
+    return db.query(User.data_version).filter(User.telegram_id == user_id).scalar() or 0
+
+async def run_in_session(session_factory, fn, *args, **kwargs):
+    """Выполнить fn(db, *args, **kwargs) в пуле потоков в отдельной сессии.
+
+    Синхронные запросы SQLAlchemy не блокируют event loop; сессия живёт ровно
+    один вызов и закрывается в том же потоке.
+    """
+    def unit_of_work():
+        with session_factory() as db:
+            return fn(db, *args, **kwargs)
+
+    return await asyncio.to_thread(unit_of_work)
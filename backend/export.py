@@ -0,0 +1,104 @@
+import csv
+import io
+import zlib
+from typing import Iterable, Iterator
+
+from sqlalchemy.orm import Session
+
+from archive import archived_months, archived_transactions
+from categories import key_expression
+from database import Account, Category, Transaction
+
+CSV_HEADER = ["ID", "Тип", "Сумма", "Категория", "Счёт", "Описание", "Дата"]
+
+# Сколько строк забирать из БД за раз (серверный курсор на PostgreSQL)
+BATCH_SIZE = 1000
+
+
+def iter_export_rows(db: Session, user_id: int) -> Iterator[tuple]:
+    """Операции пользователя с категорией и названием счёта одним запросом, порциями по BATCH_SIZE.
+
+    Категория выгружается в том же виде, что и в API (ключ или id), чтобы
+    файл импортировался обратно в те же категории. Заархивированные операции
+    (archive.py) старше всех оставшихся и идут после них.
+    """
+    query = db.query(
+        Transaction.id,
+        Transaction.type,
+        Transaction.amount,
+        key_expression(),
+        Account.name,
+        Transaction.description,
+        Transaction.created_at,
+    ).outerjoin(Account, Account.id == Transaction.account_id).outerjoin(
+        Category, Category.id == Transaction.category_id
+    ).filter(
+        Transaction.user_id == user_id
+    ).order_by(
+        Transaction.created_at.desc(), Transaction.id.desc()
+    ).execution_options(yield_per=BATCH_SIZE)
+
+    for id_, type_, amount, category, account_name, description, created_at in query:
+        yield (
+            id_,
+            type_.value,
+            amount,
+            category or '',
+            account_name or '',
+            description or '',
+            created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+    months = archived_months(db, user_id)
+    if not months:
+        return
+    accounts = dict(db.query(Account.id, Account.name).filter(Account.user_id == user_id).all())
+    for row in archived_transactions(db, user_id, months):
+        yield (
+            row["id"],
+            row["type"].value,
+            row["amount"],
+            row["category"] or '',
+            accounts.get(row["account_id"], ''),
+            row["description"] or '',
+            row["created_at"].strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+
+def iter_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    """CSV с заголовком кусками примерно по BATCH_SIZE строк.
+
+    csv.writer экранирует запятые, кавычки и переводы строк в описаниях.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_encoded(chunks: Iterable[str], compress: bool = False) -> Iterator[bytes]:
+    """Перекодировать куски в UTF-8 и, при необходимости, сжать их потоково в gzip"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(session_factory, user_id: int, compress: bool = False) -> Iterator[bytes]:
+    """Генератор CSV-выгрузки со своей сессией: живёт столько же, сколько ответ"""
+    with session_factory() as db:
+        yield from iter_encoded(iter_csv(iter_export_rows(db, user_id)), compress)
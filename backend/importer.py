@@ -0,0 +1,122 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Sequence
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from categories import resolve_categories
+from database import Account, Transaction, TransactionType, bump_data_version
+from export import CSV_HEADER
+from ledger import IMPORT, post, signed_amount
+from rollups import apply_rows
+from schemas import TransactionCreate
+
+# Размер пачки для executemany: SQLAlchemy разворачивает её в многострочные INSERT
+IMPORT_BATCH_SIZE = 5000
+
+
+def import_transactions(db: Session, transactions: Sequence[TransactionCreate]) -> Dict[int, int]:
+    """Вставить операции пачками в одной транзакции БД.
+
+    Баланс каждого затронутого счёта и месячная сводка меняются одним
+    запросом на ключ, а не построчно. Возвращает {user_id: новая версия данных}.
+    При ошибке в любой строке ничего не записывается (ValueError с номером строки).
+    """
+    account_ids = {t.account_id for t in transactions}
+    owners = dict(db.query(Account.id, Account.user_id).filter(Account.id.in_(account_ids)).all())
+
+    deltas = defaultdict(Decimal)
+    versions = {}
+    rows = []
+    now = datetime.utcnow()
+    for index, t in enumerate(transactions):
+        if owners.get(t.account_id) != t.user_id:
+            raise ValueError(f"Row {index}: account {t.account_id} not found")
+        try:
+            type_ = TransactionType(t.type)
+        except ValueError:
+            raise ValueError(f"Row {index}: unknown transaction type '{t.type}'")
+
+        deltas[t.account_id] += signed_amount(type_, t.amount)
+        rows.append({
+            "user_id": t.user_id,
+            "account_id": t.account_id,
+            "type": type_,
+            "amount": t.amount,
+            "category": t.category,
+            "description": t.description,
+            "created_at": t.created_at or now,
+        })
+
+    try:
+        for user_id in {row["user_id"] for row in rows}:
+            versions[user_id] = bump_data_version(db, user_id)
+        categories = {
+            user_id: resolve_categories(
+                db, user_id, [(row["type"], row["category"]) for row in rows if row["user_id"] == user_id], version
+            )
+            for user_id, version in versions.items()
+        }
+        for row in rows:
+            row["version"] = versions[row["user_id"]]
+            category = categories[row["user_id"]].get((row["type"], row.pop("category")))
+            row["category_id"] = category.id if category is not None else None
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            db.execute(Transaction.__table__.insert(), rows[start:start + IMPORT_BATCH_SIZE])
+        for account_id, delta in deltas.items():
+            user_id = owners[account_id]
+            post(db, user_id, account_id, delta, IMPORT, versions[user_id])
+        apply_rows(db, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return versions
+
+
+def parse_backup_csv(db: Session, telegram_id: int, text: str) -> List[TransactionCreate]:
+    """Разобрать CSV в формате /backup. Недостающие счета создаются по названию.
+
+    Созданные счета помечаются версией данных, как при записи через API, —
+    клиенты получат их в /changes вместе с импортированными операциями.
+    """
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if header != CSV_HEADER:
+        raise ValueError("Unexpected CSV header")
+
+    accounts = dict(db.query(Account.name, Account.id).filter(Account.user_id == telegram_id).all())
+    version = None
+    transactions = []
+    for line, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        try:
+            _, type_, amount, category, account_name, description, created_at = row
+            account_name = account_name or "Основной"
+            if account_name not in accounts and version is None:
+                # Блокировка пользователя до коммита; счета перечитываются под ней,
+                # чтобы параллельный импорт не создал тот же счёт дважды
+                version = bump_data_version(db, telegram_id)
+                accounts.update(db.query(Account.name, Account.id).filter(Account.user_id == telegram_id).all())
+            if account_name not in accounts:
+                account = Account(user_id=telegram_id, name=account_name, balance=Decimal("0.00"), version=version)
+                db.add(account)
+                db.flush()
+                accounts[account_name] = account.id
+            transactions.append(TransactionCreate(
+                user_id=telegram_id,
+                account_id=accounts[account_name],
+                type=type_,
+                amount=Decimal(amount),
+                category=category,
+                description=description,
+                created_at=datetime.fromisoformat(created_at)
+            ))
+        except (ValueError, InvalidOperation, ValidationError) as e:
+            raise ValueError(f"Line {line}: {e}")
+    return transactions
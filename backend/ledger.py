@@ -0,0 +1,137 @@
+"""Журнал проводок по счетам и атомарное изменение балансов.
+
+    python ledger.py verify [--user ID]                    # сверить балансы с журналом
+    python ledger.py balance ACCOUNT_ID [--at 2024-01-31]  # баланс счёта на момент времени
+
+Баланс меняется только через post(): один UPDATE accounts SET balance =
+balance + :delta без чтения значения в Python и проводка в ledger_entries
+в той же транзакции БД. Параллельные записи из бота и API не затирают друг
+друга, а суммы не проходят через float.
+"""
+import argparse
+import sys
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Account, LedgerEntry, Transaction, TransactionType
+
+OPENING = "opening"
+ADJUSTMENT = "adjustment"
+TRANSACTION = "transaction"
+REVERSAL = "reversal"
+IMPORT = "import"
+# При удалении счёта журнал обнуляется: SQLite может выдать его id новому счёту
+CLOSING = "closing"
+
+
+def signed_amount(type_: TransactionType, amount: Decimal) -> Decimal:
+    """Изменение баланса счёта от операции"""
+    return -amount if type_ == TransactionType.EXPENSE else amount
+
+
+def post(db: Session, user_id: int, account_id: int, delta: Decimal, reason: str,
+         version: Optional[int] = None, transaction_id: Optional[int] = None):
+    """Изменить баланс счёта на delta и записать проводку.
+
+    version — версия данных пользователя для инкрементальной синхронизации
+    (см. changes.py): счёт с новым балансом попадёт в ответ клиенту.
+    """
+    values = {Account.balance: Account.balance + delta}
+    if version is not None:
+        values[Account.version] = version
+    db.query(Account).filter(Account.id == account_id).update(values, synchronize_session=False)
+    db.add(LedgerEntry(
+        account_id=account_id,
+        user_id=user_id,
+        transaction_id=transaction_id,
+        delta=delta,
+        reason=reason,
+        created_at=datetime.utcnow()
+    ))
+
+
+def post_transaction(db: Session, transaction: Transaction, version: Optional[int] = None, sign: int = 1):
+    """Провести операцию по её счёту (sign=1) или сторнировать её (sign=-1)"""
+    if transaction.account_id is None:
+        return
+    post(
+        db, transaction.user_id, transaction.account_id,
+        sign * signed_amount(transaction.type, transaction.amount),
+        TRANSACTION if sign > 0 else REVERSAL,
+        version, transaction.id
+    )
+
+
+def lock_account(db: Session, account_id: int) -> Optional[Account]:
+    """Прочитать счёт под блокировкой строки (SELECT ... FOR UPDATE в PostgreSQL).
+
+    Нужна, когда новое значение зависит от текущего баланса, например при
+    установке баланса вручную. SQLite не поддерживает FOR UPDATE, но там
+    bump_data_version в начале записи уже держит блокировку базы на запись.
+    """
+    return db.query(Account).filter(Account.id == account_id).with_for_update().populate_existing().first()
+
+
+def balance_at(db: Session, account_id: int, at: Optional[datetime] = None) -> Decimal:
+    """Баланс счёта по журналу на момент at (по умолчанию — текущий)"""
+    query = db.query(func.coalesce(func.sum(LedgerEntry.delta), 0)).filter(LedgerEntry.account_id == account_id)
+    if at is not None:
+        query = query.filter(LedgerEntry.created_at <= at)
+    return Decimal(str(query.scalar())).quantize(Decimal("0.01"))
+
+
+def verify(db: Session, user_id: Optional[int] = None) -> List[str]:
+    """Сравнить балансы счетов с суммами их проводок. Возвращает список расхождений"""
+    totals = db.query(
+        LedgerEntry.account_id, func.sum(LedgerEntry.delta)
+    ).group_by(LedgerEntry.account_id)
+    accounts = db.query(Account.id, Account.balance)
+    if user_id is not None:
+        totals = totals.filter(LedgerEntry.user_id == user_id)
+        accounts = accounts.filter(Account.user_id == user_id)
+    expected = {account_id: Decimal(str(total)).quantize(Decimal("0.01")) for account_id, total in totals}
+
+    problems = []
+    for account_id, balance in accounts.order_by(Account.id):
+        stored = Decimal(str(balance or 0)).quantize(Decimal("0.01"))
+        journal = expected.pop(account_id, Decimal("0.00"))
+        if stored != journal:
+            problems.append(f"счёт {account_id}: баланс {stored}, по журналу {journal}")
+    # Удалённые счета закрываются проводкой closing и должны сходиться к нулю
+    for account_id, journal in sorted(expected.items()):
+        if journal:
+            problems.append(f"удалённый счёт {account_id}: по журналу {journal}")
+    return problems
+
+
+def main():
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["verify", "balance"])
+    parser.add_argument("account_id", type=int, nargs="?")
+    parser.add_argument("--user", type=int, default=None)
+    parser.add_argument("--at", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        if args.command == "balance":
+            if args.account_id is None:
+                parser.error("balance требует ACCOUNT_ID")
+            print(balance_at(db, args.account_id, args.at))
+            return
+
+        problems = verify(db, args.user)
+        for problem in problems:
+            print(problem)
+        print(f"Расхождений: {len(problems)}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
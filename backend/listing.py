@@ -0,0 +1,146 @@
+import base64
+import itertools
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from archive import archived_months, archived_transactions
+from categories import key_expression
+from database import Category, Transaction, TransactionType
+from rollups import month_key
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Поля ответа об операции (schemas.TransactionResponse) в том же порядке
+TRANSACTION_COLUMNS = (
+    Transaction.id,
+    Transaction.type,
+    Transaction.amount,
+    key_expression().label("category"),
+    Transaction.category_id,
+    Category.name.label("category_name"),
+    Category.icon.label("category_icon"),
+    Transaction.description,
+    Transaction.account_id,
+    Transaction.created_at,
+)
+
+
+def transaction_rows(db: Session):
+    """Запрос операций кортежами колонок ответа: без ORM-объектов и identity map"""
+    return db.query(*TRANSACTION_COLUMNS).outerjoin(Category, Category.id == Transaction.category_id)
+
+
+def encode_cursor(created_at: datetime, transaction_id: int) -> str:
+    """Курсор на позицию после операции: (created_at, id) в base64"""
+    raw = f"{created_at.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, transaction_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def list_transactions(
+    db: Session,
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    type: Optional[str] = None,
+    category: Optional[str] = None,
+    category_id: Optional[int] = None,
+    account_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    amount_min: Optional[Decimal] = None,
+    amount_max: Optional[Decimal] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Страница операций пользователя от новых к старым.
+
+    Пагинация по ключу (created_at, id): каждая страница — это поиск по индексу
+    (user_id, created_at) от позиции курсора, без OFFSET, поэтому время ответа
+    не зависит от длины истории. category — категория в виде, в котором её
+    передаёт клиент (ключ или id строкой), category_id — id категории.
+    Возвращает операции словарями с полями TransactionResponse и курсор
+    следующей страницы (None, если страница последняя).
+
+    Операции старше горизонта архивации (archive.py) дочитываются из архива,
+    только если страница доходит до заархивированных месяцев.
+    """
+    conditions = []
+    query = transaction_rows(db).filter(Transaction.user_id == user_id)
+
+    # Каждый фильтр применяется и в SQL, и к операциям из архива
+    if type is not None:
+        type_ = TransactionType(type)
+        query = query.filter(Transaction.type == type_)
+        conditions.append(lambda row: row["type"] == type_)
+    if category is not None:
+        # Категория операции всегда принадлежит её пользователю, так что хватает присоединённой строки
+        query = query.filter(key_expression() == category)
+        conditions.append(lambda row: row["category"] == category)
+    if category_id is not None:
+        query = query.filter(Transaction.category_id == category_id)
+        conditions.append(lambda row: row["category_id"] == category_id)
+    if account_id is not None:
+        query = query.filter(Transaction.account_id == account_id)
+        conditions.append(lambda row: row["account_id"] == account_id)
+    if date_from is not None:
+        query = query.filter(Transaction.created_at >= date_from)
+        conditions.append(lambda row: row["created_at"] >= date_from)
+    if date_to is not None:
+        query = query.filter(Transaction.created_at < date_to)
+        conditions.append(lambda row: row["created_at"] < date_to)
+    if amount_min is not None:
+        query = query.filter(Transaction.amount >= amount_min)
+        conditions.append(lambda row: row["amount"] >= amount_min)
+    if amount_max is not None:
+        query = query.filter(Transaction.amount <= amount_max)
+        conditions.append(lambda row: row["amount"] <= amount_max)
+
+    upper = date_to
+    if cursor is not None:
+        created_at, transaction_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Transaction.created_at < created_at,
+            and_(Transaction.created_at == created_at, Transaction.id < transaction_id)
+        ))
+        conditions.append(lambda row: (row["created_at"], row["id"]) < (created_at, transaction_id))
+        upper = min(upper, created_at) if upper is not None else created_at
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = [row._asdict() for row in query.order_by(
+        Transaction.created_at.desc(), Transaction.id.desc()
+    ).limit(limit + 1)]
+
+    # Месяцы архива между позицией курсора и последней строкой страницы:
+    # если страница заполнена более новыми операциями, архив не читается
+    lower = rows[limit]["created_at"] if len(rows) > limit else None
+    if date_from is not None and (lower is None or date_from > lower):
+        lower = date_from
+    months = archived_months(
+        db, user_id,
+        month_from=month_key(lower) if lower is not None else None,
+        month_to=month_key(upper) if upper is not None else None
+    )
+    if months:
+        # Архив отдаётся от новых к старым, так что хватает первых limit + 1 подходящих операций
+        archived = itertools.islice(
+            (row for row in archived_transactions(db, user_id, months) if all(c(row) for c in conditions)),
+            limit + 1
+        )
+        rows = sorted(
+            itertools.chain(rows, archived), key=lambda row: (row["created_at"], row["id"]), reverse=True
+        )[:limit + 1]
+
+    next_cursor = encode_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
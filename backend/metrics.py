@@ -0,0 +1,317 @@
+"""Метрики производительности в текстовом формате Prometheus.
+
+Запросы API (MetricsMiddleware) и обработчики бота (instrument_handler)
+пишут гистограммы длительности, числа запросов к БД и времени в БД. Запросы
+к БД считаются через события движка SQLAlchemy (instrument_engine); они идут
+в пуле потоков, но contextvars копируются в asyncio.to_thread, поэтому
+попадают в счётчики своего HTTP-запроса или обновления бота. Запросы
+дольше SLOW_QUERY_MS пишутся в лог slow_query с текстом SQL и местом вызова,
+а запросы API и обработчики с подозрительно большим числом обращений к БД
+(N+1) — в лог с порогом REQUEST_QUERY_WARN.
+"""
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_query")
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+REQUEST_QUERY_WARN = int(os.environ.get("REQUEST_QUERY_WARN", "50"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# Счётчики текущего HTTP-запроса или обновления бота: {"queries": int, "db_seconds": float}
+current_unit = contextvars.ContextVar("metrics_unit", default=None)
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# Сбор значений в момент выдачи /metrics: (имя, тип, описание, [(метки, значение)])
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Длительность запросов API", ["method", "route", "status"]
+))
+http_request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "Число запросов к БД на запрос API", ["route"], QUERY_COUNT_BUCKETS
+))
+http_request_db_seconds = registry.register(Histogram(
+    "http_request_db_seconds", "Время в БД на запрос API", ["route"]
+))
+bot_handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Длительность обработчиков бота", ["handler", "status"]
+))
+bot_handler_db_queries = registry.register(Histogram(
+    "bot_handler_db_queries", "Число запросов к БД на обработчик бота", ["handler"], QUERY_COUNT_BUCKETS
+))
+bot_handler_db_seconds = registry.register(Histogram(
+    "bot_handler_db_seconds", "Время в БД на обработчик бота", ["handler"]
+))
+db_queries_total = registry.register(Counter(
+    "db_queries_total", "Запросы к БД", ["operation"]
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Длительность отдельных запросов к БД", ["operation"]
+))
+db_slow_queries_total = registry.register(Counter(
+    "db_slow_queries_total", "Запросы к БД дольше SLOW_QUERY_MS", ["operation"]
+))
+
+
+_registered_caches = set()
+
+
+def register_cache(name: str, cache):
+    """Отдавать в /metrics попадания и промахи кэша (объект cache.Cache).
+
+    Повторная регистрация того же имени (API и бот в одном процессе) ничего
+    не делает: серии с одинаковыми метками в выдаче недопустимы.
+    """
+    if name in _registered_caches:
+        return
+    _registered_caches.add(name)
+
+    def collect():
+        stats = cache.stats()
+        labels = {"cache": name}
+        yield "cache_hits_total", "counter", "Попадания в кэш", [(labels, stats["hits"])]
+        yield "cache_misses_total", "counter", "Промахи кэша", [(labels, stats["misses"])]
+        yield "cache_invalidations_total", "counter", "Инвалидации кэша", [(labels, stats["invalidations"])]
+        yield "cache_hit_ratio", "gauge", "Доля попаданий в кэш", [(labels, stats["hit_rate"])]
+    registry.register_collector(collect)
+
+
+def _caller() -> str:
+    """Ближайший к запросу кадр из кода приложения (не SQLAlchemy и не этот модуль)"""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(_BACKEND_DIR) and not frame.filename.endswith("metrics.py"):
+            return f"{os.path.relpath(frame.filename, _BACKEND_DIR)}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+def instrument_engine(engine, slow_query_ms: Optional[float] = None):
+    """Считать запросы движка, их длительность и писать медленные в лог slow_query"""
+    threshold = (SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms) / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        db_queries_total.inc(operation)
+        db_query_duration.observe(elapsed, operation)
+
+        unit = current_unit.get()
+        if unit is not None:
+            unit["queries"] += 1
+            unit["db_seconds"] += elapsed
+
+        if elapsed >= threshold:
+            db_slow_queries_total.inc(operation)
+            slow_query_logger.warning(
+                f"{elapsed * 1000:.1f} ms at {_caller()}: {' '.join(statement.split())}"
+            )
+
+
+def _begin_unit() -> Tuple[dict, contextvars.Token]:
+    unit = {"queries": 0, "db_seconds": 0.0}
+    return unit, current_unit.set(unit)
+
+
+def _warn_queries(kind: str, name: str, unit: dict):
+    if unit["queries"] > REQUEST_QUERY_WARN:
+        logger.warning(f"{kind} {name}: {unit['queries']} запросов к БД (порог {REQUEST_QUERY_WARN}) — возможен N+1")
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность, число запросов и время в БД по маршрутам API"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        unit, token = _begin_unit()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_unit.reset(token)
+            route = scope.get("route")
+            # Шаблон пути, а не сам путь: /api/stats/{user_id}, а не /api/stats/42
+            path = getattr(route, "path", "unmatched")
+            http_request_duration.observe(elapsed, scope["method"], path, str(status["code"]))
+            http_request_db_queries.observe(unit["queries"], path)
+            http_request_db_seconds.observe(unit["db_seconds"], path)
+            _warn_queries(scope["method"], path, unit)
+
+
+def instrument_handler(handler):
+    """Обёртка обработчика PTB: длительность, число запросов и время в БД"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        unit, token = _begin_unit()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(*args, **kwargs)
+            status = "ok"
+            return result
+        finally:
+            current_unit.reset(token)
+            bot_handler_duration.observe(time.perf_counter() - started, name, status)
+            bot_handler_db_queries.observe(unit["queries"], name)
+            bot_handler_db_seconds.observe(unit["db_seconds"], name)
+            _warn_queries("handler", name, unit)
+
+    return wrapper
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Отдавать /metrics отдельным HTTP-сервером в фоновом потоке (для бота)"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
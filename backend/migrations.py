@@ -0,0 +1,336 @@
+"""Версионные миграции схемы.
+
+Base.metadata.create_all создаёт только отсутствующие таблицы, поэтому всё,
+что меняет уже существующие таблицы (индексы, новые колонки), оформляется
+миграцией. Применённые версии хранятся в таблице schema_version. Миграции
+должны быть идемпотентными: на свежей базе create_all уже создал актуальную
+схему, и миграция лишь фиксирует версию.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+# Произвольный ключ advisory-блокировки PostgreSQL, чтобы API и бот,
+# стартуя одновременно, не применяли миграции параллельно
+_PG_LOCK_KEY = 7301
+
+
+def migration(version: int, description: str):
+    """Зарегистрировать функцию migrate(conn) как миграцию с номером version"""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(c['name'] == column for c in inspect(conn).get_columns(table))
+
+
+@migration(1, "indexes for per-user lookups and the transaction feed")
+def _add_hot_path_indexes(conn):
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_accounts_user_id ON accounts (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_categories_user_id ON categories (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_account_id ON transactions (account_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_id_created_at ON transactions (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_id_type ON transactions (user_id, type)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(2, "backfill monthly_rollups from transactions")
+def _backfill_monthly_rollups(conn):
+    # Схема с category_id: сводку по ней заполняет миграция 7. Это касается и
+    # базы, где create_all уже создал monthly_rollups в новом виде рядом со
+    # старой transactions.category
+    if not has_column(conn, "transactions", "category") or not has_column(conn, "monthly_rollups", "category"):
+        return
+    if conn.dialect.name == "postgresql":
+        month = "to_char(created_at, 'YYYY-MM')"
+    else:
+        month = "strftime('%Y-%m', created_at)"
+    conn.execute(text("DELETE FROM monthly_rollups"))
+    conn.execute(text(
+        "INSERT INTO monthly_rollups (user_id, account_id, category, type, month, total, transactions_count) "
+        f"SELECT user_id, COALESCE(account_id, 0), category, type, {month}, SUM(amount), COUNT(*) "
+        "FROM transactions WHERE user_id IS NOT NULL "
+        f"GROUP BY user_id, COALESCE(account_id, 0), category, type, {month}"
+    ))
+
+
+@migration(3, "users.data_version for ETag")
+def _add_user_data_version(conn):
+    if not has_column(conn, "users", "data_version"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+
+
+@migration(4, "row versions for incremental sync")
+def _add_row_versions(conn):
+    for table in ("accounts", "categories", "transactions"):
+        if not has_column(conn, table, "version"):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_user_id_version ON {table} (user_id, version)"))
+
+
+@migration(5, "backfill ledger_entries from transactions and balances")
+def _backfill_ledger(conn):
+    # Операции проводятся на дату операции; остаток, который ими не объясняется
+    # (начальный баланс, ручные правки), — проводкой opening на дату создания счёта
+    signed = "CASE WHEN t.type = 'EXPENSE' THEN -t.amount ELSE t.amount END"
+    conn.execute(text("DELETE FROM ledger_entries"))
+    conn.execute(text(
+        "INSERT INTO ledger_entries (account_id, user_id, transaction_id, delta, reason, created_at) "
+        f"SELECT t.account_id, a.user_id, t.id, {signed}, 'transaction', COALESCE(t.created_at, CURRENT_TIMESTAMP) "
+        "FROM transactions t JOIN accounts a ON a.id = t.account_id WHERE a.user_id IS NOT NULL"
+    ))
+    conn.execute(text(
+        "INSERT INTO ledger_entries (account_id, user_id, transaction_id, delta, reason, created_at) "
+        "SELECT id, user_id, NULL, opening, 'opening', created_at FROM ("
+        "SELECT a.id, a.user_id, COALESCE(a.created_at, CURRENT_TIMESTAMP) AS created_at, "
+        # SQLite считает в double: округляем, чтобы не получить копеечные хвосты
+        f"ROUND(COALESCE(a.balance, 0) - COALESCE((SELECT SUM({signed}) FROM transactions t WHERE t.account_id = a.id), 0), 2) AS opening "
+        "FROM accounts a WHERE a.user_id IS NOT NULL"
+        ") balances WHERE opening <> 0"
+    ))
+
+
+@migration(6, "covering index on transactions for analytics by date range")
+def _widen_transactions_by_date_index(conn):
+    # Запросы аналитики читают только индекс, не обращаясь к строкам таблицы.
+    # На схеме с category_id индекс уже создан create_all или миграцией 7
+    if not has_column(conn, "transactions", "category"):
+        return
+    columns = ("user_id", "created_at", "account_id", "type", "category", "amount")
+    existing = {ix["name"]: tuple(ix["column_names"]) for ix in inspect(conn).get_indexes("transactions")}
+    if existing.get("ix_transactions_user_id_created_at") == columns:
+        return
+    conn.execute(text("DROP INDEX IF EXISTS ix_transactions_user_id_created_at"))
+    conn.execute(text(f"CREATE INDEX ix_transactions_user_id_created_at ON transactions ({', '.join(columns)})"))
+
+
+@migration(7, "transactions.category_id referencing categories instead of free-text category")
+def _normalize_categories(conn):
+    from categories import default_category
+    from database import MonthlyRollup, TransactionType
+
+    if not has_column(conn, "categories", "key"):
+        conn.execute(text("ALTER TABLE categories ADD COLUMN key VARCHAR(50)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_categories_user_id_type_key ON categories (user_id, type, key)"
+    ))
+    if not has_column(conn, "transactions", "category"):
+        return
+    if not has_column(conn, "transactions", "category_id"):
+        conn.execute(text("ALTER TABLE transactions ADD COLUMN category_id INTEGER REFERENCES categories (id)"))
+
+    # Строка с id своей категории пользователя (так Web App передаёт свои категории)
+    conn.execute(text(
+        "UPDATE transactions SET category_id = ("
+        "SELECT c.id FROM categories c "
+        "WHERE c.user_id = transactions.user_id AND CAST(c.id AS VARCHAR(20)) = transactions.category"
+        ") WHERE category_id IS NULL"
+    ))
+    # Остальные строки (ключи встроенных категорий, произвольные названия) — категории с ключом
+    existing = {
+        (user_id, type_, key)
+        for user_id, type_, key in conn.execute(text(
+            "SELECT user_id, type, key FROM categories WHERE key IS NOT NULL"
+        ))
+    }
+    rows = []
+    for user_id, type_, key in conn.execute(text(
+        "SELECT DISTINCT user_id, type, category FROM transactions "
+        "WHERE category_id IS NULL AND user_id IS NOT NULL AND category <> ''"
+    )):
+        if (user_id, type_, key) in existing:
+            continue
+        name, icon = default_category(TransactionType[type_], key)
+        rows.append({
+            "user_id": user_id, "key": key, "name": name, "icon": icon, "type": type_, "created_at": datetime.utcnow()
+        })
+    if rows:
+        conn.execute(text(
+            "INSERT INTO categories (user_id, key, name, icon, type, created_at, version) "
+            "VALUES (:user_id, :key, :name, :icon, :type, :created_at, 0)"
+        ), rows)
+    conn.execute(text(
+        "UPDATE transactions SET category_id = ("
+        "SELECT c.id FROM categories c WHERE c.user_id = transactions.user_id "
+        "AND c.type = transactions.type AND c.key = transactions.category"
+        ") WHERE category_id IS NULL"
+    ))
+
+    # Сводка становится по category_id: первичный ключ не изменить ALTER-ом, пересоздаём
+    conn.execute(text("DROP TABLE monthly_rollups"))
+    MonthlyRollup.__table__.create(conn, checkfirst=True)
+    if conn.dialect.name == "postgresql":
+        month = "to_char(created_at, 'YYYY-MM')"
+    else:
+        month = "strftime('%Y-%m', created_at)"
+    conn.execute(text(
+        "INSERT INTO monthly_rollups (user_id, account_id, category_id, type, month, total, transactions_count) "
+        f"SELECT user_id, COALESCE(account_id, 0), COALESCE(category_id, 0), type, {month}, SUM(amount), COUNT(*) "
+        "FROM transactions WHERE user_id IS NOT NULL "
+        f"GROUP BY user_id, COALESCE(account_id, 0), COALESCE(category_id, 0), type, {month}"
+    ))
+
+    # SQLite удаляет колонку, только если она не входит в индексы
+    conn.execute(text("DROP INDEX IF EXISTS ix_transactions_user_id_created_at"))
+    conn.execute(text("ALTER TABLE transactions DROP COLUMN category"))
+    conn.execute(text(
+        "CREATE INDEX ix_transactions_user_id_created_at "
+        "ON transactions (user_id, created_at, account_id, type, category_id, amount)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transactions_category_id ON transactions (category_id)"))
+
+
+@migration(8, "transactions.idempotency_key for recurring transactions")
+def _add_idempotency_key(conn):
+    # Таблицы recurring_rules и user_reports создаёт create_all
+    if not has_column(conn, "transactions", "idempotency_key"):
+        conn.execute(text("ALTER TABLE transactions ADD COLUMN idempotency_key VARCHAR(100)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_transactions_idempotency_key ON transactions (idempotency_key)"
+    ))
+
+
+def _rebuild_with_autoincrement(conn, model):
+    """Пересоздать таблицу model в SQLite с AUTOINCREMENT, если его ещё нет.
+
+    Режим AUTOINCREMENT задаётся только в CREATE TABLE. Внешние ключи в SQLite
+    не включены, ссылки других таблиц по имени останутся верными.
+    """
+    from database import Account, Category, User
+
+    name = model.__tablename__
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    ).scalar()
+    if "AUTOINCREMENT" in sql.upper():
+        return
+    copy = MetaData()
+    for referenced in (User, Account, Category):
+        referenced.__table__.to_metadata(copy)
+    table = model.__table__.to_metadata(copy, name=f"{name}_rebuild")
+    columns = ", ".join(column.name for column in table.columns)
+    conn.execute(CreateTable(table))
+    conn.execute(text(f"INSERT INTO {name}_rebuild ({columns}) SELECT {columns} FROM {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    conn.execute(text(f"ALTER TABLE {name}_rebuild RENAME TO {name}"))
+    for index in model.__table__.indexes:
+        index.create(conn)
+
+
+def _seed_sequence(conn, name: str, top: int):
+    """Поднять счётчик AUTOINCREMENT таблицы name не ниже top"""
+    seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": name}).scalar()
+    if seq is None:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": name, "seq": top})
+    elif seq < top:
+        conn.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"), {"name": name, "seq": top})
+
+
+def _max_id(conn, *queries: str) -> int:
+    """Наибольшее из значений запросов SELECT MAX(...); пустые таблицы дают 0"""
+    return max(conn.execute(text(query)).scalar() or 0 for query in queries)
+
+
+@migration(9, "AUTOINCREMENT on transactions so deleted and archived ids are never reused")
+def _autoincrement_transactions(conn):
+    # В PostgreSQL id выдаёт последовательность, она значений не повторяет
+    if conn.dialect.name != "sqlite":
+        return
+    from archive import decode
+    from database import Transaction, TransactionArchive
+
+    _rebuild_with_autoincrement(conn, Transaction)
+    # Счётчик начинается выше всех выданных id: живых, удалённых (их помнят
+    # отметки синхронизации и журнал проводок) и перенесённых в архив
+    top = _max_id(
+        conn,
+        "SELECT MAX(id) FROM transactions",
+        "SELECT MAX(entity_id) FROM deleted_rows WHERE entity = 'transactions'",
+        "SELECT MAX(transaction_id) FROM ledger_entries",
+    )
+    for data, in conn.execute(select(TransactionArchive.data)):
+        top = max([top] + [row["id"] for row in decode(data)])
+    _seed_sequence(conn, "transactions", top)
+
+
+@migration(10, "AUTOINCREMENT on accounts and categories referenced by archived transactions")
+def _autoincrement_accounts_and_categories(conn):
+    # Архив хранит account_id и category_id: новый счёт или категория с id
+    # удалённых подхватили бы их заархивированные операции и итоги
+    if conn.dialect.name != "sqlite":
+        return
+    from archive import decode
+    from database import Account, Category, TransactionArchive
+
+    _rebuild_with_autoincrement(conn, Account)
+    _rebuild_with_autoincrement(conn, Category)
+    tops = {
+        "accounts": _max_id(
+            conn,
+            "SELECT MAX(id) FROM accounts",
+            "SELECT MAX(entity_id) FROM deleted_rows WHERE entity = 'accounts'",
+            "SELECT MAX(account_id) FROM ledger_entries",
+            "SELECT MAX(account_id) FROM archived_rollups",
+            "SELECT MAX(account_id) FROM recurring_rules",
+        ),
+        "categories": _max_id(
+            conn,
+            "SELECT MAX(id) FROM categories",
+            "SELECT MAX(entity_id) FROM deleted_rows WHERE entity = 'categories'",
+            "SELECT MAX(category_id) FROM archived_rollups",
+            "SELECT MAX(category_id) FROM recurring_rules",
+        ),
+    }
+    for data, in conn.execute(select(TransactionArchive.data)):
+        for row in decode(data):
+            tops["accounts"] = max(tops["accounts"], row["account_id"] or 0)
+            tops["categories"] = max(tops["categories"], row["category_id"] or 0)
+    for name, top in tops.items():
+        _seed_sequence(conn, name, top)
+
+
+
+@migration(11, "drop stored stats reports with amounts as strings")
+def _drop_string_reports(conn):
+    # Отчёты пересчитываются при первом чтении: суммы в них снова числа, как в /api/stats первого выпуска
+    conn.execute(text("DELETE FROM user_reports"))
+
+def current_version(conn) -> int:
+    versions = conn.execute(select(schema_version.c.version)).scalars().all()
+    return max(versions, default=0)
+
+
+def run_migrations(engine):
+    """Применить к базе все миграции новее записанной версии"""
+    metadata.create_all(bind=engine)
+
+    for version, description, fn in MIGRATIONS:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+            if version <= current_version(conn):
+                continue
+            logger.info(f"Применяю миграцию {version}: {description}")
+            fn(conn)
+            conn.execute(schema_version.insert().values(version=version, description=description))
@@ -0,0 +1,275 @@
+"""Запись операций — общий сервис для API и бота.
+
+record_transactions() пишет пачку операций в текущей транзакции БД: версия
+данных, строки transactions, проводки по счетам и месячная сводка. Поверх
+неё GroupCommitter реализует групповой коммит: операции, пришедшие в
+течение нескольких миллисекунд, записываются одной транзакцией БД, а каждый
+вызывающий получает свой результат или свою ошибку.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+
+from sqlalchemy.orm import Session
+
+from categories import resolve_categories
+from database import Account, Transaction, TransactionType, User, bump_data_version
+from ledger import post_transaction
+from rollups import apply_rows
+from schemas import TransactionCreate
+
+logger = logging.getLogger(__name__)
+
+
+class AccountNotFound(LookupError):
+    """Счёт не существует или принадлежит другому пользователю"""
+
+
+def record_transactions(
+    db: Session,
+    requests: Sequence[TransactionCreate],
+    idempotency_keys: Optional[Sequence[Optional[str]]] = None
+) -> List[Union[dict, Exception]]:
+    """Записать операции без коммита. Возвращает по элементу на запрос.
+
+    idempotency_keys — ключи идемпотентности операций по порядку запросов:
+    операция с уже записанным ключом нарушит уникальный индекс при flush.
+
+    Элемент — словарь с данными записанной операции (id, user_id, account_id,
+    account_name, currency, type, amount, category — название категории,
+    category_id, version) или исключение,
+    если именно этот запрос некорректен; остальные запросы пачки при этом
+    записываются.
+    """
+    account_ids = {request.account_id for request in requests}
+    accounts = {
+        account_id: (user_id, name, currency)
+        for account_id, user_id, name, currency in db.query(
+            Account.id, Account.user_id, Account.name, User.currency
+        ).join(User, User.telegram_id == Account.user_id).filter(Account.id.in_(account_ids))
+    }
+
+    results = []
+    valid = []
+    for request in requests:
+        account = accounts.get(request.account_id)
+        if account is None or account[0] != request.user_id:
+            results.append(AccountNotFound("Account not found"))
+            continue
+        try:
+            type_ = TransactionType(request.type)
+        except ValueError:
+            results.append(ValueError(f"Unknown transaction type '{request.type}'"))
+            continue
+        results.append(None)
+        valid.append((len(results) - 1, request, type_))
+
+    # Версии выдаются в порядке user_id: пачки с несколькими пользователями
+    # блокируют их строки в одном порядке и не ждут друг друга по кругу
+    versions = {
+        user_id: bump_data_version(db, user_id)
+        for user_id in sorted({request.user_id for _, request, _ in valid})
+    }
+    categories = {
+        user_id: resolve_categories(
+            db, user_id, [(type_, request.category) for _, request, type_ in valid if request.user_id == user_id], version
+        )
+        for user_id, version in versions.items()
+    }
+    now = datetime.utcnow()
+    transactions = [
+        Transaction(
+            user_id=request.user_id,
+            account_id=request.account_id,
+            type=type_,
+            amount=request.amount,
+            category_ref=categories[request.user_id].get((type_, request.category)),
+            description=request.description,
+            created_at=request.created_at or now,
+            version=versions[request.user_id],
+            idempotency_key=idempotency_keys[index] if idempotency_keys else None
+        )
+        for index, request, type_ in valid
+    ]
+    db.add_all(transactions)
+    db.flush()
+
+    for transaction in transactions:
+        post_transaction(db, transaction, transaction.version)
+    apply_rows(db, [{
+        "user_id": t.user_id,
+        "account_id": t.account_id,
+        "category_id": t.category_id,
+        "type": t.type,
+        "amount": t.amount,
+        "created_at": t.created_at,
+    } for t in transactions])
+
+    for (index, request, type_), transaction in zip(valid, transactions):
+        _, account_name, currency = accounts[request.account_id]
+        results[index] = {
+            "id": transaction.id,
+            "user_id": request.user_id,
+            "account_id": request.account_id,
+            "account_name": account_name,
+            "currency": currency,
+            "type": type_,
+            "amount": request.amount,
+            "category": transaction.category_name,
+            "category_id": transaction.category_id,
+            "version": transaction.version,
+        }
+    return results
+
+
+def record_transaction(db: Session, request: TransactionCreate) -> dict:
+    """Записать одну операцию и закоммитить. Ошибка запроса пробрасывается"""
+    result = record_transactions(db, [request])[0]
+    if isinstance(result, Exception):
+        db.rollback()
+        raise result
+    db.commit()
+    return result
+
+
+class CommitMetrics:
+    """Размеры пакетов и длительность коммитов группового коммита"""
+
+    def __init__(self, window: int = 1000):
+        self.batches = 0
+        self.transactions = 0
+        self.max_batch_size = 0
+        self.fallbacks = 0
+        self._latencies = deque(maxlen=window)
+        self._sizes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, size: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.transactions += size
+            self.max_batch_size = max(self.max_batch_size, size)
+            self._sizes.append(size)
+            self._latencies.append(seconds * 1000)
+
+    def fallback(self):
+        """Учесть пакет, который пришлось повторить по одной операции"""
+        with self._lock:
+            self.fallbacks += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            sizes = list(self._sizes)
+            batches, transactions = self.batches, self.transactions
+            max_batch_size, fallbacks = self.max_batch_size, self.fallbacks
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(round(q / 100 * (len(latencies) - 1))))], 2)
+
+        return {
+            "batches": batches,
+            "transactions": transactions,
+            "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+            "max_batch_size": max_batch_size,
+            "fallbacks": fallbacks,
+            "commit_p50_ms": percentile(50),
+            "commit_p95_ms": percentile(95),
+            "commit_max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        }
+
+
+class GroupCommitter:
+    """Групповой коммит операций в пуле потоков.
+
+    Первая операция пакета ждёт попутчиков не дольше max_delay секунд, пакет
+    ограничен max_batch операциями. Пока пакет коммитится, новые операции
+    копятся в очереди и уходят следующим пакетом. Если коммит всего пакета
+    не удался, операции повторяются по одной, чтобы ошибка досталась только
+    её отправителю. on_commit(user_ids) вызывается после каждого коммита.
+    """
+
+    def __init__(self, session_factory, max_delay: float = 0.005, max_batch: int = 200,
+                 on_commit: Optional[Callable[[Iterable[int]], None]] = None):
+        self.session_factory = session_factory
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self.metrics = CommitMetrics()
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, request: TransactionCreate) -> dict:
+        """Поставить операцию в очередь и дождаться её коммита"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def close(self):
+        """Дописать очередь и остановить обработчик"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        self._worker = None
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                results = await asyncio.to_thread(self._commit, [request for request, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                self._queue.task_done()
+
+    def _commit(self, requests: List[TransactionCreate]) -> List[Union[dict, Exception]]:
+        started = time.perf_counter()
+        with self.session_factory() as db:
+            try:
+                results = record_transactions(db, requests)
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception(f"Групповой коммит {len(requests)} операций не удался, пишу по одной")
+                self.metrics.fallback()
+                results = []
+                for request in requests:
+                    try:
+                        results.append(record_transaction(db, request))
+                    except Exception as e:
+                        db.rollback()
+                        results.append(e)
+        self.metrics.observe(len(requests), time.perf_counter() - started)
+
+        if self.on_commit:
+            self.on_commit({r["user_id"] for r in results if not isinstance(r, Exception)})
+        return results
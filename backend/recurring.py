@@ -0,0 +1,121 @@
+"""Регулярные операции: правила RecurringRule и создание операций по ним.
+
+Повторение номер n правила приходится на start_at + n * interval периодов
+(day, week, month; в коротком месяце — на его последний день). Операция
+повторения пишется через recorder.record_transactions с ключом
+идемпотентности recurring:<id правила>:<n>: если планировщик упал после
+коммита или правило одновременно обрабатывают два процесса, уникальный
+индекс не даст создать операцию второй раз. После простоя materialize_due
+догоняет все пропущенные повторения с их датами.
+"""
+import calendar
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import RecurringRule, Transaction
+from recorder import AccountNotFound, record_transactions
+from schemas import TransactionCreate
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("day", "week", "month")
+
+# Сколько пропущенных повторений одного правила создаётся за проход; остальные — следующими проходами
+MAX_CATCH_UP = 400
+# Ключей в одном IN: SQLite ограничивает число параметров запроса
+KEY_LOOKUP_CHUNK = 500
+
+
+def occurrence(start_at: datetime, period: str, interval: int, n: int) -> datetime:
+    """Дата повторения номер n (с нуля)"""
+    if period == "day":
+        return start_at + timedelta(days=n * interval)
+    if period == "week":
+        return start_at + timedelta(weeks=n * interval)
+    months = start_at.month - 1 + n * interval
+    year, month = start_at.year + months // 12, months % 12 + 1
+    return start_at.replace(year=year, month=month, day=min(start_at.day, calendar.monthrange(year, month)[1]))
+
+
+def idempotency_key(rule_id: int, n: int) -> str:
+    return f"recurring:{rule_id}:{n}"
+
+
+def due_occurrences(rule: RecurringRule, now: datetime, limit: int = MAX_CATCH_UP) -> List[Tuple[int, datetime]]:
+    """Наступившие и ещё не созданные повторения правила: [(номер, дата)]"""
+    due = []
+    n = rule.runs
+    while len(due) < limit:
+        at = occurrence(rule.start_at, rule.period, rule.interval, n)
+        if at > now or (rule.end_at is not None and at > rule.end_at):
+            break
+        due.append((n, at))
+        n += 1
+    return due
+
+
+def materialize_due(db: Session, now: Optional[datetime] = None, batch_size: int = 200) -> Tuple[int, int, Set[int]]:
+    """Создать операции по правилам, у которых наступило повторение, и закоммитить.
+
+    Берёт не больше batch_size правил, все их операции пишутся одной
+    транзакцией БД. Возвращает (число правил, число операций, id
+    пользователей с новыми операциями); вызывать, пока правил не 0.
+    """
+    now = now or datetime.utcnow()
+    query = db.query(RecurringRule).filter(
+        RecurringRule.active.is_(True), RecurringRule.next_run_at <= now
+    ).order_by(RecurringRule.next_run_at, RecurringRule.id).limit(batch_size)
+    if db.get_bind().dialect.name == "postgresql":
+        # Параллельные планировщики (воркеры uvicorn) разбирают разные правила
+        query = query.with_for_update(skip_locked=True, of=RecurringRule)
+    rules = query.all()
+    if not rules:
+        return 0, 0, set()
+
+    pending = [(rule, n, at) for rule in rules for n, at in due_occurrences(rule, now)]
+    # Повторения, которые уже записал другой процесс
+    keys = [idempotency_key(rule.id, n) for rule, n, _ in pending]
+    existing = set()
+    for start in range(0, len(keys), KEY_LOOKUP_CHUNK):
+        existing.update(key for key, in db.query(Transaction.idempotency_key).filter(
+            Transaction.idempotency_key.in_(keys[start:start + KEY_LOOKUP_CHUNK])
+        ))
+    pending = [(rule, n, at) for rule, n, at in pending if idempotency_key(rule.id, n) not in existing]
+    results = record_transactions(db, [
+        TransactionCreate(
+            user_id=rule.user_id,
+            account_id=rule.account_id or 0,
+            type=rule.type.value,
+            amount=rule.amount,
+            category=str(rule.category_id or ""),
+            description=rule.description,
+            created_at=at
+        )
+        for rule, _, at in pending
+    ], [idempotency_key(rule.id, n) for rule, n, _ in pending]) if pending else []
+
+    failed, users, created = set(), set(), 0
+    for (rule, _, _), result in zip(pending, results):
+        if isinstance(result, AccountNotFound):
+            failed.add(rule.id)
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            users.add(rule.user_id)
+            created += 1
+
+    for rule in rules:
+        if rule.id in failed:
+            # Счёт правила удалён: операции больше некуда записывать
+            logger.warning(f"Правило {rule.id}: счёт {rule.account_id} не найден, правило выключено")
+            rule.active = False
+            continue
+        rule.runs += len(due_occurrences(rule, now))
+        rule.next_run_at = occurrence(rule.start_at, rule.period, rule.interval, rule.runs)
+        if rule.end_at is not None and rule.next_run_at > rule.end_at:
+            rule.active = False
+    db.commit()
+    return len(rules), created, users
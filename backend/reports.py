@@ -0,0 +1,92 @@
+"""Готовая статистика пользователей (user_reports).
+
+Ответ /stats (stats.compute_stats) хранится в JSON вместе с версией данных
+пользователя, для которой посчитан. Пока версия не изменилась, /stats в API
+и боте читает одну строку по первичному ключу; после записи статистика
+пересчитывается при первом чтении и сохраняется снова. Планировщик
+(scheduler.py) в нерабочие часы заранее пересчитывает устаревшие отчёты,
+чтобы утреннее чтение не ждало агрегатов.
+
+Суммы в отчёте — числа, как в ответе /api/stats первого выпуска (jsonable_encoder
+переводил Decimal во float), а не строки, как в остальных ответах API.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import User, UserReport, get_data_version
+from metrics import Counter, registry
+from serialization import dumps
+from stats import compute_stats
+
+report_reads_total = registry.register(Counter(
+    "stats_report_reads_total", "Чтения статистики: hit — готовый отчёт, miss — пересчёт", ["result"]
+))
+
+
+def _dumps_stats(user_stats: dict) -> str:
+    return dumps(user_stats, decimal_as_float=True).decode()
+
+
+def _store(db: Session, user_id: int, version: int, body: str):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(UserReport).values(
+        user_id=user_id, data_version=version, body=body, computed_at=datetime.utcnow()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"data_version": stmt.excluded.data_version, "body": stmt.excluded.body,
+              "computed_at": stmt.excluded.computed_at}
+    ))
+
+
+def refresh_report(db: Session, user_id: int, version: Optional[int] = None) -> str:
+    """Пересчитать и сохранить статистику пользователя (без коммита). Возвращает JSON"""
+    # Версия читается до агрегатов: при параллельной записи отчёт окажется
+    # новее своей версии и просто пересчитается при следующем чтении
+    if version is None:
+        version = get_data_version(db, user_id)
+    body = _dumps_stats(compute_stats(db, user_id))
+    _store(db, user_id, version, body)
+    return body
+
+
+def stats_body(db: Session, user_id: int) -> str:
+    """Статистика пользователя в JSON: готовый отчёт или пересчёт с сохранением"""
+    row = db.query(User.data_version, UserReport.data_version, UserReport.body).outerjoin(
+        UserReport, UserReport.user_id == User.telegram_id
+    ).filter(User.telegram_id == user_id).first()
+    if row is None:
+        # Пользователя ещё нет: сохранять отчёт не для кого
+        return _dumps_stats(compute_stats(db, user_id))
+    version, report_version, report = row
+    if report is not None and report_version == version:
+        report_reads_total.inc("hit")
+        return report
+    report_reads_total.inc("miss")
+    body = refresh_report(db, user_id, version)
+    db.commit()
+    return body
+
+
+def stale_users(db: Session, limit: int) -> List[int]:
+    """Пользователи без отчёта или с отчётом для старой версии данных"""
+    return [
+        user_id for user_id, in db.query(User.telegram_id).outerjoin(
+            UserReport, UserReport.user_id == User.telegram_id
+        ).filter(
+            or_(UserReport.user_id.is_(None), UserReport.data_version != User.data_version)
+        ).order_by(User.telegram_id).limit(limit)
+    ]
+
+
+def refresh_stale(db: Session, batch_size: int = 100) -> int:
+    """Пересчитать до batch_size устаревших отчётов и закоммитить. Возвращает их число"""
+    users = stale_users(db, batch_size)
+    for user_id in users:
+        refresh_report(db, user_id)
+    db.commit()
+    return len(users)
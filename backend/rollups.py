@@ -0,0 +1,192 @@
+"""Инкрементальное ведение monthly_rollups и его пересчёт из transactions.
+
+    python rollups.py rebuild [--user ID]   # пересчитать с нуля
+    python rollups.py verify [--user ID]    # сверить с transactions (код 1 при расхождении)
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import ArchivedRollup, MonthlyRollup, Transaction
+from stats import month_bucket
+
+KEY_COLUMNS = ["user_id", "account_id", "category_id", "type", "month"]
+
+# Операции без счёта (счёт удалён) учитываются под account_id = 0, без категории — под category_id = 0
+NO_ACCOUNT = 0
+NO_CATEGORY = 0
+
+
+def month_key(created_at: datetime) -> str:
+    return created_at.strftime('%Y-%m')
+
+
+def _upsert(db: Session, values: List[dict]):
+    """Прибавить total и transactions_count к строкам сводки (INSERT ... ON CONFLICT)"""
+    if not values:
+        return
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(MonthlyRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={
+            "total": MonthlyRollup.total + stmt.excluded.total,
+            "transactions_count": MonthlyRollup.transactions_count + stmt.excluded.transactions_count,
+        }
+    )
+    db.execute(stmt, values)
+
+    if any(v["transactions_count"] < 0 for v in values):
+        db.query(MonthlyRollup).filter(
+            MonthlyRollup.user_id.in_({v["user_id"] for v in values}),
+            MonthlyRollup.transactions_count <= 0
+        ).delete(synchronize_session=False)
+
+
+def apply_rows(db: Session, rows: Iterable[dict], sign: int = 1):
+    """Учесть в сводке операции-словари (user_id, account_id, category_id, type, amount, created_at).
+
+    sign=-1 вычитает операции. Строки группируются по ключу сводки заранее,
+    поэтому пакетный импорт делает один upsert на ключ, а не на операцию.
+    """
+    grouped = defaultdict(lambda: [Decimal("0"), 0])
+    for row in rows:
+        key = (
+            row["user_id"],
+            row["account_id"] or NO_ACCOUNT,
+            row["category_id"] or NO_CATEGORY,
+            row["type"],
+            month_key(row["created_at"]),
+        )
+        grouped[key][0] += sign * Decimal(row["amount"])
+        grouped[key][1] += sign
+
+    _upsert(db, [
+        dict(zip(KEY_COLUMNS, key), total=total, transactions_count=count)
+        for key, (total, count) in grouped.items()
+    ])
+
+
+def apply_transaction(db: Session, transaction: Transaction, sign: int = 1):
+    """Учесть (sign=1) или вычесть (sign=-1) одну операцию в сводке"""
+    apply_rows(db, [{
+        "user_id": transaction.user_id,
+        "account_id": transaction.account_id,
+        "category_id": transaction.category_id,
+        "type": transaction.type,
+        "amount": transaction.amount,
+        "created_at": transaction.created_at,
+    }], sign)
+
+
+def reassign(db: Session, user_id: int, column: str, old_id: int, new_id: int):
+    """Перенести строки сводки пользователя с account_id/category_id = old_id на new_id.
+
+    Удаление категории сливает её итоги с «без категории» и трогает только
+    её строки, не пересчитывая всю сводку пользователя.
+    """
+    key = getattr(MonthlyRollup, column)
+    condition = (MonthlyRollup.user_id == user_id) & (key == old_id)
+    rows = db.execute(select(
+        *(getattr(MonthlyRollup, name) for name in KEY_COLUMNS), MonthlyRollup.total, MonthlyRollup.transactions_count
+    ).where(condition)).all()
+    if not rows:
+        return
+    db.query(MonthlyRollup).filter(condition).delete(synchronize_session=False)
+    _upsert(db, [
+        dict(zip(KEY_COLUMNS, row[:5]), **{column: new_id}, total=row.total, transactions_count=row.transactions_count)
+        for row in rows
+    ])
+
+
+def _aggregate_query(db: Session, user_id: Optional[int] = None):
+    """Сводка по transactions вместе с итогами заархивированных операций (archive.py)"""
+    month = month_bucket(db, Transaction.created_at)
+    account = func.coalesce(Transaction.account_id, NO_ACCOUNT)
+    category = func.coalesce(Transaction.category_id, NO_CATEGORY)
+    live = select(
+        Transaction.user_id, account.label("account_id"), category.label("category_id"), Transaction.type,
+        month.label("month"), func.sum(Transaction.amount).label("total"),
+        func.count(Transaction.id).label("transactions_count")
+    ).where(Transaction.user_id.is_not(None)).group_by(
+        Transaction.user_id, account, category, Transaction.type, month
+    )
+    archived = select(
+        ArchivedRollup.user_id, ArchivedRollup.account_id, ArchivedRollup.category_id, ArchivedRollup.type,
+        ArchivedRollup.month, ArchivedRollup.total, ArchivedRollup.transactions_count
+    )
+    if user_id is not None:
+        live = live.where(Transaction.user_id == user_id)
+        archived = archived.where(ArchivedRollup.user_id == user_id)
+    rows = union_all(live, archived).subquery()
+    keys = [rows.c.user_id, rows.c.account_id, rows.c.category_id, rows.c.type, rows.c.month]
+    return select(*keys, func.sum(rows.c.total), func.sum(rows.c.transactions_count)).group_by(*keys)
+
+
+def rebuild(db: Session, user_id: Optional[int] = None):
+    """Пересчитать сводку из transactions и archived_rollups (для всех или одного пользователя)"""
+    delete = db.query(MonthlyRollup)
+    if user_id is not None:
+        delete = delete.filter(MonthlyRollup.user_id == user_id)
+    delete.delete(synchronize_session=False)
+
+    db.execute(MonthlyRollup.__table__.insert().from_select(
+        KEY_COLUMNS + ["total", "transactions_count"], _aggregate_query(db, user_id)
+    ))
+
+
+def verify(db: Session, user_id: Optional[int] = None) -> List[str]:
+    """Сравнить сводку с пересчётом из transactions. Возвращает список расхождений"""
+    expected = {
+        tuple(row[:5]): (Decimal(str(row[5])).quantize(Decimal("0.01")), row[6])
+        for row in db.execute(_aggregate_query(db, user_id))
+    }
+
+    stored_query = db.query(MonthlyRollup)
+    if user_id is not None:
+        stored_query = stored_query.filter(MonthlyRollup.user_id == user_id)
+    stored = {
+        (r.user_id, r.account_id, r.category_id, r.type, r.month):
+            (Decimal(str(r.total)).quantize(Decimal("0.01")), r.transactions_count)
+        for r in stored_query
+    }
+
+    problems = []
+    for key in sorted(expected.keys() | stored.keys(), key=str):
+        if expected.get(key) != stored.get(key):
+            problems.append(f"{key}: ожидалось {expected.get(key)}, в сводке {stored.get(key)}")
+    return problems
+
+
+def main():
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--user", type=int, default=None)
+    args = parser.parse_args()
+
+    SessionLocal = init_db()
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            rebuild(db, args.user)
+            db.commit()
+            print("Сводка monthly_rollups пересчитана")
+            return
+
+        problems = verify(db, args.user)
+        for problem in problems:
+            print(problem)
+        print(f"Расхождений: {len(problems)}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
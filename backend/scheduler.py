@@ -0,0 +1,102 @@
+"""Фоновый планировщик в процессе API: регулярные операции и отчёты.
+
+Каждые SCHEDULER_INTERVAL секунд создаёт операции по наступившим
+регулярным правилам (recurring.py) пачками по SCHEDULER_BATCH_SIZE правил.
+Раз в сутки, в час SCHEDULER_REPORTS_HOUR (UTC), пересчитывает устаревшие
+отчёты статистики (reports.py). Работа идёт в пуле потоков через
+run_in_session и не блокирует обработку запросов.
+
+Планировщик запускается из lifespan приложения API (api.py), поэтому с
+uvicorn --workers N их работает N: операции защищены ключами
+идемпотентности, а в PostgreSQL воркеры разбирают разные правила.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from database import run_in_session
+from metrics import Counter, registry
+from recurring import materialize_due
+from reports import refresh_stale
+
+logger = logging.getLogger(__name__)
+
+# 0 — планировщик выключен
+SCHEDULER_INTERVAL = float(os.environ.get("SCHEDULER_INTERVAL", "60"))
+SCHEDULER_BATCH_SIZE = int(os.environ.get("SCHEDULER_BATCH_SIZE", "200"))
+SCHEDULER_REPORTS_HOUR = int(os.environ.get("SCHEDULER_REPORTS_HOUR", "3"))
+
+scheduler_jobs_total = registry.register(Counter(
+    "scheduler_jobs_total", "Результаты работы планировщика", ["job"]
+))
+
+
+class Scheduler:
+    """Периодические задачи в asyncio-задаче рядом с приложением.
+
+    run_once() выполняет один проход и пригодна для ручного запуска;
+    on_commit(user_ids) вызывается с пользователями, у которых появились
+    операции, — чтобы сбросить кэш их данных.
+    """
+
+    def __init__(self, session_factory, interval: float = SCHEDULER_INTERVAL,
+                 batch_size: int = SCHEDULER_BATCH_SIZE, reports_hour: int = SCHEDULER_REPORTS_HOUR,
+                 on_commit: Optional[Callable[[Iterable[int]], None]] = None):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reports_hour = reports_hour
+        self.on_commit = on_commit
+        self._reports_date = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Планировщик: проход раз в {self.interval:g} с, отчёты в {self.reports_hour}:00 UTC")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        """Создать наступившие регулярные операции, а в час отчётов — пересчитать отчёты"""
+        now = now or datetime.utcnow()
+        result = {"rules": 0, "transactions": 0, "reports": 0}
+        while True:
+            rules, created, users = await run_in_session(
+                self.session_factory, materialize_due, now, self.batch_size
+            )
+            if not rules:
+                break
+            result["rules"] += rules
+            result["transactions"] += created
+            if users and self.on_commit:
+                self.on_commit(users)
+        scheduler_jobs_total.inc("recurring_transactions", amount=result["transactions"])
+
+        if now.hour == self.reports_hour and self._reports_date != now.date():
+            self._reports_date = now.date()
+            while True:
+                refreshed = await run_in_session(self.session_factory, refresh_stale, self.batch_size)
+                result["reports"] += refreshed
+                if refreshed < self.batch_size:
+                    break
+            scheduler_jobs_total.inc("reports", amount=result["reports"])
+            logger.info(f"Планировщик: пересчитано отчётов {result['reports']}")
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                result = await self.run_once()
+                if result["transactions"]:
+                    logger.info(f"Планировщик: создано регулярных операций {result['transactions']}")
+            except Exception:
+                # Например, конфликт с планировщиком другого воркера: повторим следующим проходом
+                logger.exception("Проход планировщика не удался")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,132 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from datetime import datetime
+from decimal import Decimal
+
+class AccountCreate(BaseModel):
+    user_id: int
+    name: str
+    balance: Decimal = Decimal("0.00")
+
+class AccountUpdate(BaseModel):
+    name: Optional[str] = None
+    balance: Optional[Decimal] = None
+
+class TransactionCreate(BaseModel):
+    user_id: int
+    account_id: int
+    type: str
+    amount: Decimal
+    category: str
+    description: Optional[str] = ""
+    # Для импорта истории из выписки; по умолчанию — текущее время
+    created_at: Optional[datetime] = None
+
+class TransactionUpdate(BaseModel):
+    amount: Optional[Decimal] = None
+    category: Optional[str] = None
+    description: Optional[str] = None
+    account_id: Optional[int] = None
+
+class CategoryCreate(BaseModel):
+    user_id: int
+    name: str
+    icon: str = '📝'
+    type: str
+
+class CategoryUpdate(BaseModel):
+    name: Optional[str] = None
+    icon: Optional[str] = None
+
+class CategoryResponse(BaseModel):
+    id: int
+    # Ключ встроенной категории Web App (food, salary, ...); у своих категорий None
+    key: Optional[str] = None
+    name: str
+    icon: str
+    type: str
+
+    class Config:
+        from_attributes = True
+
+class AccountResponse(BaseModel):
+    id: int
+    name: str
+    balance: Decimal
+
+    class Config:
+        from_attributes = True
+
+class TransactionResponse(BaseModel):
+    id: int
+    type: str
+    amount: Decimal
+    # Категория в том виде, в котором её передаёт клиент: ключ или id строкой.
+    # None — категория операции удалена
+    category: Optional[str]
+    category_id: Optional[int]
+    category_name: Optional[str]
+    category_icon: Optional[str]
+    description: Optional[str]
+    # None — счёт операции удалён
+    account_id: Optional[int]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class TransactionPage(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str] = None
+
+class BulkTransactionCreate(BaseModel):
+    transactions: List[TransactionCreate]
+
+class DeletedIds(BaseModel):
+    accounts: List[int] = []
+    transactions: List[int] = []
+    categories: List[int] = []
+
+class ChangeSet(BaseModel):
+    """Изменения данных пользователя после версии клиента (см. changes.py)"""
+    data_version: int
+    # True — разницу отдать нельзя, клиент перечитывает данные целиком
+    reset: bool = False
+    accounts: List[AccountResponse] = []
+    transactions: List[TransactionResponse] = []
+    categories: List[CategoryResponse] = []
+    deleted: DeletedIds = DeletedIds()
+
+class BulkImportResponse(ChangeSet):
+    imported: int
+
+class RecurringRuleCreate(BaseModel):
+    user_id: int
+    account_id: int
+    type: str
+    amount: Decimal
+    category: str
+    description: Optional[str] = ""
+    period: Literal["day", "week", "month"] = "month"
+    interval: int = Field(1, ge=1)
+    # Дата первой операции; по умолчанию — сейчас
+    start_at: Optional[datetime] = None
+    end_at: Optional[datetime] = None
+
+class RecurringRuleResponse(BaseModel):
+    id: int
+    account_id: Optional[int]
+    type: str
+    amount: Decimal
+    category: Optional[str]
+    category_id: Optional[int]
+    description: Optional[str]
+    period: str
+    interval: int
+    start_at: datetime
+    end_at: Optional[datetime]
+    next_run_at: datetime
+    active: bool
+
+    class Config:
+        from_attributes = True
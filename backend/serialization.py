@@ -0,0 +1,36 @@
+"""Сериализация ответов API в JSON через orjson.
+
+Decimal отдаются строками ("10.00"), как и в ответах со схемой pydantic,
+datetime — в ISO 8601, Enum — значением. Статистика (/api/stats) с первого
+выпуска отдаёт суммы числами: для неё dumps вызывается с decimal_as_float. Списки выбираются кортежами
+колонок (listing.py) и сериализуются напрямую: без загрузки ORM-объектов,
+проверки каждой строки схемой pydantic и обхода jsonable_encoder.
+"""
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _default_float(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return _default(value)
+
+
+def dumps(content: Any, decimal_as_float: bool = False) -> bytes:
+    return orjson.dumps(content, default=_default_float if decimal_as_float else _default)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse с сериализацией через orjson и Decimal строками"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
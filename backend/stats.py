@@ -0,0 +1,310 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import func, case, literal, null, select, union_all
+from sqlalchemy.orm import Session
+
+from categories import key_expression
+from database import Account, ArchivedRollup, Category, MonthlyRollup, Transaction, TransactionArchive, TransactionType
+
+ZERO = Decimal("0.00")
+
+PERIODS = ("day", "week", "month")
+
+# Диапазон аналитики по умолчанию (до текущего момента) и ограничение числа периодов в ответе
+DEFAULT_RANGE = {"day": timedelta(days=31), "week": timedelta(weeks=26), "month": timedelta(days=365)}
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 28}
+MAX_BUCKETS = 400
+
+
+def month_bucket(db: Session, column):
+    """SQL-выражение 'YYYY-MM' для колонки с датой с учётом диалекта БД"""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def period_bucket(db: Session, column, period: str):
+    """SQL-выражение 'YYYY-MM-DD' начала дня, недели (с понедельника) или месяца"""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.to_char(func.date_trunc(period, column), "YYYY-MM-DD")
+    # SQLAlchemy хранит DateTime в SQLite строкой 'YYYY-MM-DD HH:MM:SS.ffffff':
+    # день и месяц — её префикс, что заметно дешевле strftime на каждой строке
+    if period == "day":
+        return func.substr(column, 1, 10)
+    if period == "week":
+        # 'weekday 0' сдвигает на ближайшее воскресенье (или оставляет его), минус 6 дней — понедельник
+        return func.date(column, "weekday 0", "-6 days")
+    return func.substr(column, 1, 7).concat("-01")
+
+
+def _month_start(at: datetime, months: int = 0) -> datetime:
+    """Начало месяца, отстоящего от месяца at на months"""
+    index = at.year * 12 + at.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def archived_until(db: Session, user_id: int) -> Optional[datetime]:
+    """Начало месяца после последнего заархивированного (archive.py) или None, если архива нет"""
+    newest = db.query(func.max(TransactionArchive.month)).filter(TransactionArchive.user_id == user_id).scalar()
+    if newest is None:
+        return None
+    return _month_start(datetime.strptime(newest, "%Y-%m"), 1)
+
+
+def _money(value) -> Decimal:
+    if value is None:
+        return ZERO
+    return Decimal(str(value)).quantize(ZERO)
+
+
+def compute_stats(db: Session, user_id: int) -> dict:
+    """Посчитать статистику пользователя агрегатными запросами на стороне БД"""
+    accounts = db.query(Account.id, Account.name, Account.balance).filter(
+        Account.user_id == user_id
+    ).order_by(Account.id).all()
+
+    # Агрегаты читаются из месячной сводки (rollups.py): O(месяцев × категорий)
+    # строк вместо всех операций пользователя
+    rollup = db.query(MonthlyRollup).filter(MonthlyRollup.user_id == user_id)
+    income = func.sum(case((MonthlyRollup.type == TransactionType.INCOME, MonthlyRollup.total), else_=0))
+    expense = func.sum(case((MonthlyRollup.type == TransactionType.EXPENSE, MonthlyRollup.total), else_=0))
+
+    by_type = {t.value: {"total": ZERO, "count": 0} for t in TransactionType}
+    for type_, total, count in rollup.with_entities(
+        MonthlyRollup.type, func.sum(MonthlyRollup.total), func.sum(MonthlyRollup.transactions_count)
+    ).group_by(MonthlyRollup.type):
+        by_type[type_.value] = {"total": _money(total), "count": count}
+
+    account_flows = {
+        account_id: (_money(income_total), _money(expense_total))
+        for account_id, income_total, expense_total in rollup.with_entities(
+            MonthlyRollup.account_id, income, expense
+        ).group_by(MonthlyRollup.account_id)
+    }
+
+    # Группировка по целочисленному category_id; название и значок берутся
+    # из categories, операции удалённых категорий идут одной строкой с id None
+    by_category = [
+        {
+            "category": key,
+            "category_id": category_id,
+            "name": name,
+            "icon": icon,
+            "type": type_.value,
+            "total": _money(total),
+            "count": count,
+        }
+        for category_id, key, name, icon, type_, total, count in rollup.outerjoin(
+            Category, Category.id == MonthlyRollup.category_id
+        ).with_entities(
+            Category.id, key_expression(), Category.name, Category.icon, MonthlyRollup.type,
+            func.sum(MonthlyRollup.total), func.sum(MonthlyRollup.transactions_count)
+        ).group_by(
+            Category.id, MonthlyRollup.type
+        ).order_by(func.sum(MonthlyRollup.total).desc())
+    ]
+
+    by_month = [
+        {"month": month, "income": _money(income_total), "expense": _money(expense_total), "count": count}
+        for month, income_total, expense_total, count in rollup.with_entities(
+            MonthlyRollup.month, income, expense, func.sum(MonthlyRollup.transactions_count)
+        ).group_by(MonthlyRollup.month).order_by(MonthlyRollup.month)
+    ]
+
+    return {
+        "total_balance": sum((_money(acc.balance) for acc in accounts), ZERO),
+        "total_income": by_type[TransactionType.INCOME.value]["total"],
+        "total_expense": by_type[TransactionType.EXPENSE.value]["total"],
+        "accounts_count": len(accounts),
+        "transactions_count": sum(item["count"] for item in by_type.values()),
+        "by_type": by_type,
+        "accounts": [
+            {
+                "id": acc.id,
+                "name": acc.name,
+                "balance": _money(acc.balance),
+                "income": account_flows.get(acc.id, (ZERO, ZERO))[0],
+                "expense": account_flows.get(acc.id, (ZERO, ZERO))[1],
+            }
+            for acc in accounts
+        ],
+        "by_category": by_category,
+        "by_month": by_month,
+    }
+
+
+def compute_analytics(
+    db: Session,
+    user_id: int,
+    period: str = "month",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> dict:
+    """Доходы и расходы по дням, неделям или месяцам в диапазоне [date_from, date_to).
+
+    Итоги по периодам, по категориям и по счетам считаются группировкой в БД
+    одним запросом. Баланс на конец периода — баланс на date_to (текущий
+    баланс минус движение после date_to) минус оконная сумма движения в
+    следующих периодах, поэтому операции до date_from не читаются. Периоды
+    без операций не выдаются.
+
+    Заархивированные месяцы (archive.py) известны только помесячными итогами
+    archived_rollups: диапазон, который их задевает, считается по месяцам, и
+    его границы расширяются до целых месяцев (ответ содержит фактические
+    date_from и date_to); по дням и неделям такой диапазон не считается.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    date_to = date_to or datetime.utcnow()
+    date_from = date_from or date_to - DEFAULT_RANGE[period]
+    if date_from >= date_to:
+        raise ValueError("date_from must be earlier than date_to")
+    until = archived_until(db, user_id)
+    archived = until is not None and date_from < until
+    if archived:
+        if period != "month":
+            raise ValueError(
+                f"Date range reaches archived months (before {until:%Y-%m}); use period 'month' for them"
+            )
+        date_from = _month_start(date_from)
+        if date_to != _month_start(date_to):
+            date_to = _month_start(date_to, 1)
+    if (date_to - date_from).days / PERIOD_DAYS[period] > MAX_BUCKETS:
+        raise ValueError(f"Date range is too long for period '{period}' (max {MAX_BUCKETS} periods)")
+
+    # Операции диапазона читаются один раз: сгруппированные по периоду, счёту,
+    # категории и типу, они материализуются в CTE, из которого считаются все три среза
+    bucket = period_bucket(db, Transaction.created_at, period).label("bucket")
+    flows = select(
+        bucket, Transaction.account_id, Transaction.category_id, Transaction.type,
+        func.sum(Transaction.amount).label("total"), func.count().label("count")
+    ).where(
+        Transaction.user_id == user_id,
+        Transaction.created_at >= date_from,
+        Transaction.created_at < date_to
+    ).group_by(bucket, Transaction.account_id, Transaction.category_id, Transaction.type)
+    # Месяц archived_rollups — то же 'YYYY-MM-01', что и period_bucket; 0 в ключе
+    # сводки (rollups.NO_ACCOUNT, NO_CATEGORY) — удалённый счёт или категория
+    archived_account = func.nullif(ArchivedRollup.account_id, 0)
+    if archived:
+        flows = union_all(flows, select(
+            (ArchivedRollup.month + "-01").label("bucket"), archived_account.label("account_id"),
+            func.nullif(ArchivedRollup.category_id, 0).label("category_id"), ArchivedRollup.type,
+            func.sum(ArchivedRollup.total).label("total"), func.sum(ArchivedRollup.transactions_count).label("count")
+        ).where(
+            ArchivedRollup.user_id == user_id,
+            ArchivedRollup.month >= f"{date_from:%Y-%m}",
+            ArchivedRollup.month < f"{date_to:%Y-%m}"
+        ).group_by(ArchivedRollup.month, ArchivedRollup.account_id, ArchivedRollup.category_id, ArchivedRollup.type))
+    flows = flows.cte("flows")
+
+    is_income = flows.c.type == TransactionType.INCOME
+    income = func.sum(case((is_income, flows.c.total), else_=0)).label("income")
+    expense = func.sum(case((is_income, 0), else_=flows.c.total)).label("expense")
+    count = func.sum(flows.c.count).label("count")
+    # Операции удалённых счетов (account_id IS NULL) в балансы не входят
+    net = func.sum(case(
+        (flows.c.account_id.is_(None), 0), (is_income, flows.c.total), else_=-flows.c.total
+    )).label("net")
+
+    # Движение по счетам после конца диапазона
+    signed = case((Transaction.type == TransactionType.INCOME, Transaction.amount), else_=-Transaction.amount)
+    moved = select(
+        Transaction.account_id, func.sum(signed).label("net")
+    ).where(
+        Transaction.user_id == user_id,
+        Transaction.created_at >= date_to,
+        Transaction.account_id.isnot(None)
+    ).group_by(Transaction.account_id)
+    if archived:
+        # Движение заархивированных месяцев после date_to (граница — начало месяца)
+        archived_signed = case(
+            (ArchivedRollup.type == TransactionType.INCOME, ArchivedRollup.total), else_=-ArchivedRollup.total
+        )
+        movements = union_all(moved, select(
+            archived_account.label("account_id"), func.sum(archived_signed).label("net")
+        ).where(
+            ArchivedRollup.user_id == user_id,
+            ArchivedRollup.month >= f"{date_to:%Y-%m}",
+            archived_account.isnot(None)
+        ).group_by(ArchivedRollup.account_id)).subquery()
+        moved = select(
+            movements.c.account_id, func.sum(movements.c.net).label("net")
+        ).group_by(movements.c.account_id)
+    moved = moved.subquery()
+    closing = (
+        select(func.coalesce(func.sum(Account.balance), 0)).where(Account.user_id == user_id).scalar_subquery()
+        - select(func.coalesce(func.sum(moved.c.net), 0)).scalar_subquery()
+    )
+    account_closing = Account.balance - func.coalesce(moved.c.net, 0)
+
+    totals = select(flows.c.bucket, income, expense, count, net).group_by(flows.c.bucket).subquery()
+    accounts = select(
+        flows.c.bucket, flows.c.account_id, income, expense, count, net
+    ).where(flows.c.account_id.isnot(None)).group_by(flows.c.bucket, flows.c.account_id).subquery()
+
+    def later(subquery, **partition):
+        # Движение в следующих периодах: баланс на конец периода = баланс на date_to минус оно
+        return func.coalesce(func.sum(subquery.c.net).over(order_by=subquery.c.bucket, rows=(1, None), **partition), 0)
+
+    # Типы колонок объединения берутся из первого SELECT, поэтому срез по категориям идёт первым.
+    # Операции удалённых категорий (category_id IS NULL) собираются в одну строку с id None
+    rows = db.execute(union_all(
+        select(
+            literal("category").label("kind"), flows.c.bucket, Category.id.label("id"), Category.name.label("name"),
+            key_expression().label("key"), Category.icon.label("icon"),
+            flows.c.type, income, expense, count, null().label("balance")
+        ).select_from(flows).outerjoin(
+            Category, Category.id == flows.c.category_id
+        ).group_by(flows.c.bucket, Category.id, flows.c.type),
+        select(
+            literal("total"), totals.c.bucket, null(), null(), null(), null(), null(),
+            totals.c.income, totals.c.expense, totals.c.count, closing - later(totals)
+        ),
+        select(
+            literal("account"), accounts.c.bucket, accounts.c.account_id, Account.name, null(), null(), null(),
+            accounts.c.income, accounts.c.expense, accounts.c.count,
+            account_closing - later(accounts, partition_by=accounts.c.account_id)
+        ).join(
+            Account, Account.id == accounts.c.account_id
+        ).outerjoin(moved, moved.c.account_id == accounts.c.account_id)
+    ).order_by("kind", "bucket", "id"))
+
+    buckets, by_category, by_account = [], [], []
+    for row in rows:
+        income_total, expense_total = _money(row.income), _money(row.expense)
+        if row.kind == "category":
+            by_category.append({
+                "bucket": row.bucket,
+                "category": row.key,
+                "category_id": row.id,
+                "name": row.name,
+                "icon": row.icon,
+                "type": row.type.value,
+                "total": income_total + expense_total,
+                "count": row.count,
+            })
+            continue
+        item = {"bucket": row.bucket}
+        if row.kind == "account":
+            item.update(account_id=row.id, account_name=row.name)
+        item.update(
+            income=income_total,
+            expense=expense_total,
+            net=income_total - expense_total,
+            count=row.count,
+            balance=_money(row.balance),
+        )
+        (by_account if row.kind == "account" else buckets).append(item)
+    by_category.sort(key=lambda item: (item["bucket"], -item["total"]))
+
+    return {
+        "period": period,
+        "date_from": date_from,
+        "date_to": date_to,
+        "buckets": buckets,
+        "by_category": by_category,
+        "by_account": by_account,
+    }
@@ -0,0 +1,39 @@
+"""Общие настройки тестов: временная база SQLite и модули backend в sys.path.
+
+api и bot читают настройки окружения при импорте, поэтому переменные
+задаются здесь, до первого импорта. Все тесты работают с одной базой и
+разводят данные по разным telegram_id.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tests.db')}"
+os.environ["SCHEDULER_INTERVAL"] = "0"
+os.environ["RATE_LIMIT_PER_SECOND"] = "0"
+# Пустые значения, а не отсутствие: load_dotenv не подставит их из .env разработчика
+os.environ["BOT_WEBHOOK_SECRET"] = ""
+os.environ["CACHE_URL"] = ""
+
+_telegram_ids = itertools.count(100_000)
+
+
+@pytest.fixture(scope="session")
+def client():
+    import api
+    from fastapi.testclient import TestClient
+
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.fixture
+def telegram_id():
+    """Новый пользователь на каждый тест: данные тестов в общей базе не пересекаются"""
+    return next(_telegram_ids)
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import api
+from database import get_data_version
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Задержать первое чтение из БД после gate.armed.set(), пока тест не откроет gate.release"""
+    gate = SimpleNamespace(armed=threading.Event(), started=threading.Event(), release=threading.Event(), loads=0)
+
+    def hold(load):
+        def wrapper(*args, **kwargs):
+            result = load(*args, **kwargs)
+            if gate.armed.is_set():
+                gate.loads += 1
+                if not gate.started.is_set():
+                    gate.started.set()
+                    gate.release.wait(5)
+            return result
+        return wrapper
+
+    monkeypatch.setattr(api, "load_user_data", hold(api.load_user_data))
+    monkeypatch.setattr(api, "load_stats", hold(api.load_stats))
+    return gate
+
+
+def etag_version(response: httpx.Response) -> int:
+    return int(response.headers["ETag"].rstrip('"').rsplit("-", 1)[-1])
+
+
+async def read_around_write(telegram_id: int, path: str, gate) -> tuple:
+    """Чтение A начато до записи, чтение B — после её коммита, пока A ещё идёт"""
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        response = await http.get(f"/api/user/{telegram_id}")
+        account_id = response.json()["accounts"][0]["id"]
+
+        # Как после записи с другого устройства: кэш пуст, чтение идёт в БД
+        api.invalidate_user_data(telegram_id)
+        gate.armed.set()
+        first = asyncio.ensure_future(http.get(path))
+        assert await asyncio.get_running_loop().run_in_executor(None, gate.started.wait, 5)
+        response = await http.post("/api/transactions", json={
+            "user_id": telegram_id, "account_id": account_id, "type": "expense", "amount": "5.00", "category": "food"
+        })
+        response.raise_for_status()
+        second = asyncio.ensure_future(http.get(path))
+        await asyncio.sleep(0.05)
+        gate.release.set()
+        return await first, await second, response.json()["data_version"]
+
+
+@pytest.mark.parametrize("path, telegram_id", [("/api/user/{}", 9001), ("/api/stats/{}", 9002)])
+def test_read_after_write_does_not_join_earlier_read(gate, path, telegram_id):
+    first, second, written = asyncio.run(read_around_write(telegram_id, path.format(telegram_id), gate))
+
+    assert etag_version(first) < written
+    assert etag_version(second) == written
+    # Чтение после записи сходило в БД само, а не дождалось начатого до неё
+    assert gate.loads == 2
+
+
+def test_read_started_before_write_is_not_cached(gate):
+    telegram_id = 9003
+    asyncio.run(read_around_write(telegram_id, f"/api/user/{telegram_id}", gate))
+    cached = api.user_cache.get(api.user_key(telegram_id))
+    with api.SessionLocal() as db:
+        assert cached is None or cached["version"] == get_data_version(db, telegram_id)
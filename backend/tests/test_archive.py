@@ -0,0 +1,81 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import api
+import ledger
+import rollups
+from archive import add_months, archive, archive_month, decode, horizon
+from database import Transaction, TransactionArchive, bump_data_version
+
+# Середина месяца 30 месяцев назад: операции теста не расходятся по двум месяцам
+OLD = horizon(30) + timedelta(days=14)
+
+
+def add_transactions(client, telegram_id: int, dates) -> tuple:
+    """Счёт пользователя и id операций, записанных датами dates"""
+    account_id = client.get(f"/api/user/{telegram_id}").json()["accounts"][0]["id"]
+    ids = []
+    for created_at in dates:
+        response = client.post("/api/transactions", json={
+            "user_id": telegram_id, "account_id": account_id, "type": "expense", "amount": "12.50",
+            "category": "food", "created_at": created_at.isoformat(),
+        })
+        response.raise_for_status()
+        ids.append(response.json()["transactions"][0]["id"])
+    return account_id, ids
+
+
+def test_archive_keeps_totals_and_notifies_clients(client, telegram_id):
+    account_id, ids = add_transactions(client, telegram_id, [OLD, OLD + timedelta(hours=1), datetime.utcnow()])
+    before = client.get(f"/api/user/{telegram_id}")
+    invalidated = []
+
+    def on_commit(user_ids):
+        invalidated.extend(user_ids)
+        for user_id in user_ids:
+            api.invalidate_user_data(user_id)
+
+    with api.SessionLocal() as db:
+        moved = archive(db, horizon(24), telegram_id, on_commit)
+        assert sum(count for *_, count in moved) == 2
+        assert not rollups.verify(db, telegram_id)
+        assert not ledger.verify(db, telegram_id)
+
+    assert invalidated == [telegram_id]
+    after = client.get(f"/api/user/{telegram_id}", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    changes = client.get(f"/api/user/{telegram_id}/changes", params={"since": before.json()["data_version"]}).json()
+    assert sorted(changes["deleted"]["transactions"]) == ids[:2]
+
+    # Лента по-прежнему отдаёт все операции, а новые id не совпадают с архивными
+    page = client.get(f"/api/transactions/{telegram_id}").json()
+    assert sorted(item["id"] for item in page["items"]) == ids
+    _, [new_id] = add_transactions(client, telegram_id, [datetime.utcnow()])
+    assert new_id > max(ids)
+
+
+def test_archive_month_waits_for_concurrent_delete(client, telegram_id):
+    """Удаление операции, закоммиченное во время архивации, не попадает в архив"""
+    _, ids = add_transactions(client, telegram_id, [OLD, OLD + timedelta(hours=1)])
+    month = OLD.strftime("%Y-%m")
+    start = datetime.strptime(month, "%Y-%m")
+
+    with api.SessionLocal() as writer:
+        # Запись через API держит блокировку пользователя до коммита
+        bump_data_version(writer, telegram_id)
+        writer.query(Transaction).filter(Transaction.id == ids[0]).delete(synchronize_session=False)
+
+        def run():
+            with api.SessionLocal() as db:
+                archive_month(db, telegram_id, month, start, add_months(start, 1))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.3)
+        writer.commit()
+    thread.join(10)
+
+    with api.SessionLocal() as db:
+        archived = decode(db.get(TransactionArchive, (telegram_id, month)).data)
+    assert [row["id"] for row in archived] == ids[1:]
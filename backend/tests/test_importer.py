@@ -0,0 +1,59 @@
+import asyncio
+import csv
+import io
+from types import SimpleNamespace
+
+import api
+import bot
+from export import CSV_HEADER
+
+
+def backup_csv(*rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def document_update(telegram_id: int, content: bytes, replies: list):
+    async def download_as_bytearray():
+        return bytearray(content)
+
+    async def get_file():
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    message = SimpleNamespace(document=SimpleNamespace(get_file=get_file), reply_text=reply_text)
+    return SimpleNamespace(message=message, effective_message=message, effective_user=SimpleNamespace(id=telegram_id))
+
+
+def test_backup_import_reports_created_accounts_in_changes(client, telegram_id):
+    since = client.get(f"/api/user/{telegram_id}").json()["data_version"]
+    text = backup_csv(
+        ["", "expense", "10.00", "food", "Карта", "", "2024-01-05T10:00:00"],
+        ["", "income", "25.00", "salary", "Основной", "", "2024-01-06T10:00:00"],
+    )
+    with api.SessionLocal() as db:
+        assert bot.import_backup(db, telegram_id, text) == 2
+
+    changes = client.get(f"/api/user/{telegram_id}/changes", params={"since": since}).json()
+    assert "Карта" in {account["name"] for account in changes["accounts"]}
+    assert len(changes["transactions"]) == 2
+
+
+def test_import_document_replies_when_csv_is_broken(telegram_id):
+    replies = []
+    # Поле длиннее предела модуля csv: reader бросает csv.Error, а не ValueError
+    content = backup_csv(["", "expense", "1.00", "food", "Основной", "x" * 200_000, "2024-01-05T10:00:00"]).encode()
+    asyncio.run(bot.import_document(document_update(telegram_id, content, replies), SimpleNamespace(user_data={})))
+    assert len(replies) == 1 and replies[0].startswith("❌")
+
+
+def test_import_document_replies_on_unknown_type(telegram_id):
+    replies = []
+    content = backup_csv(["", "transfer", "1.00", "food", "Основной", "", "2024-01-05T10:00:00"]).encode()
+    asyncio.run(bot.import_document(document_update(telegram_id, content, replies), SimpleNamespace(user_data={})))
+    assert len(replies) == 1 and replies[0].startswith("❌")
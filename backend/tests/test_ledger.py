@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import api
+import ledger
+from database import Account, LedgerEntry, bump_data_version
+
+
+def account_of(client, telegram_id: int) -> int:
+    return client.get(f"/api/user/{telegram_id}").json()["accounts"][0]["id"]
+
+
+def test_concurrent_posts_do_not_lose_updates(client, telegram_id):
+    account_id = account_of(client, telegram_id)
+    count, rounds = 8, 25
+    barrier = threading.Barrier(count)
+
+    def worker():
+        barrier.wait()
+        for _ in range(rounds):
+            with api.SessionLocal() as db:
+                ledger.post(db, telegram_id, account_id, Decimal("0.10"), ledger.ADJUSTMENT)
+                db.commit()
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with api.SessionLocal() as db:
+        # 200 × 0.10 ровно 20.00: сумма не проходит через float
+        assert db.get(Account, account_id).balance == Decimal("20.00")
+        assert db.query(LedgerEntry).filter(LedgerEntry.account_id == account_id).count() == count * rounds
+        assert not ledger.verify(db, telegram_id)
+
+
+def test_post_sets_account_version_only_when_given(client, telegram_id):
+    account_id = account_of(client, telegram_id)
+    with api.SessionLocal() as db:
+        before = db.get(Account, account_id).version
+        ledger.post(db, telegram_id, account_id, Decimal("5.00"), ledger.ADJUSTMENT)
+        db.commit()
+        assert db.get(Account, account_id).version == before
+
+        version = bump_data_version(db, telegram_id)
+        ledger.post(db, telegram_id, account_id, Decimal("-2.50"), ledger.ADJUSTMENT, version)
+        db.commit()
+        account = db.get(Account, account_id)
+        assert (account.balance, account.version) == (Decimal("2.50"), version)
+
+
+def test_transaction_edits_keep_balance_in_step_with_ledger(client, telegram_id):
+    first = account_of(client, telegram_id)
+    second = client.post("/api/accounts", json={"user_id": telegram_id, "name": "Вклад"}).json()["accounts"][-1]["id"]
+    created = client.post("/api/transactions", json={
+        "user_id": telegram_id, "account_id": first, "type": "expense", "amount": "30.00", "category": "food"
+    }).json()["transactions"][0]
+
+    # Перенос на другой счёт со сменой суммы: сторно на старом счёте, проводка на новом
+    client.put(f"/api/transactions/{created['id']}", json={"account_id": second, "amount": "45.00"}).raise_for_status()
+    with api.SessionLocal() as db:
+        assert db.get(Account, first).balance == Decimal("0.00")
+        assert db.get(Account, second).balance == Decimal("-45.00")
+        assert not ledger.verify(db, telegram_id)
+
+    client.delete(f"/api/transactions/{created['id']}").raise_for_status()
+    with api.SessionLocal() as db:
+        assert db.get(Account, second).balance == Decimal("0.00")
+        assert not ledger.verify(db, telegram_id)
+
+
+def test_balance_at_reads_history(client, telegram_id):
+    account_id = account_of(client, telegram_id)
+    start = datetime.utcnow() - timedelta(days=10)
+    with api.SessionLocal() as db:
+        for days, delta in ((0, "100.00"), (5, "-40.00")):
+            ledger.post(db, telegram_id, account_id, Decimal(delta), ledger.ADJUSTMENT)
+            db.flush()
+            db.query(LedgerEntry).filter(LedgerEntry.account_id == account_id, LedgerEntry.delta == Decimal(delta)).update(
+                {LedgerEntry.created_at: start + timedelta(days=days)}, synchronize_session=False
+            )
+        db.commit()
+
+        assert ledger.balance_at(db, account_id, start - timedelta(days=1)) == Decimal("0.00")
+        assert ledger.balance_at(db, account_id, start + timedelta(days=1)) == Decimal("100.00")
+        assert ledger.balance_at(db, account_id) == Decimal("60.00")
+        assert not ledger.verify(db, telegram_id)
@@ -0,0 +1,98 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+
+import ledger
+import migrations
+import rollups
+from benchmarks.upgrade_bench import seed_legacy
+from database import Account, Base, Category, Transaction, TransactionType, init_db
+
+
+@pytest.fixture
+def legacy_url():
+    """Пустая база SQLite с данными в схеме первого выпуска"""
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'legacy.db')}"
+    engine = create_engine(url)
+    expected = seed_legacy(engine, user_count=3, transaction_count=50)
+    engine.dispose()
+    return url, expected
+
+
+def test_upgrade_from_first_release(legacy_url):
+    url, expected = legacy_url
+    SessionLocal = init_db(url)
+    with SessionLocal() as db:
+        conn = db.connection()
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+        # Миграция 7: категории операций — ссылки на categories, старой колонки нет
+        assert not migrations.has_column(conn, "transactions", "category")
+        assert db.query(func.count(Transaction.id)).scalar() == expected["transactions"]
+        assert db.query(Transaction.id).filter(Transaction.category_id.is_(None)).first() is None
+        assert db.scalar(select(func.sum(Account.balance))) == expected["balance"]
+        assert not rollups.verify(db)
+        assert not ledger.verify(db)
+        # Миграция 8: ключ идемпотентности регулярных операций уникален
+        indexes = {index["name"]: index for index in inspect(conn).get_indexes("transactions")}
+        assert indexes["ix_transactions_idempotency_key"]["unique"]
+
+
+def test_autoincrement_migrations_do_not_reuse_deleted_ids(legacy_url, monkeypatch):
+    """База на версии 8 без AUTOINCREMENT: удалённые последними id не выдаются снова после 9 и 10"""
+    url, _ = legacy_url
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    all_migrations = list(migrations.MIGRATIONS)
+    monkeypatch.setattr(migrations, "MIGRATIONS", [m for m in all_migrations if m[0] <= 8])
+    migrations.run_migrations(engine)
+
+    deleted = {}
+    with engine.begin() as conn:
+        for table, entity in (("transactions", "transactions"), ("accounts", "accounts"), ("categories", "categories")):
+            top = conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar()
+            user_id = conn.execute(text(f"SELECT user_id FROM {table} WHERE id = :id"), {"id": top}).scalar()
+            conn.execute(text(f"DELETE FROM {table} WHERE id = :id"), {"id": top})
+            # Удаление через API оставляет отметку для /changes
+            conn.execute(text(
+                "INSERT INTO deleted_rows (user_id, entity, entity_id, version) VALUES (:user_id, :entity, :id, 1)"
+            ), {"user_id": user_id, "entity": entity, "id": top})
+            deleted[table] = top
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", all_migrations)
+    migrations.run_migrations(engine)
+    with engine.begin() as conn:
+        assert migrations.current_version(conn) == all_migrations[-1][0]
+        for table in deleted:
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"), {"name": table}).scalar()
+            assert "AUTOINCREMENT" in sql.upper()
+        # Индексы пересозданных таблиц на месте
+        assert "ix_transactions_user_id_created_at" in {ix["name"] for ix in inspect(conn).get_indexes("transactions")}
+        assert "ix_categories_user_id_type_key" in {ix["name"] for ix in inspect(conn).get_indexes("categories")}
+
+        account_id = conn.execute(Account.__table__.insert().values(user_id=1, name="new", version=0)).inserted_primary_key[0]
+        category_id = conn.execute(Category.__table__.insert().values(
+            user_id=1, name="new", type=TransactionType.EXPENSE, version=0
+        )).inserted_primary_key[0]
+        transaction_id = conn.execute(Transaction.__table__.insert().values(
+            user_id=1, account_id=account_id, type=TransactionType.EXPENSE, amount=1, category_id=category_id, version=0
+        )).inserted_primary_key[0]
+    engine.dispose()
+
+    assert account_id > deleted["accounts"]
+    assert category_id > deleted["categories"]
+    assert transaction_id > deleted["transactions"]
+
+
+def test_new_account_and_category_get_fresh_ids(client, telegram_id):
+    client.get(f"/api/user/{telegram_id}")
+    for path, body in (
+        ("accounts", {"user_id": telegram_id, "name": "temp"}),
+        ("categories", {"user_id": telegram_id, "name": "temp", "icon": "🧪", "type": "expense"}),
+    ):
+        created = client.post(f"/api/{path}", json=body).json()[path]
+        top = max(row["id"] for row in created)
+        client.delete(f"/api/{path}/{top}").raise_for_status()
+        again = client.post(f"/api/{path}", json=body).json()[path]
+        assert max(row["id"] for row in again) > top
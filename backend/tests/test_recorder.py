@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from decimal import Decimal
+
+import api
+import ledger
+import recorder
+import rollups
+from database import Account
+from recorder import AccountNotFound, CommitMetrics, GroupCommitter
+from schemas import TransactionCreate
+
+
+def account_of(client, telegram_id: int) -> int:
+    return client.get(f"/api/user/{telegram_id}").json()["accounts"][0]["id"]
+
+
+def expense(telegram_id: int, account_id: int, amount: str = "1.00") -> TransactionCreate:
+    return TransactionCreate(user_id=telegram_id, account_id=account_id, type="expense", amount=amount, category="food")
+
+
+async def submit_all(committer: GroupCommitter, requests) -> list:
+    try:
+        return await asyncio.gather(*(committer.submit(request) for request in requests), return_exceptions=True)
+    finally:
+        await committer.close()
+
+
+def test_group_commit_batches_concurrent_submits(client, telegram_id):
+    account_id = account_of(client, telegram_id)
+    committed = []
+    committer = GroupCommitter(api.SessionLocal, max_delay=0.05, on_commit=committed.extend)
+
+    results = asyncio.run(submit_all(committer, [expense(telegram_id, account_id) for _ in range(50)]))
+
+    assert len({result["id"] for result in results}) == 50
+    stats = committer.metrics.stats()
+    assert stats["transactions"] == 50 and stats["batches"] < 50
+    assert set(committed) == {telegram_id}
+    with api.SessionLocal() as db:
+        assert db.get(Account, account_id).balance == Decimal("-50.00")
+        assert not ledger.verify(db, telegram_id)
+        assert not rollups.verify(db, telegram_id)
+
+
+def test_group_commit_error_reaches_only_its_sender(client, telegram_id):
+    account_id = account_of(client, telegram_id)
+    committer = GroupCommitter(api.SessionLocal, max_delay=0.05)
+    requests = [expense(telegram_id, account_id) for _ in range(5)]
+    requests.insert(2, expense(telegram_id, account_id=10 ** 9))
+
+    results = asyncio.run(submit_all(committer, requests))
+
+    assert isinstance(results[2], AccountNotFound)
+    assert all(isinstance(result, dict) for i, result in enumerate(results) if i != 2)
+
+
+def test_group_commit_falls_back_to_single_commits(client, telegram_id, monkeypatch):
+    account_id = account_of(client, telegram_id)
+    record_transactions = recorder.record_transactions
+
+    def fail_batches(db, requests):
+        if len(requests) > 1:
+            raise RuntimeError("batch failed")
+        return record_transactions(db, requests)
+
+    monkeypatch.setattr(recorder, "record_transactions", fail_batches)
+    committer = GroupCommitter(api.SessionLocal, max_delay=0.05)
+
+    results = asyncio.run(submit_all(committer, [expense(telegram_id, account_id) for _ in range(5)]))
+
+    assert all(isinstance(result, dict) for result in results)
+    assert committer.metrics.stats()["fallbacks"] >= 1
+    with api.SessionLocal() as db:
+        assert db.get(Account, account_id).balance == Decimal("-5.00")
+
+
+def test_commit_metrics_count_from_many_threads():
+    count = 8
+    metrics = CommitMetrics()
+    barrier = threading.Barrier(count)
+
+    def worker():
+        barrier.wait()
+        for _ in range(2000):
+            metrics.fallback()
+            metrics.observe(2, 0.001)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = metrics.stats()
+    assert stats["fallbacks"] == count * 2000
+    assert stats["batches"] == count * 2000
+    assert stats["transactions"] == count * 4000
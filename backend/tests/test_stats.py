@@ -0,0 +1,22 @@
+import api
+import bot
+
+
+def test_stats_amounts_are_numbers(client, telegram_id):
+    account_id = client.get(f"/api/user/{telegram_id}").json()["accounts"][0]["id"]
+    client.post("/api/transactions", json={
+        "user_id": telegram_id, "account_id": account_id, "type": "expense", "amount": "12.35", "category": "food"
+    }).raise_for_status()
+
+    # Второе чтение отдаёт сохранённый отчёт (reports.py) — в нём суммы тоже числа
+    for _ in range(2):
+        stats = client.get(f"/api/stats/{telegram_id}").json()
+        assert stats["total_expense"] == 12.35
+        assert stats["total_balance"] == -12.35
+        assert stats["accounts"][0]["balance"] == -12.35
+        assert stats["by_month"][0]["expense"] == 12.35
+        assert stats["by_category"][0]["total"] == 12.35
+
+    with api.SessionLocal() as db:
+        _, summary = bot.load_stats(db, telegram_id)
+    assert f"{summary['total_expense']:.2f}" == "12.35"
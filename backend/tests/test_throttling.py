@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+import pytest
+
+import throttling
+from throttling import RateLimiter, SingleFlight, create_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttling.time, "monotonic", clock)
+    return clock
+
+
+def test_rate_limiter_allows_burst_then_refills(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.acquire(1) for _ in range(3)] == [None, None, None]
+    assert limiter.acquire(1) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert limiter.acquire(1) is None
+    assert limiter.acquire(1) is not None
+
+
+def test_rate_limiter_keys_are_independent(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.acquire(1) is None
+    assert limiter.acquire(1) is not None
+    assert limiter.acquire(2) is None
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(rate=0, burst=1)
+    assert not limiter.enabled
+    assert all(limiter.acquire(1) is None for _ in range(100))
+
+
+def test_rate_limiter_prunes_only_full_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=2, max_keys=2)
+    limiter.acquire("idle")
+    clock.now += 10
+    limiter.acquire("busy")
+    limiter.acquire("busy")
+    limiter.acquire("new")
+    assert "idle" not in limiter._buckets
+    # Пустое ведро не забывается: иначе сброс ключей обходил бы лимит
+    assert limiter.acquire("busy") is not None
+
+
+def test_rate_limiter_threads_share_one_budget(clock):
+    limiter = RateLimiter(rate=1, burst=50)
+    granted = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        granted.extend(limiter.acquire(7) is None for _ in range(20))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(granted) == 50
+
+
+def test_create_limiter_shares_instance_per_settings():
+    assert create_limiter(5, 10) is create_limiter(5, 10)
+    assert create_limiter(5, 10) is not create_limiter(5, 11)
+
+
+def test_single_flight_runs_once_for_concurrent_calls():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("key", load) for _ in range(5)))
+        # Ключ освобождается по завершении: следующее чтение идёт в БД заново
+        return results, await flight.do("key", load)
+
+    results, after = asyncio.run(main())
+    assert results == [1] * 5
+    assert after == 2
+
+
+def test_single_flight_separates_keys():
+    flight = SingleFlight("test")
+
+    async def main():
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, result="a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, result="b")),
+        )
+
+    assert asyncio.run(main()) == ["a", "b"]
+
+
+def test_single_flight_error_reaches_every_waiter():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight._calls == {}
+
+
+def test_single_flight_survives_cancelled_caller():
+    flight = SingleFlight("test")
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0.02, result="done")))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0, result="other")))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
@@ -0,0 +1,111 @@
+"""Ограничение частоты запросов пользователя и объединение одинаковых чтений.
+
+RateLimiter — token bucket на пользователя: RATE_LIMIT_PER_SECOND токенов в
+секунду и запас RATE_LIMIT_BURST на всплеск. Им ограничиваются маршруты API
+(429 с Retry-After) и обработчики бота, ключ — telegram_id. Счётчики живут
+в памяти процесса: с uvicorn --workers N у каждого воркера свой лимит, а
+бот в режиме webhook делит ограничитель с API своего процесса.
+
+SingleFlight объединяет одновременные одинаковые чтения: пока первое
+выполняется, остальные с тем же ключом ждут его результата, а не идут в БД
+сами. Веб-приложение перечитывает данные после каждого действия и при
+перерисовке, поэтому такие всплески — обычное дело.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import Counter, registry
+
+throttled_requests_total = registry.register(Counter(
+    "throttled_requests_total", "Запросы, отклонённые ограничением частоты", ["source"]
+))
+coalesced_requests_total = registry.register(Counter(
+    "coalesced_requests_total", "Чтения, дождавшиеся уже выполняющегося такого же запроса", ["name"]
+))
+
+
+class RateLimiter:
+    """Token bucket на ключ: rate токенов в секунду, не больше burst.
+
+    Хранится (токены, время обновления) на ключ; когда ключей больше
+    max_keys, забываются те, чьё ведро за время простоя уже наполнилось.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: Hashable) -> Optional[float]:
+        """Взять токен. Возвращает None или через сколько секунд повторить запрос"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return None
+
+    def _prune(self, now: float):
+        idle = self.burst / self.rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < idle}
+
+
+# Ограничители по настройкам: API и бот в одном процессе (режим webhook) получают
+# один и тот же, и запросы пользователя из обоих расходуют общий лимит
+_limiters = {}
+
+
+def create_limiter(rate: float = None, burst: int = None) -> RateLimiter:
+    """Ограничитель по настройкам окружения: RATE_LIMIT_PER_SECOND (0 — без ограничения), RATE_LIMIT_BURST"""
+    rate = rate if rate is not None else float(os.environ.get("RATE_LIMIT_PER_SECOND", "10"))
+    burst = burst if burst is not None else int(os.environ.get("RATE_LIMIT_BURST", "30"))
+    key = (rate, burst)
+    if key not in _limiters:
+        _limiters[key] = RateLimiter(rate, burst)
+    return _limiters[key]
+
+
+class SingleFlight:
+    """Одно выполнение на ключ для одновременных вызовов в event loop.
+
+    Чтение выполняется отдельной задачей: если клиент, запустивший его,
+    отключится, остальные всё равно получат результат. Исключение чтения
+    получают все ожидающие.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            coalesced_requests_total.inc(self.name)
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибка уже передана ожидающим; если все отключились, не пишем её в лог как потерянную
+        if not task.cancelled():
+            task.exception()
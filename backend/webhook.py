@@ -0,0 +1,133 @@
+"""Приём обновлений Telegram через webhook на сервере API.
+
+С BOT_WEBHOOK_SECRET приложение API (api.py) поднимает бота у себя: маршрут
+BOT_WEBHOOK_PATH принимает обновления от Telegram, проверяет секретный
+токен из заголовка X-Telegram-Bot-Api-Secret-Token и ставит обновление в
+ограниченную очередь. Её разбирают BOT_CONCURRENT_UPDATES обработчиков, так
+что одновременно выполняется не больше стольких обработчиков бота. Если
+очередь заполнена дольше BOT_WEBHOOK_ENQUEUE_TIMEOUT секунд, маршрут
+отвечает 503: Telegram повторит доставку позже, а пока держит не больше
+max_connections запросов (BOT_WEBHOOK_MAX_CONNECTIONS) к каждому серверу.
+
+Каждый воркер uvicorn держит свою очередь и своё приложение PTB, поэтому
+воркеров можно запускать несколько.
+"""
+import asyncio
+import hmac
+import logging
+import os
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес сервера API, на который Telegram шлёт обновления (python bot.py webhook)
+WEBHOOK_URL = os.environ.get("BOT_WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("BOT_WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.environ.get("BOT_WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+QUEUE_SIZE = int(os.environ.get("BOT_WEBHOOK_QUEUE_SIZE", "1000"))
+ENQUEUE_TIMEOUT = float(os.environ.get("BOT_WEBHOOK_ENQUEUE_TIMEOUT", "1"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+webhook_updates_total = registry.register(Counter(
+    "telegram_webhook_updates_total", "Обновления, пришедшие на webhook", ["status"]
+))
+
+
+def check_secret(token: Optional[str], secret: str = None) -> bool:
+    """Совпадает ли секретный токен запроса с BOT_WEBHOOK_SECRET (сравнение за постоянное время)"""
+    secret = WEBHOOK_SECRET if secret is None else secret
+    if not token or not secret:
+        return False
+    return hmac.compare_digest(token.encode(), secret.encode())
+
+
+class TelegramWebhook:
+    """Ограниченная очередь обновлений перед приложением PTB.
+
+    submit() возвращается, как только обновление поставлено в очередь, —
+    ответ Telegram не ждёт обработчиков. Обработка идёт через
+    Application.process_update без Updater: приложение только
+    инициализируется (initialize), а не запускается (start).
+    """
+
+    def __init__(self, application: Application, workers: int = 32, queue_size: int = QUEUE_SIZE,
+                 enqueue_timeout: float = ENQUEUE_TIMEOUT):
+        self.application = application
+        self.workers = workers
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.processed = 0
+        self.failed = 0
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        await self.application.initialize()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Webhook: {self.workers} обработчиков, очередь на {self.queue_size} обновлений")
+
+    async def stop(self):
+        """Дообработать очередь, остановить обработчики и приложение"""
+        if self._queue is not None:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+        await self.application.shutdown()
+
+    async def submit(self, data: dict) -> bool:
+        """Поставить обновление в очередь. False — очередь переполнена, Telegram нужно ответить 503"""
+        update = Update.de_json(data, self.application.bot)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(update), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                webhook_updates_total.inc("rejected")
+                return False
+        webhook_updates_total.inc("accepted")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def _work(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.application.process_update(update)
+                self.processed += 1
+            except Exception:
+                # Ошибки обработчиков PTB передаёт своим error handlers; сюда доходят только прочие
+                self.failed += 1
+                logger.exception(f"Не удалось обработать обновление {update.update_id}")
+            finally:
+                self._queue.task_done()
+
+
+def register_webhook(webhook: TelegramWebhook):
+    """Отдавать в /metrics заполнение очереди webhook"""
+    def collect():
+        stats = webhook.stats()
+        yield "telegram_webhook_queue_depth", "gauge", "Обновления в очереди webhook", [({}, stats["queued"])]
+        yield "telegram_webhook_processed_total", "counter", "Обработанные обновления", [({}, stats["processed"])]
+        yield "telegram_webhook_failed_total", "counter", "Обновления, обработка которых упала", [({}, stats["failed"])]
+    registry.register_collector(collect)
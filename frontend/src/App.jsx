@@ -31,6 +31,9 @@ const DEFAULT_CATEGORIES = {
   ]
 }
 
+// Категория в запросах и в поле category операции: ключ встроенной категории или id своей
+const categoryValue = (cat) => String(cat.key ?? cat.id)
+
 const getStartOfMonth = (date) => {
   return new Date(date.getFullYear(), date.getMonth(), 1)
 }
@@ -99,38 +102,66 @@ function App() {
     }
   }
 
+  // Записи отвечают только изменёнными строками: применяем их к состоянию
+  // (сначала удаления, затем новые и изменённые строки) без полной перезагрузки
+  const applyChanges = (telegramId, changes) => {
+    if (changes.reset) {
+      fetchUserData(telegramId)
+      return
+    }
+    const merge = (rows, updated, deletedIds) => {
+      const replaced = new Set([...deletedIds, ...updated.map(row => row.id)])
+      return [...rows.filter(row => !replaced.has(row.id)), ...updated]
+    }
+    setUserData(prev => ({
+      ...prev,
+      data_version: changes.data_version,
+      accounts: merge(prev.accounts, changes.accounts, changes.deleted.accounts).sort((a, b) => a.id - b.id),
+      categories: merge(prev.categories, changes.categories, changes.deleted.categories),
+      transactions: merge(prev.transactions, changes.transactions, changes.deleted.transactions)
+        .sort((a, b) => new Date(b.created_at) - new Date(a.created_at) || b.id - a.id)
+    }))
+  }
+
+  // Версия наших данных: в ответ придут и чужие изменения после неё (например, от бота)
+  const withSince = (url) => (
+    userData?.data_version !== undefined ? `${url}?since=${userData.data_version}` : url
+  )
+
   const showSnackbar = (message, type = 'success') => {
     setSnackbar({ open: true, message, type })
     setTimeout(() => setSnackbar({ open: false, message: '', type: 'success' }), 3000)
   }
 
   const getAllCategories = useCallback((type) => {
-    const dbCategories = userData?.categories?.filter(c => c.type === type) || []
+    // Встроенные категории, которые сервер уже создал у пользователя, приходят с key — не дублируем их
+    const defaultIds = DEFAULT_CATEGORIES[type].map(c => c.id)
+    const dbCategories = userData?.categories?.filter(c => c.type === type && !defaultIds.includes(c.key)) || []
     return [...DEFAULT_CATEGORIES[type], ...dbCategories]
   }, [userData?.categories])
 
   const getCategoryIcon = useCallback((categoryId, type) => {
     const categories = getAllCategories(type)
-    const category = categories.find(c => String(c.id) === String(categoryId))
+    const category = categories.find(c => categoryValue(c) === String(categoryId))
     return category?.icon || '📝'
   }, [getAllCategories])
 
   const getCategoryName = useCallback((categoryId, type) => {
     const categories = getAllCategories(type)
-    const category = categories.find(c => String(c.id) === String(categoryId))
-    return category?.name || categoryId
+    const category = categories.find(c => categoryValue(c) === String(categoryId))
+    return category?.name || categoryId || 'Без категории'
   }, [getAllCategories])
 
   const addCustomCategory = async (userId, type, name, icon) => {
     try {
-      const response = await fetch(`${API_URL}/api/categories`, {
+      const response = await fetch(withSince(`${API_URL}/api/categories`), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ user_id: userId, name, icon, type })
       })
       if (response.ok) {
         showSnackbar('Категория добавлена!')
-        await fetchUserData(userId)
+        applyChanges(userId, await response.json())
       }
     } catch (error) {
       console.error('Ошибка добавления категории:', error)
@@ -140,10 +171,10 @@ function App() {
 
   const deleteCustomCategory = async (userId, categoryId) => {
     try {
-      const response = await fetch(`${API_URL}/api/categories/${categoryId}`, { method: 'DELETE' })
+      const response = await fetch(withSince(`${API_URL}/api/categories/${categoryId}`), { method: 'DELETE' })
       if (response.ok) {
         showSnackbar('Категория удалена!')
-        fetchUserData(userId)
+        applyChanges(userId, await response.json())
       }
     } catch (error) {
       console.error('Ошибка удаления категории:', error)
@@ -154,10 +185,10 @@ function App() {
   const deleteAccount = async (accountId, accountName) => {
     const userId = tg.initDataUnsafe?.user?.id || 123456789
     try {
-      const response = await fetch(`${API_URL}/api/accounts/${accountId}`, { method: 'DELETE' })
+      const response = await fetch(withSince(`${API_URL}/api/accounts/${accountId}`), { method: 'DELETE' })
       if (response.ok) {
         showSnackbar(`Счёт "${accountName}" удалён!`)
-        fetchUserData(userId)
+        applyChanges(userId, await response.json())
       }
     } catch (error) {
       console.error('Ошибка удаления счёта:', error)
@@ -169,10 +200,10 @@ function App() {
   const deleteTransaction = async (transactionId) => {
     const userId = tg.initDataUnsafe?.user?.id || 123456789
     try {
-      const response = await fetch(`${API_URL}/api/transactions/${transactionId}`, { method: 'DELETE' })
+      const response = await fetch(withSince(`${API_URL}/api/transactions/${transactionId}`), { method: 'DELETE' })
       if (response.ok) {
         showSnackbar('Операция удалена!')
-        fetchUserData(userId)
+        applyChanges(userId, await response.json())
       }
     } catch (error) {
       console.error('Ошибка удаления операции:', error)
@@ -192,7 +223,7 @@ function App() {
     if (activeModal === 'create_account') {
       if (!formData.name || !formData.balance) return
       try {
-        const response = await fetch(`${API_URL}/api/accounts`, {
+        const response = await fetch(withSince(`${API_URL}/api/accounts`), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({ user_id: userId, name: formData.name, balance: parseFloat(formData.balance) })
@@ -201,7 +232,7 @@ function App() {
           tg.sendData(JSON.stringify({ type: 'create_account', name: formData.name, balance: parseFloat(formData.balance) }))
           closeModal()
           showSnackbar('Счёт успешно создан!')
-          fetchUserData(userId)
+          applyChanges(userId, await response.json())
         }
       } catch (error) {
         console.error('Ошибка создания счёта:', error)
@@ -210,7 +241,7 @@ function App() {
     } else if (activeModal === 'expense' || activeModal === 'income') {
       if (!formData.amount || !formData.account_id || !formData.category) return
       try {
-        const response = await fetch(`${API_URL}/api/transactions`, {
+        const response = await fetch(withSince(`${API_URL}/api/transactions`), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -234,7 +265,7 @@ function App() {
           }))
           closeModal()
           showSnackbar(`Операция успешно ${activeModal === 'expense' ? 'создана' : 'создана'}!`)
-          fetchUserData(userId)
+          applyChanges(userId, await response.json())
         }
       } catch (error) {
         console.error('Ошибка создания транзакции:', error)
@@ -247,7 +278,7 @@ function App() {
     } else if (activeModal === 'edit_transaction' && editTransaction) {
       if (!formData.amount || !formData.category) return
       try {
-        const response = await fetch(`${API_URL}/api/transactions/${editTransaction.id}`, {
+        const response = await fetch(withSince(`${API_URL}/api/transactions/${editTransaction.id}`), {
           method: 'PUT',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -259,7 +290,7 @@ function App() {
         })
         if (response.ok) {
           showSnackbar('Операция обновлена!')
-          fetchUserData(userId)
+          applyChanges(userId, await response.json())
           closeModal()
         }
       } catch (error) {
@@ -279,9 +310,9 @@ function App() {
       setFormData({
         ...formData,
         amount: transaction.amount.toString(),
-        category: transaction.category,
+        category: transaction.category ?? '',
         description: transaction.description || '',
-        account_id: transaction.account_id.toString()
+        account_id: transaction.account_id?.toString() || ''
       })
     }
   }
@@ -324,14 +355,15 @@ function App() {
     })
     const expensesByCategory = {}
     filteredTransactions.forEach(t => {
-      expensesByCategory[t.category] = (expensesByCategory[t.category] || 0) + parseFloat(t.amount)
+      const key = t.category ?? ''
+      expensesByCategory[key] = (expensesByCategory[key] || 0) + parseFloat(t.amount)
     })
     const categoryIds = Object.keys(expensesByCategory)
     const customCategories = userData.categories?.filter(c => c.type === 'expense') || []
     const allCategoriesMap = {}
-    DEFAULT_CATEGORIES.expense.forEach(cat => { allCategoriesMap[String(cat.id)] = cat.name })
-    customCategories.forEach(cat => { allCategoriesMap[String(cat.id)] = cat.name })
-    const labels = categoryIds.map(id => allCategoriesMap[String(id)] || id)
+    DEFAULT_CATEGORIES.expense.forEach(cat => { allCategoriesMap[categoryValue(cat)] = cat.name })
+    customCategories.forEach(cat => { allCategoriesMap[categoryValue(cat)] = cat.name })
+    const labels = categoryIds.map(id => allCategoriesMap[id] || id || 'Без категории')
     return {
       labels,
       datasets: [{ data: Object.values(expensesByCategory), backgroundColor: ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', '#FF9F40', '#C9CBCF', '#4CAF50'] }]
@@ -479,7 +511,7 @@ function App() {
                   <div className="form-group"><label>Сумма</label><input type="number" name="amount" value={formData.amount} onChange={handleInputChange} placeholder="0.00" step="0.01" autoFocus /></div>
                   <div className="form-group"><label>Счёт</label><select name="account_id" value={formData.account_id} onChange={handleInputChange}>{userData?.accounts?.map(account => (<option key={account.id} value={account.id}>{account.name}</option>))}</select></div>
                 </div>
-                <div className="form-group"><label>Категория</label><select name="category" value={formData.category} onChange={handleInputChange}><option value="">Выберите категорию</option>{getAllCategories(editTransaction?.type).map(cat => (<option key={cat.id} value={cat.id}>{cat.icon} {cat.name}</option>))}</select></div>
+                <div className="form-group"><label>Категория</label><select name="category" value={formData.category} onChange={handleInputChange}><option value="">Выберите категорию</option>{getAllCategories(editTransaction?.type).map(cat => (<option key={cat.id} value={categoryValue(cat)}>{cat.icon} {cat.name}</option>))}</select></div>
                 <div className="form-group"><label>Описание</label><textarea name="description" value={formData.description} onChange={handleInputChange} placeholder="Комментарий к операции" /></div>
               </>
             ) : (
@@ -488,7 +520,7 @@ function App() {
                   <div className="form-group"><label>Сумма</label><input type="number" name="amount" value={formData.amount} onChange={handleInputChange} placeholder="0.00" step="0.01" autoFocus /></div>
                   <div className="form-group"><label>Счёт</label><select name="account_id" value={formData.account_id} onChange={handleInputChange}>{userData?.accounts?.map(account => (<option key={account.id} value={account.id}>{account.name}</option>))}</select></div>
                 </div>
-                <div className="form-group"><label>Категория</label><select name="category" value={formData.category} onChange={handleInputChange}><option value="">Выберите категорию</option>{getAllCategories(activeModal).map(cat => (<option key={cat.id} value={cat.id}>{cat.icon} {cat.name}</option>))}</select></div>
+                <div className="form-group"><label>Категория</label><select name="category" value={formData.category} onChange={handleInputChange}><option value="">Выберите категорию</option>{getAllCategories(activeModal).map(cat => (<option key={cat.id} value={categoryValue(cat)}>{cat.icon} {cat.name}</option>))}</select></div>
                 <div className="form-group"><label>Описание (необязательно)</label><textarea name="description" value={formData.description} onChange={handleInputChange} placeholder="Комментарий к операции" /></div>
               </>
             )}